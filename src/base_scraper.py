@@ -1,18 +1,57 @@
 # src/base_scraper.py
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional
 from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
 from datetime import datetime, timezone
 import logging
 from models import Doctor
+from data_processors import doctor_fingerprint
+from doctor_index import DoctorIndex
+from lookups import LOOKUP_ID_FIELDS, LookupCache
 
 logger = logging.getLogger(__name__)
 
+# Dialects with INSERT ... ON CONFLICT DO UPDATE
+_UPSERT_DIALECTS = {'sqlite', 'postgresql'}
+# Never rewritten by an upsert - the row keeps its own primary key and creation time
+_UPSERT_KEEP = {'id', 'doctolib_id', 'created_at'}
+
 class BaseDoctolibScraper(ABC):
     """Base class with common functionality for all scrapers"""
 
-    def save_doctor_to_db(self, doctor_dict: Dict, db: Session) -> bool:
-        """Common database saving logic used by all scrapers"""
+    # Optional ProviderArchive that keeps every raw provider entry
+    archive = None
+
+    def archive_providers(self, specialty: str, department_id: Optional[int], providers: List,
+                          encoded: bool = False):
+        """Keep a page's raw providers in the archive, if there is one - never fails the crawl
+
+        With encoded, providers are (doctolib_id, canonical JSON) pairs from provider_archive.encode_provider.
+        """
+        if self.archive is None or not providers:
+            return
+        try:
+            if encoded:
+                self.archive.add_encoded(specialty, department_id, providers)
+            else:
+                self.archive.add(specialty, department_id, providers)
+        except Exception as e:
+            logger.error(f"Could not archive {len(providers)} raw providers: {e}")
+
+    @property
+    def lookups(self) -> LookupCache:
+        """Specialty/sector/city ids for this scraper's saves, cached across pages"""
+        if getattr(self, '_lookups', None) is None:
+            self._lookups = LookupCache()
+        return self._lookups
+
+    def save_doctor_to_db(self, doctor_dict: Dict, db: Session, rebuild: bool = False) -> bool:
+        """Common database saving logic used by all scrapers
+
+        With rebuild, the doctor's content is rewritten but last_seen, is_active and
+        removed_at are left as they are - see save_doctors_bulk.
+        """
         try:
             # Remove any 'id' field that might conflict with primary key
             if 'id' in doctor_dict:
@@ -23,18 +62,29 @@ class BaseDoctolibScraper(ABC):
                 logger.error(f"No doctolib_id found in doctor_dict")
                 return False
             
+            doctor_dict['fingerprint'] = doctor_fingerprint(doctor_dict)
             existing_doctor = db.query(Doctor).filter(
                 Doctor.doctolib_id == doctolib_id
             ).first()
 
+            if existing_doctor and existing_doctor.fingerprint == doctor_dict['fingerprint']:
+                # Nothing changed since the last crawl - only record that we saw it again
+                if not rebuild:
+                    self._touch_last_seen([doctolib_id], db)
+                return True
+
+            self.lookups.resolve([doctor_dict], db)
             if existing_doctor:
                 # Update existing record
                 for key, value in doctor_dict.items():
                     if hasattr(existing_doctor, key) and not key.startswith('_'):
                         setattr(existing_doctor, key, value)
-                    existing_doctor.updated_at = datetime.now(timezone.utc)
-                    existing_doctor.last_name = datetime.now(timezone.utc)
-                    logger.info(f"Updated doctor: {doctor_dict.get('last_name', doctor_dict.get('organization_name', 'Unknown'))}")
+                existing_doctor.updated_at = datetime.now(timezone.utc)
+                if not rebuild:
+                    existing_doctor.last_seen = datetime.now(timezone.utc)
+                    existing_doctor.is_active = True
+                    existing_doctor.removed_at = None
+                logger.info(f"Updated doctor: {doctor_dict.get('last_name', doctor_dict.get('organization_name', 'Unknown'))}")
 
             else:
                 # Create new record
@@ -50,6 +100,133 @@ class BaseDoctolibScraper(ABC):
             db.rollback()
             return False
         
+    def save_doctors_bulk(self, doctor_dicts: Iterable[Dict], db: Session, batch_size: int = 500,
+                          index: Optional[DoctorIndex] = None, rebuild: bool = False) -> int:
+        """Upsert many extracted doctors with one INSERT ... ON CONFLICT(doctolib_id) DO UPDATE executemany per batch
+
+        Rows end up as save_doctor_to_db would leave them: new doctors get the model
+        defaults, changed ones get every provided field overwritten and a fresh
+        updated_at/last_seen, and ones whose fingerprint is unchanged only get last_seen.
+        Returns the number of doctors written.
+
+        With a preloaded DoctorIndex, unchanged doctors are found without querying the
+        database, and the index is kept up to date with what was written.
+
+        With rebuild (re-extracting stored data rather than crawling), nothing has been
+        seen: last_seen, is_active and removed_at are left alone, so doctors retired by
+        presence.mark_removed stay removed, and unchanged doctors are not touched.
+        """
+        dialect = db.get_bind().dialect.name
+        if dialect not in _UPSERT_DIALECTS:
+            # No portable upsert - keep the row-by-row path
+            return sum(self.save_doctor_to_db(doctor_dict, db, rebuild) for doctor_dict in doctor_dicts)
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+
+        columns = set(Doctor.__table__.columns.keys())
+        # One row per doctolib_id, last one wins like sequential saves would;
+        # PostgreSQL refuses to update the same row twice in one statement
+        rows = {}
+        for doctor_dict in doctor_dicts:
+            doctolib_id = doctor_dict.get('doctolib_id')
+            if not doctolib_id:
+                logger.error("No doctolib_id found in doctor_dict")
+                continue
+            rows[doctolib_id] = {key: value for key, value in doctor_dict.items() if key in columns and key != 'id'}
+        if not rows:
+            return 0
+
+        # Unchanged doctors only get last_seen bumped, instead of rewriting every column
+        for row in rows.values():
+            row['fingerprint'] = doctor_fingerprint(row)
+        if index is not None:
+            unchanged = [doctolib_id for doctolib_id, row in rows.items()
+                         if index.fingerprint(doctolib_id) == row['fingerprint']]
+        else:
+            unchanged = self._unchanged_ids(rows, db, batch_size)
+        saved = 0
+        if not rebuild:
+            for start in range(0, len(unchanged), batch_size):
+                saved += self._touch_last_seen(unchanged[start:start + batch_size], db)
+
+        # executemany needs the same keys on every row, so batch per key set
+        by_keys: Dict[frozenset, List[Dict]] = {}
+        changed = []
+        unchanged = set(unchanged)
+        for doctolib_id, row in rows.items():
+            if doctolib_id not in unchanged:
+                changed.append(row)
+        for row in changed:
+            by_keys.setdefault(frozenset(row), []).append(row)
+
+        for keys, group in by_keys.items():
+            for start in range(0, len(group), batch_size):
+                batch = group[start:start + batch_size]
+                written = self._upsert_batch(insert, batch, keys, db, rebuild)
+                saved += written
+                # Only trust the index with fingerprints that are known to be stored
+                if index is not None and written == len(batch):
+                    for row in batch:
+                        index.set(row['doctolib_id'], None, row['fingerprint'])
+        return saved
+
+    def _unchanged_ids(self, rows: Dict[str, Dict], db: Session, batch_size: int) -> List[str]:
+        """doctolib_ids whose stored fingerprint matches the freshly extracted record"""
+        doctolib_ids = list(rows)
+        unchanged = []
+        for start in range(0, len(doctolib_ids), batch_size):
+            stored = db.query(Doctor.doctolib_id, Doctor.fingerprint).filter(
+                Doctor.doctolib_id.in_(doctolib_ids[start:start + batch_size])
+            ).all()
+            unchanged.extend(
+                doctolib_id for doctolib_id, fingerprint in stored
+                if fingerprint is not None and fingerprint == rows[doctolib_id]['fingerprint']
+            )
+        return unchanged
+
+    def _touch_last_seen(self, doctolib_ids: List[str], db: Session) -> int:
+        """One UPDATE that marks doctors as seen now, leaving the rest of their row alone"""
+        if not doctolib_ids:
+            return 0
+        try:
+            db.query(Doctor).filter(Doctor.doctolib_id.in_(doctolib_ids)).update({
+                Doctor.last_seen: datetime.now(timezone.utc),
+                # Back in the results after having been marked removed
+                Doctor.is_active: True,
+                Doctor.removed_at: None,
+                # Keep updated_at meaning "content changed" - otherwise its onupdate would fire
+                Doctor.updated_at: Doctor.updated_at,
+            }, synchronize_session=False)
+            db.commit()
+            return len(doctolib_ids)
+        except Exception as e:
+            logger.error(f"Error marking {len(doctolib_ids)} doctors as seen: {e}")
+            db.rollback()
+            return 0
+
+    def _upsert_batch(self, insert, batch: List[Dict], keys: frozenset, db: Session, rebuild: bool = False) -> int:
+        now = datetime.now(timezone.utc)
+        # Per batch: new lookup rows are committed with it, or rolled back with it
+        self.lookups.resolve(batch, db)
+        keys = keys | LOOKUP_ID_FIELDS
+        # Rows go in as executemany parameters rather than a literal VALUES list, so the
+        # statement compiles once per key set and is then served from SQLAlchemy's cache
+        statement = insert(Doctor.__table__)
+        updates = {key: statement.excluded[key] for key in keys - _UPSERT_KEEP}
+        updates['updated_at'] = now
+        if not rebuild:
+            updates.update(last_seen=now, is_active=True, removed_at=None)
+        statement = statement.on_conflict_do_update(index_elements=['doctolib_id'], set_=updates)
+        try:
+            db.execute(statement, batch)
+            db.commit()
+            logger.info(f"Upserted {len(batch)} doctors")
+            return len(batch)
+        except Exception as e:
+            db.rollback()
+            # Fall back to row by row so one bad doctor does not cost the rest of the batch
+            logger.error(f"Bulk upsert of {len(batch)} doctors failed, saving one by one: {e}")
+            return sum(self.save_doctor_to_db(dict(row), db, rebuild) for row in batch)
+
     @abstractmethod
     def search_doctors(self, specialty: str, department, max_pages: int = 2) -> List[Dict]:
         """Abstract method - each scraper implements its own search logic"""
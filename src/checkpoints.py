@@ -0,0 +1,299 @@
+# src/checkpoints.py
+"""
+Resumable crawl checkpoints backed by the crawl_tasks table.
+
+Every (specialty, department, page) request is a CrawlTask row that moves through
+pending -> in_flight -> done. Failures go to a retry queue with exponential backoff
+and end up dead after max_attempts. A restarted crawl puts interrupted in-flight
+tasks back to pending and never refetches a page that is already done.
+
+Tasks belong to a crawl run. A store picks up the latest run while it still has
+work outstanding, so a crashed crawl resumes where it stopped; once every task of
+that run is done or dead, the next store starts a new run and the same searches
+are fetched again - a recurring re-crawl, not a no-op.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, insert, inspect, or_, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from models import CrawlRun, CrawlTask, Department
+from crawl_planner import CrawlJob, CrawlPlan
+
+logger = logging.getLogger(__name__)
+
+TaskKey = Tuple[str, int, int]  # (specialty, department id, page)
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # SQLite hands datetimes back naive - they were written as UTC
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def retry_delay(attempts: int, base: float, cap: float) -> float:
+    """Exponential backoff before retry number `attempts`: base, 2*base, 4*base... up to cap"""
+    return min(cap, base * 2 ** (attempts - 1))
+
+
+def job_key(job: CrawlJob) -> TaskKey:
+    return (job.specialty, job.department.id, job.page)
+
+
+# Tasks that still have a fetch ahead of them
+OUTSTANDING = (CrawlTask.PENDING, CrawlTask.IN_FLIGHT, CrawlTask.FAILED)
+
+
+def current_run(db: Session, label: Optional[str] = None) -> int:
+    """Id of the run new tasks belong to - the latest run while it has work outstanding, else a new one"""
+    run = db.query(CrawlRun).filter(CrawlRun.finished_at.is_(None)).order_by(CrawlRun.id.desc()).first()
+    if run is not None:
+        tasks = db.query(CrawlTask.id).filter(CrawlTask.run_id == run.id)
+        # A run with no tasks yet is still being set up by whoever created it
+        if tasks.first() is None or tasks.filter(CrawlTask.status.in_(OUTSTANDING)).first() is not None:
+            return run.id
+        run.finished_at = datetime.now(timezone.utc)
+    run = CrawlRun(label=label)
+    db.add(run)
+    db.commit()
+    logger.info(f"Started crawl run {run.id}")
+    return run.id
+
+
+def migrate_crawl_tasks(bind: Engine) -> int:
+    """Move crawl tasks recorded before crawl runs existed into a run of their own - returns tasks moved
+
+    Their unique constraint has to gain run_id, which SQLite can only do by rebuilding
+    the table. The tasks become the latest unfinished run, so an interrupted crawl still resumes.
+    """
+    inspector = inspect(bind)
+    table = CrawlTask.__table__
+    if not inspector.has_table(table.name):
+        return 0
+    constraints = [set(constraint['column_names']) for constraint in inspector.get_unique_constraints(table.name)]
+    if {'run_id', 'specialty', 'department_id', 'page'} in constraints:
+        return 0
+
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    columns = [column for column in table.columns if column.name in existing and column.name != 'run_id']
+    with bind.begin() as connection:
+        rows = [dict(row) for row in connection.execute(select(*columns)).mappings()]
+        CrawlRun.__table__.create(connection, checkfirst=True)
+        run_id = connection.execute(
+            insert(CrawlRun.__table__).values(label="before crawl runs", started_at=datetime.now(timezone.utc))
+        ).inserted_primary_key[0]
+        table.drop(connection)
+        table.create(connection)
+        if rows:
+            connection.execute(insert(table), [dict(row, run_id=run_id) for row in rows])
+    logger.info(f"Moved {len(rows)} crawl tasks into crawl run {run_id}")
+    return len(rows)
+
+
+class CheckpointStore:
+    """Reads and writes crawl progress for a crawl plan, within one crawl run"""
+
+    def __init__(self, db: Session, max_attempts: int = 5, backoff_base: float = 30.0,
+                 backoff_max: float = 3600.0, run_id: Optional[int] = None):
+        self.db = db
+        # Resumes the current run unless told which one to record into
+        self.run_id = run_id if run_id is not None else current_run(db)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._task_ids: Dict[TaskKey, int] = {}
+        self._specialties = set()
+        self._department_ids = set()
+
+    def register(self, jobs: Iterable[CrawlJob]) -> int:
+        """Create pending tasks for jobs that have none yet and return how many were added"""
+        jobs = list(jobs)
+        specialties = {job.specialty for job in jobs}
+        department_ids = {job.department.id for job in jobs}
+        if not jobs:
+            return 0
+        self._specialties |= specialties
+        self._department_ids |= department_ids
+
+        existing = self.db.query(CrawlTask.id, CrawlTask.specialty, CrawlTask.department_id, CrawlTask.page).filter(
+            CrawlTask.run_id == self.run_id,
+            CrawlTask.specialty.in_(specialties),
+            CrawlTask.department_id.in_(department_ids),
+        ).all()
+        for task_id, specialty, department_id, page in existing:
+            self._task_ids[(specialty, department_id, page)] = task_id
+
+        new_tasks = [
+            CrawlTask(run_id=self.run_id, specialty=job.specialty, department_id=job.department.id, page=job.page,
+                      status=CrawlTask.PENDING)
+            for job in jobs if job_key(job) not in self._task_ids
+        ]
+        if new_tasks:
+            self.db.add_all(new_tasks)
+            self.db.flush()
+            for task in new_tasks:
+                self._task_ids[(task.specialty, task.department_id, task.page)] = task.id
+            self.db.commit()
+        return len(new_tasks)
+
+    def recover_in_flight(self) -> int:
+        """Put tasks left in flight by a dead process back in the pending state"""
+        # Tasks leased by a live distributed worker are left alone until their lease runs out
+        recovered = self.db.query(CrawlTask).filter(
+            CrawlTask.run_id == self.run_id,
+            CrawlTask.status == CrawlTask.IN_FLIGHT,
+            or_(CrawlTask.lease_expires_at.is_(None), CrawlTask.lease_expires_at < datetime.now(timezone.utc)),
+        ).update(
+            {CrawlTask.status: CrawlTask.PENDING, CrawlTask.lease_owner: None, CrawlTask.lease_expires_at: None},
+            synchronize_session=False,
+        )
+        self.db.commit()
+        if recovered:
+            logger.info(f"Recovered {recovered} interrupted crawl tasks")
+        return recovered
+
+    def resume(self, plan: CrawlPlan) -> CrawlPlan:
+        """Register a plan and return only the jobs that still need fetching now"""
+        self.recover_in_flight()
+        added = self.register(plan.jobs)
+        runnable = self._runnable_keys()
+        remaining = CrawlPlan(jobs=[job for job in plan.jobs if job_key(job) in runnable])
+        logger.info(f"Checkpoint: {added} new tasks, {remaining.total_requests}/{plan.total_requests} "
+                    f"requests still to run - {self.progress()}")
+        return remaining
+
+    def unfinished(self, jobs: List[CrawlJob]) -> List[CrawlJob]:
+        """Register jobs and keep the ones that still need fetching now"""
+        if not jobs:
+            return []
+        self.register(jobs)
+        runnable = self._runnable_keys()
+        return [job for job in jobs if job_key(job) in runnable]
+
+    def due_retries(self, departments: Dict[int, Department]) -> Tuple[CrawlPlan, Optional[datetime]]:
+        """Failed jobs that are due now, and when the next one will be due"""
+        now = datetime.now(timezone.utc)
+        failed = self._registered(self.db.query(CrawlTask.specialty, CrawlTask.department_id, CrawlTask.page,
+                                                CrawlTask.next_attempt_at)).filter(
+            CrawlTask.status == CrawlTask.FAILED
+        ).all()
+        due, next_due = set(), None
+        for specialty, department_id, page, next_attempt_at in failed:
+            next_attempt_at = _as_utc(next_attempt_at)
+            if next_attempt_at is None or next_attempt_at <= now:
+                due.add((specialty, department_id, page))
+            elif next_due is None or next_attempt_at < next_due:
+                next_due = next_attempt_at
+        jobs = [
+            CrawlJob(specialty, departments[department_id], page)
+            for specialty, department_id, page in sorted(due)
+            if department_id in departments
+        ]
+        return CrawlPlan(jobs=jobs), next_due
+
+    def finished(self, job: CrawlJob) -> Optional[Tuple[str, Optional[int], Optional[int]]]:
+        """(status, doctors_found, total_results) if the job is done or dead, None if it still needs fetching"""
+        row = self.db.query(CrawlTask.status, CrawlTask.doctors_found, CrawlTask.total_results).filter(
+            CrawlTask.id == self._task_id(job)
+        ).first()
+        if row is None or row[0] not in (CrawlTask.DONE, CrawlTask.DEAD):
+            return None
+        return tuple(row)
+
+    def started_at(self, specialty: str, department_id: int) -> Optional[datetime]:
+        """When the first task of a search was registered in this run - where a resumed crawl really began"""
+        return _as_utc(self.db.query(func.min(CrawlTask.created_at)).filter(
+            CrawlTask.run_id == self.run_id,
+            CrawlTask.specialty == specialty,
+            CrawlTask.department_id == department_id,
+        ).scalar())
+
+    def mark_in_flight(self, job: CrawlJob):
+        self._update(job, {CrawlTask.status: CrawlTask.IN_FLIGHT})
+
+    def mark_done(self, job: CrawlJob, doctors_found: int, total_results: Optional[int] = None):
+        self._update(job, {
+            CrawlTask.status: CrawlTask.DONE,
+            CrawlTask.last_status: 200,
+            CrawlTask.last_error: None,
+            CrawlTask.doctors_found: doctors_found,
+            CrawlTask.total_results: total_results,
+            CrawlTask.completed_at: datetime.now(timezone.utc),
+        })
+
+    def mark_done_on(self, job: CrawlJob, doctors_found: int,
+                     total_results: Optional[int] = None) -> Callable[[Session], None]:
+        """mark_done deferred to another thread's session - for pages saved by the write-behind writer"""
+        def mark_done(db: Session):
+            CheckpointStore(db, self.max_attempts, self.backoff_base, self.backoff_max, self.run_id).mark_done(
+                job, doctors_found, total_results
+            )
+        return mark_done
+
+    def mark_failed(self, job: CrawlJob, status: Optional[int] = None, error: Optional[str] = None):
+        """Record a failure - retried later with exponential backoff, or dead after max_attempts"""
+        task_id = self._task_id(job)
+        attempts = (self.db.query(CrawlTask.attempts).filter(CrawlTask.id == task_id).scalar() or 0) + 1
+
+        if attempts >= self.max_attempts:
+            logger.error(f"Giving up on {job.specialty} / {job.department.name} page {job.page} after {attempts} attempts")
+            values = {CrawlTask.status: CrawlTask.DEAD, CrawlTask.next_attempt_at: None}
+        else:
+            delay = retry_delay(attempts, self.backoff_base, self.backoff_max)
+            values = {
+                CrawlTask.status: CrawlTask.FAILED,
+                CrawlTask.next_attempt_at: datetime.now(timezone.utc) + timedelta(seconds=delay),
+            }
+        values.update({CrawlTask.attempts: attempts, CrawlTask.last_status: status, CrawlTask.last_error: error})
+        self._update(job, values)
+
+    def mark_failed_in_own_session(self, job: CrawlJob, status: Optional[int] = None, error: Optional[str] = None):
+        """mark_failed with a session of its own - safe on an executor thread while self.db is in use"""
+        db = Session(bind=self.db.get_bind())
+        try:
+            CheckpointStore(db, self.max_attempts, self.backoff_base, self.backoff_max, self.run_id).mark_failed(
+                job, status, error
+            )
+        finally:
+            db.close()
+
+    def progress(self) -> Dict[str, int]:
+        """Task counts by status for the specialties/departments registered so far in this run"""
+        rows = self._registered(self.db.query(CrawlTask.status, func.count(CrawlTask.id))).group_by(
+            CrawlTask.status
+        ).all()
+        return {status: count for status, count in rows}
+
+    def _registered(self, query):
+        # Filter on the (few) specialties and departments rather than on thousands of task ids
+        return query.filter(
+            CrawlTask.run_id == self.run_id,
+            CrawlTask.specialty.in_(self._specialties),
+            CrawlTask.department_id.in_(self._department_ids),
+        )
+
+    def _runnable_keys(self) -> set:
+        now = datetime.now(timezone.utc)
+        rows = self._registered(self.db.query(CrawlTask.specialty, CrawlTask.department_id, CrawlTask.page,
+                                              CrawlTask.status, CrawlTask.next_attempt_at)).filter(
+            CrawlTask.status.in_([CrawlTask.PENDING, CrawlTask.FAILED]),
+        ).all()
+        return {
+            (specialty, department_id, page)
+            for specialty, department_id, page, status, next_attempt_at in rows
+            if status == CrawlTask.PENDING or _as_utc(next_attempt_at) is None or _as_utc(next_attempt_at) <= now
+        }
+
+    def _task_id(self, job: CrawlJob) -> int:
+        key = job_key(job)
+        if key not in self._task_ids:
+            self.register([job])
+        return self._task_ids[key]
+
+    def _update(self, job: CrawlJob, values: Dict):
+        self.db.query(CrawlTask).filter(CrawlTask.id == self._task_id(job)).update(values, synchronize_session=False)
+        self.db.commit()
@@ -47,4 +47,17 @@ PAYLOAD = {
 # Add other config settings here
 
 BASE_URL = "https://doctolib.fr"
-API_ENDPOINT = "/phs_proxy/raw"
\ No newline at end of file
+API_ENDPOINT = "/phs_proxy/raw"
+
+# On-disk cache of search responses - set RESPONSE_CACHE_PATH to an empty string to disable
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', 'response_cache.db')
+RESPONSE_CACHE_TTL_HOURS = float(os.getenv('RESPONSE_CACHE_TTL_HOURS', '168'))  # 0 = never expire
+RESPONSE_CACHE_MAX_MB = int(os.getenv('RESPONSE_CACHE_MAX_MB', '1024'))  # 0 = no size cap
+
+# Record-and-replay of raw search responses - both are off when empty
+RECORD_RESPONSES_DIR = os.getenv('RECORD_RESPONSES_DIR', '')  # write every search exchange here
+REPLAY_RESPONSES_DIR = os.getenv('REPLAY_RESPONSES_DIR', '')  # answer searches from this recording instead of the network
+REPLAY_REPRODUCE_LATENCY = os.getenv('REPLAY_REPRODUCE_LATENCY', '0') == '1'
+
+# Compressed archive of every raw provider entry, for re-extraction without refetching - empty disables it
+PROVIDER_ARCHIVE_PATH = os.getenv('PROVIDER_ARCHIVE_PATH', 'provider_archive.db')
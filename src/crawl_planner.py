@@ -0,0 +1,133 @@
+# src/crawl_planner.py
+"""
+Crawl plan compiler.
+
+Expands (specialties x departments x pages) into a flat list of request jobs whose
+JSON bodies are serialized once per (specialty, department), so the fetch loop only
+ever sends bytes. The plan knows its own size before anything is sent.
+"""
+import logging
+import math
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from models import Department
+from data_processors import encode_payload
+from geo_partition import RESULT_CAP, SearchArea, apply_area
+
+logger = logging.getLogger(__name__)
+
+
+def build_search_payload(specialty: str, department: Department, area: Optional[SearchArea] = None) -> Dict:
+    """Search payload for a specialty in a department (or one area of it), as sent to /phs_proxy/raw"""
+    payload = {
+        "keyword": specialty,
+        "location": {
+            "place": {
+                "id": department.doctolib_id,
+                "name": department.name,
+                "country": "fr",
+                "type": department.type,
+                "viewport": {
+                    "northeast": {
+                        "lat": float(department.viewport_ne_lat),
+                        "lng": float(department.viewport_ne_lng),
+                    },
+                    "southwest": {
+                        "lat": float(department.viewport_sw_lat),
+                        "lng": float(department.viewport_sw_lng),
+                    }
+                },
+                "gpsPoint": {
+                    "lat": float(department.latitude),
+                    "lng": float(department.longitude)
+                },
+                "zipcodes": department.zipcodes
+            }
+        },
+        "filters": {}
+    }
+    return apply_area(payload, area)
+
+
+def pages_for_total(total: Optional[int], page_size: int, max_pages: Optional[int] = None) -> Optional[int]:
+    """How many pages a search spans, from its reported total and page 0's size - None if total is unknown"""
+    if total is None:
+        return None
+    if total <= 0 or page_size <= 0:
+        return 1
+    # The API stops paging at RESULT_CAP results, whatever total says
+    pages = math.ceil(min(total, RESULT_CAP) / page_size)
+    return min(pages, max_pages) if max_pages else pages
+
+
+@dataclass
+class CrawlJob:
+    """One search request: a specialty, a department, a result page and its pre-encoded body"""
+    specialty: str
+    department: Department
+    page: int = 0
+    body: Optional[bytes] = None
+    attempt: int = 0
+    area: Optional[SearchArea] = None  # Part of the department when the search was partitioned
+
+
+@dataclass
+class CrawlPlan:
+    """Ordered request jobs for a crawl, plus what they add up to"""
+    jobs: List[CrawlJob] = field(default_factory=list)
+    truncated: int = 0
+
+    @property
+    def total_requests(self) -> int:
+        return len(self.jobs)
+
+    def requests_per_department(self) -> Dict[str, int]:
+        return dict(Counter(job.department.name for job in self.jobs))
+
+    def summary(self) -> str:
+        specialties = len({job.specialty for job in self.jobs})
+        departments = len({job.department.id for job in self.jobs})
+        text = f"{self.total_requests} requests across {specialties} specialties and {departments} departments"
+        if self.truncated:
+            text += f" ({self.truncated} dropped by the request cap)"
+        return text
+
+
+class CrawlPlanner:
+    """Compiles crawl plans, optionally capped at max_requests"""
+
+    def __init__(self, max_requests: Optional[int] = None):
+        self.max_requests = max_requests
+
+    def compile(self, specialties: Iterable[str], departments: Iterable[Department],
+                max_pages: int = 5) -> CrawlPlan:
+        """Expand specialties x departments x pages into request jobs"""
+        specialties = list(specialties)
+        departments = list(departments)
+
+        # One body per (specialty, department), shared by every page of that search
+        bodies = {
+            (specialty, department.id): encode_payload(build_search_payload(specialty, department))
+            for specialty in specialties
+            for department in departments
+        }
+
+        # Page-major order: every search gets its first page before anyone gets a second,
+        # so load spreads across searches and a request cap drops the deepest pages first
+        jobs = [
+            CrawlJob(specialty, department, page, bodies[(specialty, department.id)])
+            for page in range(max_pages)
+            for specialty in specialties
+            for department in departments
+        ]
+
+        plan = CrawlPlan(jobs=jobs)
+        if self.max_requests is not None and len(jobs) > self.max_requests:
+            plan.truncated = len(jobs) - self.max_requests
+            plan.jobs = jobs[:self.max_requests]
+            logger.warning(f"Crawl plan capped at {self.max_requests} requests, dropping {plan.truncated}")
+
+        logger.info(f"Crawl plan: {plan.summary()}")
+        return plan
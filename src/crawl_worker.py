@@ -0,0 +1,215 @@
+# src/crawl_worker.py
+"""
+Distributed crawl worker.
+
+Each worker (one per process, any number per machine) leases (specialty, department,
+page) tasks from the shared crawl_tasks queue, fetches them with its own
+DoctolibScraper - its own egress and rate budget - and saves doctors through
+save_doctors_bulk. Page 0 of a search enqueues the rest of its pages for everyone.
+
+Usage:
+    python src/crawl_worker.py enqueue medecin-generaliste [--departments Paris Rhône]
+    python src/crawl_worker.py run [--processes 4]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from typing import Callable, List, Optional
+
+sys.path.append(os.path.dirname(__file__))
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, engine, Base, add_missing_columns, add_missing_indexes
+from models import CrawlTask, Department
+from checkpoints import migrate_crawl_tasks
+from crawl_planner import pages_for_total
+from data_processors import extract_doctor_data
+from spatial import ensure_spatial_index
+from work_queue import LeaseWorkQueue, default_worker_id
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlWorker:
+    """Pulls tasks from the lease queue until there is nothing left to do"""
+
+    def __init__(self, scraper=None, worker_id: Optional[str] = None, lease_seconds: float = 120.0,
+                 batch_size: int = 4, poll_interval: float = 5.0,
+                 session_factory: Callable[[], Session] = SessionLocal):
+        if scraper is None:
+            from provider_archive import ProviderArchive
+            from scraper import DoctolibScraper
+            scraper = DoctolibScraper(archive=ProviderArchive.from_config())
+        self.scraper = scraper
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.session_factory = session_factory
+
+        self.pages_done = 0
+        self._leased_ids: List[int] = []
+        self._leased_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def _heartbeat_loop(self):
+        # Separate session: SQLAlchemy sessions must not be shared between threads
+        db = self.session_factory()
+        queue = LeaseWorkQueue(db, self.worker_id, self.lease_seconds)
+        try:
+            while not self._stopping.wait(self.lease_seconds / 3):
+                with self._leased_lock:
+                    task_ids = list(self._leased_ids)
+                try:
+                    queue.heartbeat(task_ids)
+                except Exception as e:
+                    logger.error(f"Heartbeat failed for {self.worker_id}: {e}")
+                    db.rollback()
+        finally:
+            db.close()
+
+    def run(self, stop_when_empty: bool = True):
+        """Work until the queue is drained (or forever when stop_when_empty is False)"""
+        db = self.session_factory()
+        queue = LeaseWorkQueue(db, self.worker_id, self.lease_seconds)
+        heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat.start()
+        logger.info(f"Worker {self.worker_id} started")
+
+        try:
+            while True:
+                tasks = queue.claim(self.batch_size)
+                if not tasks:
+                    if queue.outstanding() == 0:
+                        if stop_when_empty:
+                            break
+                        # This run is over - move on to whichever run is enqueued next
+                        queue.run_id = None
+                    # Other workers hold the remaining leases, or retries are not due yet
+                    time.sleep(self.poll_interval)
+                    continue
+
+                with self._leased_lock:
+                    self._leased_ids = [task.id for task in tasks]
+                for task in tasks:
+                    self.process(task, db, queue)
+                    with self._leased_lock:
+                        self._leased_ids.remove(task.id)
+        finally:
+            self._stopping.set()
+            heartbeat.join()
+            db.close()
+            logger.info(f"Worker {self.worker_id} finished after {self.pages_done} pages")
+
+    def process(self, task: CrawlTask, db: Session, queue: LeaseWorkQueue):
+        """Fetch one leased page, save its doctors and enqueue the rest of the search"""
+        department = db.get(Department, task.department_id)
+        if department is None:
+            logger.error(f"[{self.worker_id}] Task {task.id} names unknown department {task.department_id}")
+            queue.fail(task, error=f"unknown department {task.department_id}")
+            return
+        try:
+            data = self.scraper.search_doctors_in_department(task.specialty, department, task.page)
+        except Exception as e:
+            queue.fail(task, error=str(e))
+            return
+        if not data:
+            queue.fail(task, error="no data received")
+            return
+
+        doctors = data.get('healthcareProviders', [])
+        total = data.get('total')
+        self.scraper.archive_providers(task.specialty, department.id, doctors)
+        try:
+            self.scraper.save_doctors_bulk([extract_doctor_data(doctor, department.id) for doctor in doctors], db)
+
+            # Page 0 knows how many pages the search has - hand them to every worker
+            if task.page == 0:
+                pages = pages_for_total(total, len(doctors))
+                for page in range(1, pages or 1):
+                    queue.enqueue(task.specialty, department.id, page, task.run_id)
+            if total is None and doctors:
+                queue.enqueue(task.specialty, department.id, task.page + 1, task.run_id)
+
+            queue.complete(task, len(doctors), total)
+        except Exception as e:
+            # e.g. "database is locked" with several local processes - retry the page later
+            # instead of taking the whole worker down
+            logger.error(f"[{self.worker_id}] Saving {task.specialty} / {department.name} page {task.page + 1} "
+                         f"failed: {e}")
+            db.rollback()
+            queue.fail(task, error=str(e))
+            return
+
+        self.pages_done += 1
+        logger.info(f"[{self.worker_id}] {task.specialty} / {department.name} page {task.page + 1}: "
+                    f"{len(doctors)} doctors")
+
+
+def enqueue_searches(specialties: List[str], department_names: Optional[List[str]] = None) -> int:
+    """Seed the queue with page 0 of every (specialty, department) search"""
+    db = SessionLocal()
+    try:
+        query = db.query(Department)
+        if department_names:
+            query = query.filter(Department.name.in_(department_names))
+        queue = LeaseWorkQueue(db)
+        added = sum(
+            queue.enqueue(specialty, department.id, 0)
+            for specialty in specialties
+            for department in query.all()
+        )
+        logger.info(f"Enqueued {added} searches, {queue.outstanding()} tasks outstanding")
+        return added
+    finally:
+        db.close()
+
+
+def _run_worker_process(stop_when_empty: bool):
+    # Each process opens its own connections - engines must not cross a fork
+    engine.dispose()
+    logging.basicConfig(level=logging.INFO)
+    CrawlWorker().run(stop_when_empty=stop_when_empty)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributed Doctolib crawl worker")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = subcommands.add_parser('enqueue', help="Add searches to the shared queue")
+    enqueue_parser.add_argument('specialties', nargs='+')
+    enqueue_parser.add_argument('--departments', nargs='*', help="Department names (default: all)")
+
+    run_parser = subcommands.add_parser('run', help="Work through the queue")
+    run_parser.add_argument('--processes', type=int, default=1, help="Worker processes on this machine")
+    run_parser.add_argument('--forever', action='store_true', help="Keep polling when the queue is empty")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    Base.metadata.create_all(bind=engine)
+    migrate_crawl_tasks(engine)
+    add_missing_columns(engine)
+    add_missing_indexes(engine)
+    ensure_spatial_index(engine)
+
+    if args.command == 'enqueue':
+        enqueue_searches(args.specialties, args.departments)
+        return
+
+    processes = [
+        multiprocessing.Process(target=_run_worker_process, args=(not args.forever,))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,138 +2,143 @@
 """
 Utility functions for processing and transforming Doctolib API data
 """
+import hashlib
 import json
 from typing import Dict, Any
 from models import Doctor
+from lookups import LANGUAGES, PAYMENT_METHODS, SERVICES, to_mask
+from field_mapping import (
+    COALESCE, REQUIRED, Field, compile_column_extractor, compile_record_extractor, targets,
+)
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def extract_doctor_data(doctor_json, department_id):
-    """Extract all available data from Doctolib doctor JSON"""
-
-    def safe_get(data, path, default=None):
-        """
-        Safely navigate nested dictionaries without throwing KeyError or AttributeError
-        
-        Args:
-            data: The dictionary to search in
-            path: Dot-separated path like 'location.address' or 'speciality.name'
-            default: Value to return if any part of the path is missing
-        
-        Examples:
-            safe_get(doctor_json, 'location.city') → "Paris" or None
-            safe_get(doctor_json, 'nonexistent.field', 'default') → "default"
-        """
-
-        keys = path.split('.') # Convert 'location.city' → ['location', 'city']
-        current = data
-
-        # Check if current level is a dict AND has the key
-        for key in keys:
-            if isinstance(current, dict) and key in current:
-                current = current[key] # Move one level deeper into nested structure
-            else:
-                return default # Path broken, return default
-        
-        return current if current is not None else default
-    
-    # =========================================================================
-    # Data prep to handle null objects/empty fields/orgs instead of individuals
-    # =========================================================================
-
-    # Determine if this is an individual or organization by checking if a first name exists
-    # Some doctors are clinics (orgs) without first/last names
-    is_organization = doctor_json.get('firstName') is None and doctor_json.get('name') is not None
-
-    # Create safe versions of nested objects that might be null
-    # Prevents "no attribute" get() errors for NoneType objects
-    online_booking = doctor_json.get('onlineBooking') or {}
-    matched_visit_motive = doctor_json.get('matchedVisitMotive') or {}
-    location = doctor_json.get('location') or {}
-    references = doctor_json.get('references') or {}
-
-    # Determine if this is an individual or org.
-    is_organization = doctor_json.get('firstName') is None and doctor_json.get('name') is not None
-    
-    return {
-        # Primary identifiers
-        'doctolib_id': doctor_json.get('id', 'unknown'),
-        'profile_url': doctor_json.get('link', ''),
-        
-        # Name & personal info
-        'first_name': doctor_json.get('firstName'),
-        'last_name': doctor_json.get('name') if not is_organization else None,
-        'organization_name': doctor_json.get('name') if is_organization else None,
-        'is_organization': is_organization,
-        'title': doctor_json.get('title'),
-        'gender': doctor_json.get('gender'),
-
-        # Professional details - critical with fallbacks
-        'specialty': safe_get(doctor_json, 'speciality.name', 'Médecin généraliste'),
-        'specialty_slug': safe_get(doctor_json, 'speciality.slug', 'médecin-généraliste'),
-        'regulation_sector': doctor_json.get('regulationSector', 'unknown'),
-        'practitioner_type': doctor_json.get('type', 'UNKNOWN'),
-        
-        # Location with null handling
-        'address': location.get('address', ''),
-        'city': location.get('city', ''),
-        'postal_code': location.get('zipcode', ''),
-        'latitude': location.get('lat'),
-        'longitude': location.get('lng'),
-        
-        # References with null protection
-        'reference_id': references.get('id'),
-        'practice_id': references.get('practiceId'),
-        'legacy_id': references.get('lagacyId', ''),
-        
-        # Online services
-        'offers_online_booking': bool(doctor_json.get('onlineBooking')),
-        'offers_telehealth': online_booking.get('telehealth', False),
-        'online_booking_details': doctor_json.get('onlineBooking'),
-        'accepts_new_patients': matched_visit_motive.get('allowNewPatients', True),
-        
-        # Various JSON fields
-        'payment_methods': doctor_json.get('paymentMeans', []),
-        'languages': doctor_json.get('languages', []),
-        'services': doctor_json.get('services', []),
-        'administrative_areas': doctor_json.get('administrativeArea', []),
-        
-        # Visit motive
-        'visit_motive_id': matched_visit_motive.get('visitMotiveId'),
-        'visit_motive_name': matched_visit_motive.get('name'),
-        'visit_motive_agenda_ids': matched_visit_motive.get('agendaIds', []),
-        'visit_motive_insurance_sector': matched_visit_motive.get('insuranceSector'),
-        
-        # Clinic/Org info
-        'organization_status': doctor_json.get('organizationStatus'),
-        'cloudinary_public_id': doctor_json.get('cloudinaryPublicId'),
-        'exact_match': doctor_json.get('exactMatch', False),
-        'minimum_fee': doctor_json.get('minimumFee'),
-        
-        # Relationship
-        'department_id': department_id
-    }
-
-
-def extract_department_data(payload: Dict[str, Any]) -> Dict[str, Any]:
-    """Extract department information from a payload"""
-    place = payload['location']['place']
-    return {
-        'name': place['name'],
-        'doctolib_id': place['id'],
-        'place_id': place.get('placeId'),
-        'latitude': place['gpsPoint']['lat'],
-        'longitude': place['gpsPoint']['lng'],
-        'viewport_ne_lat': place['viewport']['northeast']['lat'],
-        'viewport_ne_lng': place['viewport']['northeast']['lng'],
-        'viewport_sw_lat': place['viewport']['southwest']['lat'],
-        'viewport_sw_lng': place['viewport']['southwest']['lng'],
-        'zipcodes': place['zipcodes'],
-        'type': place['type']
-    }
+def encode_payload(payload: Dict) -> bytes:
+    """Serialize a search payload to the exact bytes sent to /phs_proxy/raw"""
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+# Bookkeeping fields that are not part of what the API told us about a doctor - the lookup
+# ids are resolved at save time from specialty_slug/regulation_sector/city, already hashed
+FINGERPRINT_EXCLUDED = {'id', 'fingerprint', 'created_at', 'updated_at', 'last_seen',
+                        'specialty_id', 'regulation_sector_id', 'city_id'}
+
+
+def doctor_fingerprint(doctor_dict: Dict) -> str:
+    """Stable 128-bit hash of an extracted doctor record, to detect unchanged providers on re-crawls"""
+    content = {key: value for key, value in doctor_dict.items() if key not in FINGERPRINT_EXCLUDED}
+    canonical = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _mask(vocabulary):
+    """Bitmask transform for a vocabulary, with its value -> bit table built once"""
+    bits = {value: 1 << bit for bit, value in enumerate(vocabulary)}
+
+    def mask(values):
+        result = 0
+        try:
+            for value in values or ():
+                result |= bits[value]
+        except (KeyError, TypeError):
+            # A value outside the vocabulary - to_mask skips (and logs) it
+            return to_mask(values, vocabulary)
+        return result
+    return mask
+
+
+# JSON -> Doctor column mapping: one line per column (see field_mapping for the modes).
+# Nested objects that come back null (location, references, onlineBooking,
+# matchedVisitMotive) are read as {}.
+DOCTOR_MAPPING = (
+    # Primary identifiers
+    Field('doctolib_id', 'id', 'unknown'),
+    Field('profile_url', 'link', ''),
+
+    # Name & personal info - some doctors are clinics (orgs): a name but no first name
+    Field('first_name', 'firstName'),
+    Field('last_name', ('firstName', 'name'), transform='{1} if {0} is not None else None'),
+    Field('organization_name', ('firstName', 'name'), transform='{1} if {0} is None else None'),
+    Field('is_organization', ('firstName', 'name'), transform='{0} is None and {1} is not None'),
+    Field('title', 'title'),
+    Field('gender', 'gender'),
+
+    # Professional details - critical with fallbacks, also when the API sends null
+    Field('specialty', 'speciality.name', 'Médecin généraliste', COALESCE),
+    Field('specialty_slug', 'speciality.slug', 'médecin-généraliste', COALESCE),
+    Field('regulation_sector', 'regulationSector', 'unknown'),
+    Field('practitioner_type', 'type', 'UNKNOWN'),
+
+    # Location
+    Field('address', 'location.address', ''),
+    Field('city', 'location.city', ''),
+    Field('postal_code', 'location.zipcode', ''),
+    Field('latitude', 'location.lat'),
+    Field('longitude', 'location.lng'),
+
+    # References
+    Field('reference_id', 'references.id'),
+    Field('practice_id', 'references.practiceId'),
+    Field('legacy_id', 'references.legacyId', ''),
+
+    # Online services
+    Field('offers_online_booking', 'onlineBooking', transform=bool),
+    Field('offers_telehealth', 'onlineBooking.telehealth', False),
+    Field('online_booking_details', 'onlineBooking'),
+    Field('accepts_new_patients', 'matchedVisitMotive.allowNewPatients', True),
+
+    # Various JSON fields
+    Field('payment_methods', 'paymentMeans', []),
+    Field('languages', 'languages', []),
+    Field('services', 'services', []),
+    Field('payment_methods_mask', 'paymentMeans', [], transform=_mask(PAYMENT_METHODS)),
+    Field('languages_mask', 'languages', [], transform=_mask(LANGUAGES)),
+    Field('services_mask', 'services', [], transform=_mask(SERVICES)),
+    Field('administrative_areas', 'administrativeArea', []),
+
+    # Visit motive
+    Field('visit_motive_id', 'matchedVisitMotive.visitMotiveId'),
+    Field('visit_motive_name', 'matchedVisitMotive.name'),
+    Field('visit_motive_agenda_ids', 'matchedVisitMotive.agendaIds', []),
+    Field('visit_motive_insurance_sector', 'matchedVisitMotive.insuranceSector'),
+
+    # Clinic/Org info
+    Field('organization_status', 'organizationStatus'),
+    Field('cloudinary_public_id', 'cloudinaryPublicId'),
+    Field('exact_match', 'exactMatch', False),
+    Field('minimum_fee', 'minimumFee'),
+
+    # Relationship - passed in by the caller
+    Field('department_id', None),
+)
+
+# JSON -> Department column mapping, for the search payloads in department_payloads/
+DEPARTMENT_MAPPING = (
+    Field('name', 'location.place.name', mode=REQUIRED),
+    Field('doctolib_id', 'location.place.id', mode=REQUIRED),
+    Field('place_id', 'location.place.placeId'),
+    Field('latitude', 'location.place.gpsPoint.lat', mode=REQUIRED),
+    Field('longitude', 'location.place.gpsPoint.lng', mode=REQUIRED),
+    Field('viewport_ne_lat', 'location.place.viewport.northeast.lat', mode=REQUIRED),
+    Field('viewport_ne_lng', 'location.place.viewport.northeast.lng', mode=REQUIRED),
+    Field('viewport_sw_lat', 'location.place.viewport.southwest.lat', mode=REQUIRED),
+    Field('viewport_sw_lng', 'location.place.viewport.southwest.lng', mode=REQUIRED),
+    Field('zipcodes', 'location.place.zipcodes', []),
+    Field('type', 'location.place.type', mode=REQUIRED),
+)
+
+DOCTOR_FIELDS = targets(DOCTOR_MAPPING)
+
+# Compiled once, at import - called directly, with no wrapper in between
+extract_doctor_data = compile_record_extractor(
+    DOCTOR_MAPPING, 'extract_doctor_data', "Extract all available data from Doctolib doctor JSON")
+extract_doctor_columns = compile_column_extractor(
+    DOCTOR_MAPPING, 'extract_doctor_columns', "Column-oriented extraction: field -> list of values, one per provider")
+extract_department_data = compile_record_extractor(
+    DEPARTMENT_MAPPING, 'extract_department_data', "Extract department information from a payload")
 
 # Not being called?
 def create_doctor_from_json(doctor_json: Dict[str, Any], department_id: int) -> Doctor:
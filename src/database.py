@@ -1,24 +1,125 @@
 # src/database.py
-from sqlalchemy import create_engine
+from typing import List
+
+from sqlalchemy import BigInteger, Integer, create_engine, event, inspect, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./doctolib_providers.db")
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-)
+# PRAGMAs applied to every new SQLite connection, by profile name:
+# - bulk_load: fastest writes for a one-off crawl/import; synchronous=OFF can lose the
+#   last transactions (not corrupt the file, in WAL mode) if the machine itself crashes
+# - serving: WAL so readers never wait on the writer, durable-enough NORMAL sync
+# - default: SQLite's own settings (rollback journal, FULL sync)
+SQLITE_PROFILES = {
+    "default": {},
+    "bulk_load": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -256000,  # negative = KiB, so ~250 MB of page cache
+        "mmap_size": 1073741824,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000,
+    },
+    "serving": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+}
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "serving")
+
+
+def apply_sqlite_profile(engine: Engine, profile: str):
+    """Run a storage profile's PRAGMAs on every connection the engine opens"""
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLite profile {profile!r}, expected one of {sorted(SQLITE_PROFILES)}")
+    pragmas = SQLITE_PROFILES[profile]
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def create_db_engine(url: str = DATABASE_URL, sqlite_profile: str = SQLITE_PROFILE) -> Engine:
+    """Engine for url, with the SQLite storage profile applied when it is a SQLite database"""
+    is_sqlite = url.startswith("sqlite")
+    db_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False} if is_sqlite else {}
+    )
+    if is_sqlite:
+        apply_sqlite_profile(db_engine, sqlite_profile)
+    return db_engine
+
+
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Base class for ORM models
 Base = declarative_base()
 
 
+def add_missing_columns(bind: Engine = engine) -> List[str]:
+    """Add model columns that an existing database predates - create_all only creates missing tables
+
+    Also widens integer columns the models have since made BigInteger (SQLite integers are 64-bit already).
+    """
+    inspector = inspect(bind)
+    added = []
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing_types = {column['name']: column['type'] for column in inspector.get_columns(table.name)}
+            existing = set(existing_types)
+            for column in table.columns:
+                if (bind.dialect.name == 'postgresql' and isinstance(column.type, BigInteger)
+                        and isinstance(existing_types.get(column.name), Integer)
+                        and not isinstance(existing_types[column.name], BigInteger)):
+                    connection.execute(text(f'ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE BIGINT'))
+                    added.append(f"{table.name}.{column.name} (widened to BIGINT)")
+                # Only nullable columns can be added to tables that already have rows
+                if column.name in existing or not column.nullable:
+                    continue
+                column_sql = f'{column.name} {column.type.compile(dialect=bind.dialect)}'
+                if column.server_default is not None:
+                    # Existing rows take the default, exactly like rows inserted from now on
+                    default = column.server_default.arg
+                    default = default if isinstance(default, str) else default.compile(dialect=bind.dialect)
+                    column_sql += f' DEFAULT {default}'
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column_sql}'))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def add_missing_indexes(bind: Engine = engine) -> List[str]:
+    """Create model indexes that an existing table predates - create_all skips tables that exist"""
+    inspector = inspect(bind)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind)
+                added.append(index.name)
+    return added
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
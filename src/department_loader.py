@@ -1,17 +1,37 @@
 # src/department_loader.py
 
+import argparse
+import hashlib
 import json
 import os
-from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
 from sqlalchemy.orm import Session
-from models import Department
+from models import Department, DepartmentFile
 from database import SessionLocal
+from data_processors import extract_department_data
 from datetime import datetime, timezone
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Below this many changed files, starting worker processes costs more than it saves
+PARALLEL_READ_THRESHOLD = 64
+
+
+def _read_department_file(path: str) -> Tuple:
+    """Read, hash and parse one payload file - runs in worker processes for large sets"""
+    try:
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            raw = f.read()
+        sha256 = hashlib.sha256(raw).hexdigest()
+        return path, stat.st_mtime_ns, stat.st_size, sha256, extract_department_data(json.loads(raw)), None
+    except Exception as e:
+        return path, None, None, None, None, str(e)
+
+
 class DepartmentLoader:
     def __init__(self, db: Session): # Where the db gets stored
         self.db = db # Stores the session as an instance variable
@@ -25,113 +45,121 @@ class DepartmentLoader:
                 # Reads entire JSON file and converts to Python dict
                 payload = json.load(f)
 
-            place_data = payload['location']['place']
-
-            #Create department object
-            department = Department(
-                name=place_data['name'],
-                doctolib_id=place_data['id'],
-                place_id=place_data.get('placeId'),
-                type=place_data['type'],
-
-                # Geographic coordinates (center point)
-                latitude=place_data['gpsPoint']['lat'],
-                longitude=place_data['gpsPoint']['lng'],
-
-                # Bounding box
-                viewport_ne_lat=place_data['viewport']['northeast']['lat'],
-                viewport_ne_lng=place_data['viewport']['northeast']['lng'],
-                viewport_sw_lat=place_data['viewport']['southwest']['lat'],
-                viewport_sw_lng=place_data['viewport']['southwest']['lng'],
-
-                # Zipcodes
-                zipcodes=place_data.get('zipcodes', [])
-            )
-
-            # Returns the payload as a Python dict
-            return department
+            # Returns a Department object built from the payload
+            return Department(**extract_department_data(payload))
     
         except Exception as e:
             logger.error(f"Error loading department from {file_path}: {e}")
             return None
         
 
-    def load_all_departments(self, directory_path: str = "department_payloads"):
-        """Load all departments from JSON files in a directory"""
+    def load_all_departments(self, directory_path: str = "department_payloads", force: bool = False):
+        """Load all departments from JSON files in a directory
+
+        Files whose size and mtime match the department_files manifest are not even
+        opened; the rest are read and parsed (in worker processes when there are many),
+        then every department is upserted in a single transaction. force=True reloads
+        every file regardless of the manifest.
+        """
         # Check if directory exists
         if not os.path.exists(directory_path):
             logger.error(f"Directory {directory_path} does not exist")
             return
         
         # Find all JSON files in the directory
-        json_files = [f for f in os.listdir(directory_path) if f.endswith('.json')]
+        json_files = sorted(f for f in os.listdir(directory_path) if f.endswith('.json'))
         logger.info(f"Found {len(json_files)} department files")
 
+        # One query for what the previous loads recorded about these files
+        paths = {os.path.realpath(os.path.join(directory_path, json_file)): json_file for json_file in json_files}
+        manifest = {entry.path: entry for entry in self.db.query(DepartmentFile).filter(
+            DepartmentFile.path.in_(list(paths))
+        )}
+
+        to_read = []
+        for path in paths:
+            stat = os.stat(path)
+            entry = manifest.get(path)
+            if not force and entry is not None and (entry.mtime_ns, entry.size) == (stat.st_mtime_ns, stat.st_size):
+                continue
+            to_read.append(path)
+        if not to_read:
+            logger.info("Department files unchanged since the last load, nothing to do")
+            return
+
         loaded_count = 0
         updated_count = 0
+        unchanged_count = 0
         error_count = 0
 
-        # Process each file
-        for json_file in json_files:
-            # Build full path: "department_payloads/paris.json"
-            file_path = os.path.join(directory_path, json_file)
-            logger.info(f"Processing file: {json_file}")
-            # Load and parse the JSON into a department object
-            department = self.load_department_from_json(file_path)
+        parsed = self._read_files(to_read)
 
-            if not department:
-                error_count += 1
-                continue
+        # Every department the changed files describe, fetched in one query
+        doctolib_ids = {data['doctolib_id'] for _, _, _, _, data, _ in parsed if data is not None}
+        existing_departments = {department.doctolib_id: department for department in self.db.query(Department).filter(
+            Department.doctolib_id.in_(list(doctolib_ids))
+        )}
 
-            # Returns the first matching doctolib ID from the db or None
-            # query(Department) - starts a query for Department objects
-            existing = self.db.query(Department).filter(
-                Department.doctolib_id == department.doctolib_id
-            ).first()
+        try:
+            for path, mtime_ns, size, sha256, data, error in parsed:
+                json_file = paths[path]
+                if data is None:
+                    logger.error(f"Error loading department from {json_file}: {error}")
+                    error_count += 1
+                    continue
+
+                entry = manifest.get(path)
+                if entry is not None and entry.sha256 == sha256 and not force:
+                    # Touched but not modified - only remember the new mtime
+                    entry.mtime_ns, entry.size = mtime_ns, size
+                    unchanged_count += 1
+                    continue
 
-            try:
                 # If there was a match
+                existing = existing_departments.get(data['doctolib_id'])
                 if existing:
-                    # Update fields we want to keep current
-                    logger.info(f"Updating department: {department.name} (ID: {department.doctolib_id})")
-                    existing.name = department.name
-                    existing.place_id = department.place_id
-                    existing.type = department.type
-                    
-                    # Geographic data (might get more accurate over time)
-                    existing.latitude = department.latitude
-                    existing.longitude = department.longitude
-                    
-                    # Bounding box (could change with map updates)
-                    existing.viewport_ne_lat = department.viewport_ne_lat
-                    existing.viewport_ne_lng = department.viewport_ne_lng
-                    existing.viewport_sw_lat = department.viewport_sw_lat
-                    existing.viewport_sw_lng = department.viewport_sw_lng
-                    
-                    # Zipcodes (rarely change, but possible)
-                    existing.zipcodes = department.zipcodes
-                    
+                    # Update fields we want to keep current (coordinates, viewport and zipcodes can change with map updates)
+                    logger.info(f"Updating department: {data['name']} (ID: {data['doctolib_id']})")
+                    for field, value in data.items():
+                        setattr(existing, field, value)
                     # Update timestamp to show when we last refreshed this department
                     existing.last_scraped = datetime.now(timezone.utc)
                     updated_count += 1
-                    # logger.info(f"Updated department: {department.name}")
-
                 else:
                     # Add new record
-                    logger.info(f"Adding department: {department.name} (ID: {department.doctolib_id})")
+                    logger.info(f"Adding department: {data['name']} (ID: {data['doctolib_id']})")
+                    department = Department(**data)
                     self.db.add(department)
+                    existing_departments[department.doctolib_id] = department
                     loaded_count += 1
 
-                # Commit each department individually to avoid batch conflicts
-                self.db.commit()
-
-            except Exception as e:
-                logger.error(f"Error processing department {department.name} from {json_file}: {e}")
-                self.db.rollback()
-                error_count += 1
+                if entry is None:
+                    entry = DepartmentFile(path=path)
+                    self.db.add(entry)
+                    manifest[path] = entry
+                entry.mtime_ns, entry.size, entry.sha256 = mtime_ns, size, sha256
+                entry.department_doctolib_id = data['doctolib_id']
+                entry.loaded_at = datetime.now(timezone.utc)
 
-        logger.info(f"Department loading complete: {loaded_count} new, {updated_count} updated, {error_count} errors")
+            # All departments and the manifest in one transaction
+            self.db.commit()
 
+        except Exception as e:
+            logger.error(f"Error saving departments, nothing was loaded: {e}")
+            self.db.rollback()
+            error_count += loaded_count + updated_count
+            loaded_count = updated_count = 0
+
+        logger.info(f"Department loading complete: {loaded_count} new, {updated_count} updated, "
+                    f"{unchanged_count} unchanged, {error_count} errors")
+
+    def _read_files(self, paths: List[str]) -> List[Tuple]:
+        """(path, mtime_ns, size, sha256, department data or None, error) for each file"""
+        if len(paths) < PARALLEL_READ_THRESHOLD:
+            return [_read_department_file(path) for path in paths]
+        # Large payload sets (several countries) are parsed on every core
+        with ProcessPoolExecutor() as executor:
+            return list(executor.map(_read_department_file, paths, chunksize=16))
     
     def get_department_by_name(self, name: str) -> Department:
         """Get department by name"""
@@ -145,6 +173,10 @@ class DepartmentLoader:
 
 def main():
     """Main finction to load departments"""
+    parser = argparse.ArgumentParser(description="Load department payloads into the database")
+    parser.add_argument('--force', action='store_true', help="Reload every file, even unchanged ones")
+    args = parser.parse_args()
+
     db = SessionLocal()
     # DepartmentLoader is the class, passes the db to its constructor
     # Gives db the access to this session
@@ -152,7 +184,7 @@ def main():
 
     try:
         # Load departments from JSON files
-        loader.load_all_departments()
+        loader.load_all_departments(force=args.force)
 
         # List what we have
         departments = loader.list_all_departments()
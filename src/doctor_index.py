@@ -0,0 +1,171 @@
+# src/doctor_index.py
+"""
+Compact in-memory index of the doctors already stored for a crawl.
+
+Loaded once before a department is crawled, it maps doctolib_id -> (primary key,
+fingerprint), so save_doctors_bulk can tell unchanged doctors from new or changed
+ones without a SELECT per row or per batch.
+
+To keep a full-France index small, doctolib_ids are not stored at all: each doctor
+is a 64-bit hash of its id (a collision among 100k doctors has a ~1e-10 chance),
+in a sorted array searched with bisect, next to flat arrays of primary keys and
+16-byte fingerprints - 32 bytes per doctor. Doctors first inserted during the
+crawl go into a small dict on the side.
+
+Usage: python src/doctor_index.py [--entries 100000]   (prints the memory footprint)
+"""
+import argparse
+import hashlib
+import logging
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_BYTES = 16
+_NO_FINGERPRINT = bytes(FINGERPRINT_BYTES)
+_UNKNOWN_ID = -1  # Inserted during this crawl - the database assigned the key, we did not read it back
+
+
+def _key(doctolib_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(doctolib_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _pack(fingerprint: Optional[str]) -> bytes:
+    return bytes.fromhex(fingerprint) if fingerprint else _NO_FINGERPRINT
+
+
+class DoctorIndex:
+    """doctolib_id -> (primary key, fingerprint) for the doctors of some departments"""
+
+    def __init__(self, rows: Iterable[Tuple[int, str, Optional[str]]] = ()):
+        keys, ids, fingerprints = array('Q'), array('q'), bytearray()
+        for doctor_id, doctolib_id, fingerprint in rows:
+            keys.append(_key(doctolib_id))
+            ids.append(doctor_id)
+            fingerprints += _pack(fingerprint)
+
+        # Sort all three arrays by key so lookups can bisect
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self._keys = array('Q', (keys[i] for i in order))
+        self._ids = array('q', (ids[i] for i in order))
+        self._fingerprints = bytearray(len(order) * FINGERPRINT_BYTES)
+        for slot, i in enumerate(order):
+            self._fingerprints[slot * FINGERPRINT_BYTES:(slot + 1) * FINGERPRINT_BYTES] = \
+                fingerprints[i * FINGERPRINT_BYTES:(i + 1) * FINGERPRINT_BYTES]
+        # Doctors added after loading: id hash -> (primary key, packed fingerprint)
+        self._added = {}
+
+    @classmethod
+    def load(cls, db: Session, department_ids: Optional[Iterable[int]] = None) -> "DoctorIndex":
+        """Index the stored doctors of the given departments (all doctors when None)"""
+        from models import Doctor
+
+        query = db.query(Doctor.id, Doctor.doctolib_id, Doctor.fingerprint)
+        if department_ids is not None:
+            query = query.filter(Doctor.department_id.in_(list(department_ids)))
+        index = cls(query.yield_per(10000))
+        logger.info(f"Loaded doctor index: {len(index)} doctors in {index.memory_bytes() / 1024:.0f} KiB")
+        return index
+
+    def __len__(self) -> int:
+        return len(self._keys) + len(self._added)
+
+    def __contains__(self, doctolib_id: str) -> bool:
+        return self.get(doctolib_id) is not None
+
+    def _slot(self, key: int) -> Optional[int]:
+        slot = bisect_left(self._keys, key)
+        if slot < len(self._keys) and self._keys[slot] == key:
+            return slot
+        return None
+
+    def get(self, doctolib_id: str) -> Optional[Tuple[Optional[int], Optional[str]]]:
+        """(primary key, fingerprint) of a stored doctor, or None if it is not in the index"""
+        key = _key(doctolib_id)
+        slot = self._slot(key)
+        if slot is not None:
+            doctor_id = self._ids[slot]
+            packed = bytes(self._fingerprints[slot * FINGERPRINT_BYTES:(slot + 1) * FINGERPRINT_BYTES])
+        elif key in self._added:
+            doctor_id, packed = self._added[key]
+        else:
+            return None
+        return (
+            None if doctor_id == _UNKNOWN_ID else doctor_id,
+            None if packed == _NO_FINGERPRINT else packed.hex(),
+        )
+
+    def fingerprint(self, doctolib_id: str) -> Optional[str]:
+        entry = self.get(doctolib_id)
+        return entry[1] if entry is not None else None
+
+    def set(self, doctolib_id: str, doctor_id: Optional[int], fingerprint: Optional[str]):
+        """Add or update a doctor - doctor_id None keeps the key already known, if any"""
+        key = _key(doctolib_id)
+        packed = _pack(fingerprint)
+        slot = self._slot(key)
+        if slot is not None:
+            if doctor_id is not None:
+                self._ids[slot] = doctor_id
+            self._fingerprints[slot * FINGERPRINT_BYTES:(slot + 1) * FINGERPRINT_BYTES] = packed
+            return
+        if doctor_id is None:
+            doctor_id = self._added.get(key, (_UNKNOWN_ID, None))[0]
+        self._added[key] = (doctor_id, packed)
+
+    def memory_bytes(self) -> int:
+        """Approximate footprint: the three arrays plus the dict of doctors added since loading"""
+        added = sum(sys.getsizeof(key) + sys.getsizeof(value) + sys.getsizeof(value[1])
+                    for key, value in self._added.items())
+        return (sys.getsizeof(self._keys) + sys.getsizeof(self._ids) + sys.getsizeof(self._fingerprints)
+                + sys.getsizeof(self._added) + added)
+
+
+def _simulated_doctors(entries: int):
+    for doctor_id in range(1, entries + 1):
+        doctolib_id = f"profile-{1000000 + doctor_id};practice-{doctor_id % 5000};medecin-generaliste"
+        yield doctor_id, doctolib_id, hashlib.blake2b(doctolib_id.encode(), digest_size=FINGERPRINT_BYTES).hexdigest()
+
+
+def _retained_bytes(build):
+    """Bytes still allocated after build() returns, and what it returned"""
+    import tracemalloc
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = build()
+    retained = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    tracemalloc.stop()
+    return retained, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the doctor index's memory footprint")
+    parser.add_argument('--entries', type=int, default=100000, help="Doctors in the simulated department")
+    args = parser.parse_args()
+
+    def build_index():
+        return DoctorIndex(_simulated_doctors(args.entries))
+
+    # The obvious alternative, for comparison: the real id strings -> (key, hex fingerprint)
+    def build_plain_dict():
+        return {doctolib_id: (doctor_id, fingerprint)
+                for doctor_id, doctolib_id, fingerprint in _simulated_doctors(args.entries)}
+
+    compact, index = _retained_bytes(build_index)
+    plain, _ = _retained_bytes(build_plain_dict)
+
+    print("=== DOCTOR INDEX MEMORY ===")
+    print(f"Entries: {len(index)}")
+    print(f"Compact index: {compact / 2 ** 20:.1f} MiB ({compact / len(index):.0f} bytes/doctor), "
+          f"estimated {index.memory_bytes() / 2 ** 20:.1f} MiB")
+    print(f"Plain dict of ids: {plain / 2 ** 20:.1f} MiB ({plain / args.entries:.0f} bytes/doctor)")
+
+
+if __name__ == "__main__":
+    main()
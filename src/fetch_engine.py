@@ -0,0 +1,562 @@
+# src/fetch_engine.py
+"""
+Asyncio fetch engine for the Doctolib search API.
+
+Keeps many (department, page) requests in flight under the scraper's shared
+RateController, which sets both the concurrency and the requests-per-second budget,
+and feeds every page into the same extraction -> save_doctors_bulk path
+as DoctolibScraper.scrape_department, through a write-behind writer thread.
+"""
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from functools import partial
+from datetime import datetime, timezone
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+from sqlalchemy.orm import Session
+
+from models import CrawlTask, Department
+from data_processors import extract_doctor_data
+from crawl_planner import CrawlJob, CrawlPlan, CrawlPlanner, pages_for_total
+from checkpoints import CheckpointStore
+from geo_partition import RESULT_CAP, SearchArea, is_capped
+from rate_controller import RateController, parse_retry_after
+from response_cache import ResponseCache, make_cache_key
+from provider_archive import encode_provider
+from transport import ReplayTransport
+from stream_decoder import CHUNK_SIZE, PROVIDERS_KEY, ProviderStreamDecoder
+from write_behind import WriteBehindWriter
+from presence import mark_removed
+from doctor_index import DoctorIndex
+
+logger = logging.getLogger(__name__)
+
+# Handles a final FetchResult on the event loop and returns the follow-up jobs it schedules
+OnResult = Callable[["FetchResult"], Awaitable[Optional[List[CrawlJob]]]]
+
+
+class ConcurrencyGate:
+    """Lets at most rate_controller.concurrency requests run at once, re-read on every acquire"""
+
+    def __init__(self, rate_controller: RateController):
+        self.rate_controller = rate_controller
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.rate_controller.concurrency)
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+
+@dataclass
+class FetchResult:
+    """Outcome of a CrawlJob"""
+    job: CrawlJob
+    status: Optional[int] = None
+    data: Optional[Dict[str, Any]] = None
+    latency: float = 0.0
+    error: Optional[str] = None
+    timed_out: bool = False
+    from_cache: bool = False
+    # A streamed page is extracted while it downloads: data then only holds its other fields ("total"),
+    # records the extracted doctors and archived the archive's encoded providers (if it has an archive)
+    records: Optional[List[Dict]] = None
+    archived: Optional[List[Tuple[str, bytes]]] = None
+    count: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.data is not None
+
+    @property
+    def total(self) -> Optional[int]:
+        return self.data.get('total') if self.data is not None else None
+
+    @property
+    def page_size(self) -> int:
+        """Providers on the page"""
+        if self.records is not None:
+            return self.count
+        return len(self.data.get(PROVIDERS_KEY, [])) if self.data is not None else 0
+
+
+@dataclass
+class EngineStats:
+    """Counters for a single engine run"""
+    requests: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    retried: int = 0
+    cache_hits: int = 0
+    doctors_saved: int = 0
+    duplicates: int = 0
+    partitions: int = 0
+    pages_done: int = 0
+    pages_known: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def progress(self) -> str:
+        return f"{self.pages_done}/{self.pages_known} pages"
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self.started_at
+        rate = self.requests / elapsed if elapsed > 0 else 0.0
+        return (f"{self.requests} requests ({self.succeeded} ok, {self.failed} failed, {self.retried} retried), "
+                f"{self.cache_hits} pages from cache, "
+                f"{self.doctors_saved} doctors saved ({self.duplicates} duplicates skipped, "
+                f"{self.partitions} searches split) in {elapsed:.1f}s ({rate:.2f} req/s)")
+
+
+class AsyncFetchEngine:
+    """Runs search requests concurrently on top of a DoctolibScraper's headers, cookies and rate controller"""
+
+    def __init__(self, scraper, max_concurrency: Optional[int] = None,
+                 requests_per_second: Optional[float] = None, timeout: float = 30,
+                 rate_controller: Optional[RateController] = None,
+                 response_cache: Optional[ResponseCache] = None):
+        self.scraper = scraper
+        self.response_cache = response_cache or scraper.response_cache
+        # Share the scraper's controller so sync and async requests draw from the same budget
+        self.rate_controller = rate_controller or scraper.rate_controller
+        # Explicit arguments become hard ceilings while this engine runs - the controller adapts underneath
+        # them, and the scraper's own caps are back once the run is over
+        self.requests_per_second = requests_per_second
+        self.concurrency_ceiling = max_concurrency
+        self.timeout = timeout
+        self.stats = EngineStats()
+        self._seen_ids = set()
+        self._writer: Optional[WriteBehindWriter] = None
+        # Per (specialty, department id): pages a complete search needs, and pages committed so far
+        self._pages_expected: Dict[Tuple[str, int], int] = {}
+        self._pages_saved: Dict[Tuple[str, int], int] = {}
+
+    @property
+    def max_concurrency(self) -> int:
+        return self.rate_controller.max_concurrency
+
+    def _client_session(self) -> aiohttp.ClientSession:
+        """Build an aiohttp session carrying the scraper's browser headers and cookies"""
+        headers = dict(self.scraper.headers)
+        # aiohttp only decodes brotli when the optional brotli package is installed
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        cookies = {cookie.name: cookie.value for cookie in self.scraper.session.cookies}
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        return aiohttp.ClientSession(
+            headers=headers,
+            cookies=cookies,
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    def cached(self, job: CrawlJob, body: bytes) -> Optional[FetchResult]:
+        """A result served from the response cache, if this page is cached"""
+        if self.response_cache is None:
+            return None
+        data = self.response_cache.get(make_cache_key(body, job.page))
+        if data is None:
+            return None
+        return FetchResult(job=job, status=200, data=data, from_cache=True)
+
+    async def fetch(self, client: aiohttp.ClientSession, job: CrawlJob, body: bytes) -> FetchResult:
+        """POST one search page and decode its JSON body"""
+        url = f'{self.scraper.base_url}/phs_proxy/raw?page={job.page}'
+        result = FetchResult(job=job)
+        started = time.monotonic()
+
+        if isinstance(self.scraper.transport, ReplayTransport):
+            return await self._replay(job, url, body, result, started)
+
+        try:
+            async with client.post(url, data=body) as response:
+                result.status = response.status
+                if response.status == 200:
+                    # Decode and extract providers as chunks arrive, so both overlap the rest of the transfer
+                    raw = await self._read_providers(response, result)
+                else:
+                    raw = await response.read()
+                if self.scraper.recorder is not None:
+                    self.scraper.recorder.record(url, body, response.status, time.monotonic() - started,
+                                                 raw, dict(response.headers))
+                if response.status == 200:
+                    if self.response_cache is not None:
+                        self.response_cache.put(make_cache_key(body, job.page), raw)
+                elif response.status == 403:
+                    logger.error(f"Access forbidden for {job.department.name} page {job.page}. Possible blocking.")
+                elif response.status == 429:
+                    logger.error(f"Rate limited for {job.department.name} page {job.page}. Need to slow down.")
+                else:
+                    logger.error(f"Unexpected status {response.status} for {job.department.name} page {job.page}")
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        except asyncio.TimeoutError:
+            result.timed_out = True
+            result.error = 'timeout'
+            retry_after = None
+            logger.error(f"Search request timed out for {job.department.name} page {job.page}")
+        except (aiohttp.ClientError, ValueError) as e:
+            result.error = str(e) or e.__class__.__name__
+            retry_after = None
+            logger.error(f"Search request failed for {job.department.name} page {job.page}: {result.error}")
+
+        result.latency = time.monotonic() - started
+        self.rate_controller.record(result.status, result.latency, retry_after=retry_after,
+                                    timed_out=result.timed_out)
+        return result
+
+    async def _read_providers(self, response: aiohttp.ClientResponse, result: FetchResult) -> Optional[bytes]:
+        """Decode a search page as it arrives, extracting each provider into result as soon as it is complete
+
+        Decoded providers are dropped once extracted - the archive gets their canonical JSON instead.
+        Returns the raw body only when the response cache or the recorder is there to store it.
+        """
+        keep_raw = self.scraper.recorder is not None or self.response_cache is not None
+        raw = [] if keep_raw else None
+        archived = [] if self.scraper.archive is not None else None
+        records = []
+        department_id = result.job.department.id
+        decoder = ProviderStreamDecoder()
+
+        def extract(providers: List[Dict]):
+            for provider in providers:
+                records.append(extract_doctor_data(provider, department_id))
+                if archived is not None:
+                    archived.append(encode_provider(provider))
+
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            if raw is not None:
+                raw.append(chunk)
+            extract(decoder.feed(chunk))
+        extract(decoder.close())
+        result.data = dict(decoder.fields)
+        result.records, result.archived, result.count = records, archived, decoder.count
+        return b''.join(raw) if raw is not None else None
+
+    async def _replay(self, job: CrawlJob, url: str, body: bytes, result: FetchResult,
+                      started: float) -> FetchResult:
+        """Answer a job from the scraper's replay transport instead of the network"""
+        response = await self.scraper.transport.post_async(url, data=body)
+        result.status = response.status_code
+        if response.status_code == 200:
+            result.data = response.json()
+        result.latency = time.monotonic() - started
+        self.rate_controller.record(result.status, result.latency)
+        return result
+
+    async def run(self, jobs: Iterable[CrawlJob], on_result: OnResult,
+                  on_dispatch: Optional[Callable[[CrawlJob], None]] = None):
+        """Fetch all jobs under the controller's limits and hand each final result to on_result.
+
+        on_result may return follow-up jobs (more pages, smaller search areas), which join the queue.
+        """
+        with self.rate_controller.ceiling(max_rate=self.requests_per_second, max_concurrency=self.concurrency_ceiling):
+            await self._run(jobs, on_result, on_dispatch)
+
+    async def _run(self, jobs: Iterable[CrawlJob], on_result: OnResult,
+                   on_dispatch: Optional[Callable[[CrawlJob], None]]):
+        queue: asyncio.Queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+            self.stats.pages_known += 1
+
+        gate = ConcurrencyGate(self.rate_controller)
+
+        async with self._client_session() as client:
+
+            async def finish(result: FetchResult):
+                # Results are handled on the event loop thread, so the db session is never shared across threads
+                follow_ups = await on_result(result) or []
+                for follow_up in follow_ups:
+                    queue.put_nowait(follow_up)
+                self.stats.pages_done += 1
+                self.stats.pages_known += len(follow_ups)
+                logger.info(f"Progress: {self.stats.progress()}")
+
+            async def handle(job: CrawlJob):
+                body = job.body if job.body is not None else self.scraper.search_body(job.specialty, job.department, job.area)
+                result = self.cached(job, body)
+                if result is not None:
+                    # Cached pages cost no rate budget at all
+                    self.stats.cache_hits += 1
+                    await finish(result)
+                    return
+
+                async with gate:
+                    await self.rate_controller.wait_async()
+                    if on_dispatch is not None and job.attempt == 0:
+                        on_dispatch(job)
+                    result = await self.fetch(client, job, body)
+                self.stats.requests += 1
+                if result.ok:
+                    self.stats.succeeded += 1
+                elif self.rate_controller.should_retry(result.status, job.attempt, timed_out=result.timed_out):
+                    # Back into the queue - the controller has already backed off, so it goes out later
+                    self.stats.retried += 1
+                    job.attempt += 1
+                    queue.put_nowait(job)
+                    return
+                else:
+                    self.stats.failed += 1
+                await finish(result)
+
+            async def worker():
+                while True:
+                    job = await queue.get()
+                    try:
+                        await handle(job)
+                    except Exception as e:
+                        logger.error(f"Error handling {job.department.name} page {job.page}: {e}")
+                    finally:
+                        queue.task_done()
+
+            workers = [asyncio.create_task(worker()) for _ in range(max(1, self.max_concurrency))]
+            # Follow-up jobs keep the queue busy, so wait for it to drain rather than for the workers
+            await queue.join()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def save_result(self, result: FetchResult, db: Session, checkpoints: Optional[CheckpointStore] = None,
+                          on_saved: Optional[Callable[[], None]] = None):
+        """Run a fetched page through the usual extraction and persistence path
+
+        on_saved runs once the page's doctors are committed - never if their batch failed.
+        """
+        loop = asyncio.get_running_loop()
+        if not result.ok:
+            if checkpoints is not None:
+                await loop.run_in_executor(None, partial(
+                    checkpoints.mark_failed_in_own_session, result.job, result.status, result.error
+                ))
+            return
+        job = result.job
+        logger.info(f"Found {result.page_size} doctors for {job.department.name} page {job.page + 1}")
+        if result.records is None:
+            # Served whole, from the response cache or a replay
+            providers = result.data.get(PROVIDERS_KEY, [])
+            archive = partial(self.scraper.archive_providers, job.specialty, job.department.id, providers)
+            records = [extract_doctor_data(provider, job.department.id) for provider in providers]
+        else:
+            archive = partial(self.scraper.archive_providers, job.specialty, job.department.id, result.archived,
+                              encoded=True)
+            records = result.records
+        # Compression and the archive's write transaction (up to its busy timeout) stay off the loop
+        await loop.run_in_executor(None, archive)
+        parsed_doctors = []
+        page_ids = set()
+        for record in records:
+            # Overlapping searches (partitioned areas, several specialties) return the same providers
+            doctolib_id = record['doctolib_id']
+            if doctolib_id in self._seen_ids or doctolib_id in page_ids:
+                self.stats.duplicates += 1
+                continue
+            page_ids.add(doctolib_id)
+            parsed_doctors.append(record)
+        # Only committed doctors count as seen - a page retried after a failed batch saves them again
+        saved = partial(self._seen_ids.update, page_ids)
+
+        # Only checkpoint once the page's doctors are committed, so a crash never skips unsaved data
+        if self._writer is not None:
+            mark_done = None
+            if checkpoints is not None:
+                mark_done = checkpoints.mark_done_on(job, result.page_size, result.total)
+
+            def on_committed(writer_db: Session):
+                saved()
+                if on_saved is not None:
+                    on_saved()
+                if mark_done is not None:
+                    mark_done(writer_db)
+
+            # put_page blocks while the writer is behind - wait for it off the loop, so responses
+            # in flight keep being read (and are not timed out) in the meantime
+            await loop.run_in_executor(None, partial(self._writer.put_page, parsed_doctors, on_committed))
+            return
+        self.stats.doctors_saved += self.scraper.save_doctors_bulk(parsed_doctors, db)
+        saved()
+        if checkpoints is not None:
+            checkpoints.mark_done(job, result.page_size, result.total)
+        if on_saved is not None:
+            on_saved()
+
+    @contextmanager
+    def _write_behind(self, db: Session, departments: Iterable[Department]):
+        """Save pages on a writer thread for the duration of a crawl, so fetching never waits on commits"""
+        # Stored doctors of the crawled departments, so saves know what changed without querying
+        index = DoctorIndex.load(db, {department.id for department in departments})
+        self._writer = WriteBehindWriter.for_session(partial(self.scraper.save_doctors_bulk, index=index), db)
+        try:
+            yield self._writer
+        finally:
+            self._writer.close()
+            self.stats.doctors_saved += self._writer.written
+            self._writer = None
+
+    def run_plan(self, plan: CrawlPlan, db: Session, checkpoints: Optional[CheckpointStore] = None,
+                 wait_for_retries: bool = True) -> EngineStats:
+        """Execute a compiled crawl plan, resuming from and recording to checkpoints when given"""
+        self.stats = EngineStats()
+        self._seen_ids = set()
+        jobs = checkpoints.resume(plan) if checkpoints is not None else plan
+        logger.info(f"Running crawl plan: {jobs.summary()}, limits {self.rate_controller.snapshot()}")
+
+        on_result = lambda result: self.save_result(result, db, checkpoints)
+        with self._write_behind(db, (job.department for job in plan.jobs)):
+            asyncio.run(self.run(jobs.jobs, on_result, self._on_dispatch(checkpoints)))
+            self._drain_retries(plan.jobs, on_result, checkpoints, wait_for_retries)
+
+        logger.info(f"Completed concurrent scrape: {self.stats.summary()} - controller {self.rate_controller.snapshot()}")
+        return self.stats
+
+    def _on_dispatch(self, checkpoints: Optional[CheckpointStore]):
+        return checkpoints.mark_in_flight if checkpoints is not None else None
+
+    def _drain_retries(self, jobs: List[CrawlJob], on_result: OnResult, checkpoints: Optional[CheckpointStore],
+                       wait_for_retries: bool):
+        """Work through the checkpoint retry queue until every page is done or dead"""
+        departments = {job.department.id: job.department for job in jobs}
+        while checkpoints is not None:
+            retries, next_due = checkpoints.due_retries(departments)
+            if retries.jobs:
+                logger.info(f"Retrying {retries.total_requests} failed pages - {checkpoints.progress()}")
+                asyncio.run(self.run(retries.jobs, on_result, self._on_dispatch(checkpoints)))
+            elif next_due is not None and wait_for_retries:
+                delay = (next_due - datetime.now(timezone.utc)).total_seconds()
+                logger.info(f"Next retry due in {delay:.0f}s")
+                time.sleep(max(0.0, delay))
+            else:
+                break
+
+    def next_pages(self, job: CrawlJob, total: Optional[int], page_size: int,
+                   max_pages: Optional[int]) -> List[CrawlJob]:
+        """Pages to schedule after this one, driven by the search's total"""
+        if job.page == 0:
+            pages = pages_for_total(total, page_size, max_pages)
+            if pages is not None:
+                # The total tells us exactly how many pages exist - schedule them all at once
+                return [CrawlJob(job.specialty, job.department, page, job.body, area=job.area)
+                        for page in range(1, pages)]
+
+        # No total in the response: fall back to probing one page at a time until one comes back empty
+        if total is None and page_size and (max_pages is None or job.page + 1 < max_pages):
+            return [CrawlJob(job.specialty, job.department, job.page + 1, job.body, area=job.area)]
+        return []
+
+    def _page_saved(self, search: Tuple[str, int]):
+        # Runs on the writer thread once the page is committed; only read after the writer is closed
+        self._pages_saved[search] = self._pages_saved.get(search, 0) + 1
+
+    async def paginate_result(self, result: FetchResult, db: Session, max_pages: Optional[int],
+                        checkpoints: Optional[CheckpointStore] = None) -> List[CrawlJob]:
+        """Save a page and schedule the rest of its search"""
+        job = result.job
+        search = (job.specialty, job.department.id)
+        await self.save_result(result, db, checkpoints, on_saved=partial(self._page_saved, search))
+        if not result.ok:
+            return []
+        total = result.total
+        page_size = result.page_size
+        if job.page == 0 and total is not None and not is_capped(total):
+            # Pages this search needs before its results are known to be complete
+            pages = pages_for_total(total, page_size)
+            if pages_for_total(total, page_size, max_pages) == pages:
+                self._pages_expected[search] = pages
+
+        follow_ups = self.next_pages(job, total, page_size, max_pages)
+        return checkpoints.unfinished(follow_ups) if checkpoints is not None else follow_ups
+
+    def scrape_departments(self, specialty: str, departments: List[Department], db: Session,
+                           max_pages: Optional[int] = None, checkpoints: Optional[CheckpointStore] = None,
+                           wait_for_retries: bool = True) -> EngineStats:
+        """Scrape every page of every department concurrently.
+
+        Only page 0 of each department is known up front; its total decides how many more pages
+        there are, and those are then fetched concurrently. max_pages optionally caps each search.
+        """
+        self.stats = EngineStats()
+        self._seen_ids = set()
+        self._pages_expected, self._pages_saved = {}, {}
+        crawl_started_at = datetime.now(timezone.utc)
+        roots = CrawlPlanner().compile([specialty], departments, max_pages=1).jobs
+        jobs = roots
+
+        if checkpoints is not None:
+            checkpoints.recover_in_flight()
+            checkpoints.register(roots)
+            jobs = []
+            for root in roots:
+                finished = checkpoints.finished(root)
+                if finished is None:
+                    jobs.append(root)
+                elif finished[0] == CrawlTask.DONE:
+                    # Page 0 was done in an earlier run - its stored total still tells us what is left
+                    status, doctors_found, total = finished
+                    jobs.extend(checkpoints.unfinished(self.next_pages(root, total, doctors_found or 0, max_pages)))
+            logger.info(f"Resuming: {len(jobs)} pages to fetch - {checkpoints.progress()}")
+
+        logger.info(f"Scraping {specialty} in {len(departments)} departments, limits {self.rate_controller.snapshot()}")
+        on_result = lambda result: self.paginate_result(result, db, max_pages, checkpoints)
+        with self._write_behind(db, departments):
+            asyncio.run(self.run(jobs, on_result, self._on_dispatch(checkpoints)))
+            self._drain_retries(roots, on_result, checkpoints, wait_for_retries)
+
+        # Searches fetched and committed end to end in this run know which of their doctors are gone
+        for (search_specialty, department_id), pages in self._pages_expected.items():
+            if self._pages_saved.get((search_specialty, department_id), 0) >= pages:
+                mark_removed(db, search_specialty, department_id, crawl_started_at)
+
+        logger.info(f"Completed concurrent scrape: {self.stats.summary()} - controller {self.rate_controller.snapshot()}")
+        return self.stats
+
+    async def partition_result(self, result: FetchResult, db: Session, max_pages: Optional[int],
+                         result_cap: int) -> List[CrawlJob]:
+        """Save a page, and for page 0 decide between splitting the search area and paging through it"""
+        await self.save_result(result, db)
+        job = result.job
+        if not result.ok:
+            return []
+        if job.page != 0:
+            return self.next_pages(job, result.total, result.page_size, max_pages)
+
+        total = result.total
+        area = job.area or SearchArea.from_department(job.department)
+
+        if is_capped(total, result_cap) and area.can_split():
+            children = area.split()
+            self.stats.partitions += 1
+            logger.info(f"{job.department.name} [{area.label}] hit the result cap ({total}), "
+                        f"splitting into {len(children)} areas")
+            return [
+                CrawlJob(job.specialty, job.department, 0,
+                         self.scraper.search_body(job.specialty, job.department, child), area=child)
+                for child in children
+            ]
+
+        if is_capped(total, result_cap):
+            logger.warning(f"{job.department.name} [{area.label}] is still capped at depth {area.depth}, "
+                           f"results beyond {result_cap} will be missed")
+
+        # A leaf under the cap: its total says exactly how many more pages there are
+        return self.next_pages(job, total, result.page_size, max_pages)
+
+    def scrape_partitioned(self, specialties: List[str], departments: List[Department], db: Session,
+                           max_pages: Optional[int] = None, result_cap: int = RESULT_CAP) -> EngineStats:
+        """Scrape departments completely, splitting any search whose total reaches result_cap"""
+        self.stats = EngineStats()
+        self._seen_ids = set()
+        roots = CrawlPlanner().compile(specialties, departments, max_pages=1)
+        logger.info(f"Partitioned scrape: {roots.summary()} to start with, result cap {result_cap}")
+
+        with self._write_behind(db, departments):
+            asyncio.run(self.run(roots.jobs, lambda result: self.partition_result(result, db, max_pages, result_cap)))
+
+        logger.info(f"Completed partitioned scrape: {self.stats.summary()}")
+        return self.stats
@@ -0,0 +1,216 @@
+# src/field_mapping.py
+"""
+Declarative JSON -> column mappings, compiled into plain Python extractors.
+
+A mapping is a tuple of Field entries, one per output column:
+
+    Field('city', 'location.city', '')                          # location.get('city', '')
+    Field('specialty', 'speciality.name', 'Médecin généraliste', COALESCE)
+    Field('name', 'location.place.name', mode=REQUIRED)         # payload['location']['place']['name']
+    Field('offers_online_booking', 'onlineBooking', transform=bool)
+    Field('is_organization', ('firstName', 'name'), transform='{0} is None and {1} is not None')
+    Field('department_id', None)                                # passed in by the caller
+
+Modes, for the source path and every object along it:
+    GET       dict.get - the default only when the key is absent, a null parent object
+              counts as {} (how extract_doctor_data always read nested objects)
+    COALESCE  the default when the value is missing or null, whatever stands in the way
+    REQUIRED  plain indexing - a missing key raises, for payloads that must be complete
+
+A transform is a callable, or an expression string whose {0}, {1}... are the source
+values - inlined into the generated code, so it costs no function call.
+
+compile_record_extractor turns a mapping into a function returning one dict per JSON
+object, compile_column_extractor into one taking a whole list and returning a list per
+column. Both are generated source, built once at import: paths are split, shared parent
+objects are read once, sources several fields use are read once, and literal defaults
+are inlined - nothing about the mapping is interpreted per object.
+"""
+from typing import Any, Callable, Dict, NamedTuple, Optional, Sequence, Tuple, Union
+
+GET = 'get'
+COALESCE = 'coalesce'
+REQUIRED = 'required'
+MODES = (GET, COALESCE, REQUIRED)
+
+_LITERAL_TYPES = (str, int, float, bool, type(None), list, dict, tuple)
+
+
+class Field(NamedTuple):
+    target: str
+    source: Union[str, Tuple[str, ...], None]  # Dotted path(s) - several are passed to transform in order
+    default: Any = None
+    mode: str = GET
+    transform: Union[Callable, str, None] = None
+
+
+def targets(mapping: Sequence[Field]) -> Tuple[str, ...]:
+    return tuple(field.target for field in mapping)
+
+
+class _Generator:
+    """Shared bookkeeping of the two code generators: one local per distinct read"""
+
+    def __init__(self, mapping: Sequence[Field]):
+        self.mapping = mapping
+        self.namespace: Dict[str, Any] = {}
+        self.statements = []  # (local name, kind, details)
+        self._locals: Dict[Tuple, str] = {}
+
+        for field in mapping:
+            if field.mode not in MODES:
+                raise ValueError(f"Field {field.target!r}: unknown mode {field.mode!r}, expected one of {MODES}")
+            if field.source is None and field.transform is not None:
+                raise ValueError(f"Field {field.target!r}: an argument field takes no transform")
+
+    def constant(self, value: Any) -> str:
+        """Source text for a default - literals inline (so mutable ones are fresh per object)"""
+        if isinstance(value, _LITERAL_TYPES):
+            text = repr(value)
+            try:
+                if eval(text, {}) == value:
+                    return text
+            except Exception:  # e.g. nan, or a container holding something without a literal form
+                pass
+        return self.bind(value, '_c')
+
+    def bind(self, value: Any, prefix: str) -> str:
+        name = f"{prefix}{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def _local(self, key: Tuple, kind: str, details: Tuple) -> str:
+        if key not in self._locals:
+            name = f"_v{len(self._locals)}"
+            self._locals[key] = name
+            self.statements.append((name, kind, details))
+        return self._locals[key]
+
+    def parent(self, keys: Tuple[str, ...], mode: str) -> Optional[str]:
+        """Local holding the object at keys (None for the top-level object)"""
+        if not keys:
+            return None
+        if mode == GET and ('parent', REQUIRED, keys) in self._locals:
+            # Already indexed for a required field - had it been missing or null, that field would have raised
+            return self._locals[('parent', REQUIRED, keys)]
+        return self._local(('parent', mode, keys), 'parent', (self.parent(keys[:-1], mode), keys[-1], mode))
+
+    def value(self, path: str, default: Any, mode: str) -> str:
+        keys = tuple(path.split('.'))
+        if mode == COALESCE:
+            return self._local(('value', mode, keys, repr(default)), 'coalesce', (keys, default))
+        return self._local(('value', mode, keys, repr(default)), 'value',
+                           (self.parent(keys[:-1], mode), keys[-1], mode, default))
+
+    def field(self, field: Field) -> str:
+        """Local (or argument) holding a field's final value"""
+        if field.source is None:
+            return field.target
+        paths = (field.source,) if isinstance(field.source, str) else tuple(field.source)
+        sources = tuple(self.value(path, field.default, field.mode) for path in paths)
+        if field.transform is None:
+            if len(sources) > 1:
+                raise ValueError(f"Field {field.target!r}: several sources need a transform to combine them")
+            return sources[0]
+        transform = field.transform if isinstance(field.transform, str) else self.bind(field.transform, '_t')
+        return self._local(('transform', field.target), 'transform', (transform, sources))
+
+    def arguments(self) -> Tuple[str, ...]:
+        return tuple(field.target for field in self.mapping if field.source is None)
+
+    def read(self, obj: str, key: str, mode: str, default: Any = None, parent: bool = False) -> str:
+        """Expression reading key from the object named obj"""
+        if mode == REQUIRED:
+            return f"{obj}[{key!r}]"
+        if parent:
+            return f"({obj}.get({key!r}) or {{}})"
+        if isinstance(default, (list, dict)):
+            # Avoids building an empty default for every object that has the key
+            return f"({obj}[{key!r}] if {key!r} in {obj} else {self.constant(default)})"
+        return f"{obj}.get({key!r}, {self.constant(default)})"
+
+
+def _coalescer(keys: Tuple[str, ...], default: Any) -> Callable:
+    """Value at keys, or default when it is missing or null anywhere along the way"""
+    def walk(data):
+        current = data
+        for key in keys:
+            if isinstance(current, dict) and key in current:
+                current = current[key]
+            else:
+                return default
+        return current if current is not None else default
+    return walk
+
+
+def _call(transform: str, arguments: Sequence[str]) -> str:
+    """Source text applying a transform - an inlined expression, or a call of a bound callable"""
+    if '{' in transform:
+        return f"({transform.format(*arguments)})"
+    return f"{transform}({', '.join(arguments)})"
+
+
+def _compile(name: str, arguments: Sequence[str], body: Sequence[str], namespace: Dict[str, Any],
+             doc: Optional[str]) -> Callable:
+    source = f"def {name}({', '.join(arguments)}):\n" + ''.join(f"    {line}\n" for line in body)
+    code = compile(source, f"<field_mapping {name}>", 'exec')
+    exec(code, namespace)
+    function = namespace[name]
+    function.__doc__ = doc
+    function.__source__ = source  # For debugging - print(extractor.__source__)
+    return function
+
+
+def compile_record_extractor(mapping: Sequence[Field], name: str = 'extract', doc: Optional[str] = None) -> Callable:
+    """function(data, *argument_fields) -> {target: value} in mapping order"""
+    generator = _Generator(mapping)
+    outputs = [(field.target, generator.field(field)) for field in mapping]
+    body = []
+    for local, kind, details in generator.statements:
+        if kind == 'parent':
+            parent, key, mode = details
+            body.append(f"{local} = {generator.read(parent or 'data', key, mode, parent=True)}")
+        elif kind == 'value':
+            parent, key, mode, default = details
+            body.append(f"{local} = {generator.read(parent or 'data', key, mode, default)}")
+        elif kind == 'coalesce':
+            keys, default = details
+            body.append(f"{local} = data.get({keys[0]!r})")
+            for key in keys[1:]:
+                body.append(f"{local} = {local}.get({key!r}) if isinstance({local}, dict) else None")
+            body.append(f"if {local} is None: {local} = {generator.constant(default)}")
+        else:
+            transform, sources = details
+            body.append(f"{local} = {_call(transform, sources)}")
+    body.append("return {" + ', '.join(f"{target!r}: {local}" for target, local in outputs) + "}")
+    return _compile(name, ('data',) + generator.arguments(), body, generator.namespace, doc)
+
+
+def compile_column_extractor(mapping: Sequence[Field], name: str = 'extract_columns',
+                             doc: Optional[str] = None) -> Callable:
+    """function(rows, *argument_fields) -> {target: [value per row]}, for whole pages at once"""
+    generator = _Generator(mapping)
+    outputs = [(field.target, generator.field(field)) for field in mapping]
+    body = []
+    for local, kind, details in generator.statements:
+        if kind == 'parent':
+            parent, key, mode = details
+            body.append(f"{local} = [{generator.read('o', key, mode, parent=True)} for o in {parent or 'rows'}]")
+        elif kind == 'value':
+            parent, key, mode, default = details
+            body.append(f"{local} = [{generator.read('o', key, mode, default)} for o in {parent or 'rows'}]")
+        elif kind == 'coalesce':
+            walk = generator.bind(_coalescer(*details), '_w')
+            body.append(f"{local} = list(map({walk}, rows))")
+        elif '{' in details[0]:
+            transform, sources = details
+            names = [f"x{i}" for i in range(len(sources))]
+            iterable = sources[0] if len(sources) == 1 else f"zip({', '.join(sources)})"
+            body.append(f"{local} = [{_call(transform, names)} for {', '.join(names)} in {iterable}]")
+        else:
+            transform, sources = details
+            body.append(f"{local} = list(map({transform}, {', '.join(sources)}))")
+    for argument in generator.arguments():
+        body.append(f"{argument} = [{argument}] * len(rows)")
+    body.append("return {" + ', '.join(f"{target!r}: {local}" for target, local in outputs) + "}")
+    return _compile(name, ('rows',) + generator.arguments(), body, generator.namespace, doc)
@@ -0,0 +1,93 @@
+# src/geo_partition.py
+"""
+Adaptive geographic partitioning of department searches.
+
+The search API never reports more than RESULT_CAP results for one query, so big
+departments (Paris, Rhône...) cannot be enumerated through a single viewport.
+When page 0 of a search says total >= RESULT_CAP, the search area is split -
+first by halving its zipcode list, then quadtree-style by cutting the viewport
+into four - and each part is searched again, recursively, until every leaf is
+under the cap.
+"""
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from models import Department
+
+# sample_api_response.json reports exactly this total for a whole-France search
+RESULT_CAP = 10000
+MAX_DEPTH = 10
+
+
+@dataclass
+class SearchArea:
+    """A part of a department to search: a viewport and the zipcodes inside it"""
+    ne_lat: float
+    ne_lng: float
+    sw_lat: float
+    sw_lng: float
+    zipcodes: List[str] = field(default_factory=list)
+    depth: int = 0
+    label: str = "root"
+
+    @classmethod
+    def from_department(cls, department: Department) -> "SearchArea":
+        return cls(
+            ne_lat=float(department.viewport_ne_lat),
+            ne_lng=float(department.viewport_ne_lng),
+            sw_lat=float(department.viewport_sw_lat),
+            sw_lng=float(department.viewport_sw_lng),
+            zipcodes=list(department.zipcodes or []),
+        )
+
+    @property
+    def center(self):
+        return (self.ne_lat + self.sw_lat) / 2, (self.ne_lng + self.sw_lng) / 2
+
+    def can_split(self) -> bool:
+        return self.depth < MAX_DEPTH
+
+    def split(self) -> List["SearchArea"]:
+        """Halve the zipcode list if there is more than one zipcode, otherwise quarter the viewport"""
+        if len(self.zipcodes) > 1:
+            # Zipcodes are the tightest filter the search place carries, and cost 2 queries instead of 4
+            middle = len(self.zipcodes) // 2
+            halves = (self.zipcodes[:middle], self.zipcodes[middle:])
+            return [
+                SearchArea(self.ne_lat, self.ne_lng, self.sw_lat, self.sw_lng, list(half),
+                           self.depth + 1, f"{self.label}/z{index}")
+                for index, half in enumerate(halves)
+            ]
+
+        mid_lat, mid_lng = self.center
+        quadrants = {
+            'ne': (self.ne_lat, self.ne_lng, mid_lat, mid_lng),
+            'nw': (self.ne_lat, mid_lng, mid_lat, self.sw_lng),
+            'se': (mid_lat, self.ne_lng, self.sw_lat, mid_lng),
+            'sw': (mid_lat, mid_lng, self.sw_lat, self.sw_lng),
+        }
+        return [
+            SearchArea(ne_lat, ne_lng, sw_lat, sw_lng, list(self.zipcodes), self.depth + 1, f"{self.label}/{name}")
+            for name, (ne_lat, ne_lng, sw_lat, sw_lng) in quadrants.items()
+        ]
+
+
+def apply_area(payload: dict, area: Optional[SearchArea]) -> dict:
+    """Narrow a department search payload down to one area (in place)"""
+    if area is None:
+        return payload
+    place = payload["location"]["place"]
+    center_lat, center_lng = area.center
+    place["viewport"] = {
+        "northeast": {"lat": area.ne_lat, "lng": area.ne_lng},
+        "southwest": {"lat": area.sw_lat, "lng": area.sw_lng},
+    }
+    place["gpsPoint"] = {"lat": center_lat, "lng": center_lng}
+    place["zipcodes"] = list(area.zipcodes)
+    return payload
+
+
+def is_capped(total: Optional[int], result_cap: int = RESULT_CAP) -> bool:
+    """Whether a search's total means there are results we cannot page through"""
+    return total is not None and total >= result_cap
+
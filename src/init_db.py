@@ -1,7 +1,9 @@
 #src/init_db.py
-from .database import engine, Base
+from .database import engine, Base, add_missing_columns, add_missing_indexes
 from .models import Doctor
 
 print("Creating database tables...")
 Base.metadata.create_all(bind=engine)
+add_missing_columns(engine)
+add_missing_indexes(engine)
 print("Tables created!")
\ No newline at end of file
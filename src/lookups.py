@@ -0,0 +1,235 @@
+# src/lookups.py
+"""
+Compact encodings for repeated doctor attributes.
+
+Specialties, regulation sectors and cities are dictionary tables referenced by small
+integer foreign keys; LookupCache resolves their strings to ids (creating rows the
+first time a value is seen) and keeps them in memory for the rest of the run. The ids
+are kept alongside the strings, which stay populated. New lookup rows are part of the
+saving session's transaction, and only shared with other saves once it commits.
+
+Payment means, languages and services come from small closed sets, stored as integer
+bitmasks - bit i is set when vocabulary[i] is in the list. The vocabularies are
+append-only: a value's bit position must never change once data has been written.
+Values outside a vocabulary are not lost, they stay in the JSON columns.
+
+New saves fill these columns; rows stored before they existed are filled by the
+next crawl that sees them, or right away with:
+
+Usage: python src/lookups.py   (backfills doctors whose masks/ids are still empty)
+"""
+import logging
+import threading
+import weakref
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, event, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import City, Doctor, RegulationSector, Specialty
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_METHODS = ('cash', 'check', 'credit_card')
+SERVICES = ('profile', 'onlineBooking')
+# Doctolib shows spoken languages as flag (country) codes
+LANGUAGES = (
+    'fr', 'gb', 'es', 'de', 'it', 'pt', 'ar', 'ma', 'dz', 'tn', 'il', 'cn', 'ru', 'nl', 'pl', 'ro',
+    'tr', 'gr', 'jp', 'vn', 'in', 'ir', 'ua', 'bg', 'hu', 'cz', 'se', 'dk', 'no', 'fi', 'br', 'lb',
+    'am', 'al', 'rs', 'hr', 'sk', 'kr', 'th', 'pk', 'bd', 'sn', 'ml', 'cd', 'ht', 'kh', 'la', 'lk',
+)  # At most 63 entries - masks are signed 64-bit integers
+# Set on doctor dicts by LookupCache.resolve
+LOOKUP_ID_FIELDS = frozenset({'specialty_id', 'regulation_sector_id', 'city_id'})
+_INSERT_IGNORE = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def to_mask(values: Optional[Iterable[str]], vocabulary: Sequence[str]) -> int:
+    """Bitmask of the values that are in vocabulary"""
+    mask = 0
+    for value in values or ():
+        if value in vocabulary:
+            mask |= 1 << vocabulary.index(value)
+        else:
+            logger.debug(f"{value!r} is not in the bitmask vocabulary, only kept in JSON")
+    return mask
+
+
+def from_mask(mask: Optional[int], vocabulary: Sequence[str]) -> List[str]:
+    """The vocabulary values whose bits are set in mask"""
+    if not mask:
+        return []
+    return [value for bit, value in enumerate(vocabulary) if mask & (1 << bit)]
+
+
+def _query_mask(values: Iterable[str], vocabulary: Sequence[str]) -> int:
+    values = list(values)
+    unknown = [value for value in values if value not in vocabulary]
+    if unknown:
+        # Silently dropping them would widen the filter instead of failing it
+        raise ValueError(f"{unknown} are not in the bitmask vocabulary {vocabulary}")
+    return to_mask(values, vocabulary)
+
+
+def has_all(column, vocabulary: Sequence[str], values: Iterable[str]):
+    """SQL condition: the mask column has every one of values"""
+    mask = _query_mask(values, vocabulary)
+    return column.op('&')(mask) == mask
+
+
+def has_any(column, vocabulary: Sequence[str], values: Iterable[str]):
+    """SQL condition: the mask column has at least one of values"""
+    return column.op('&')(_query_mask(values, vocabulary)) != 0
+
+
+def speaks(*languages: str):
+    """Doctors speaking all of languages, e.g. db.query(Doctor).filter(speaks('gb', 'es'))"""
+    return has_all(Doctor.languages_mask, LANGUAGES, languages)
+
+
+def accepts_payment(*methods: str):
+    """Doctors accepting all of the payment methods"""
+    return has_all(Doctor.payment_methods_mask, PAYMENT_METHODS, methods)
+
+
+def offers_services(*services: str):
+    """Doctors offering all of services"""
+    return has_all(Doctor.services_mask, SERVICES, services)
+
+
+class LookupCache:
+    """Lookup key -> id for the dictionary tables, created on first sight and cached for the run"""
+
+    def __init__(self):
+        self._ids: Dict[Tuple, int] = {}  # Committed
+        # Resolved in a session's open transaction - cached for everyone once it commits, dropped on rollback
+        self._uncommitted: "weakref.WeakKeyDictionary[Session, Dict[Tuple, int]]" = weakref.WeakKeyDictionary()
+        self._listening: "weakref.WeakSet[Session]" = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def resolve(self, doctor_dicts: Iterable[Dict], db: Session):
+        """Set specialty_id, regulation_sector_id and city_id on extracted doctors (in place)
+
+        Lookup rows it creates are flushed in db's transaction and committed (or rolled
+        back) with the doctors that reference them.
+        """
+        # Ids are only meaningful in the database they came from
+        database = str(db.get_bind().url)
+        with self._lock:
+            uncommitted = self._session_ids(db)
+            for doctor in doctor_dicts:
+                lookups = (
+                    ('specialty_id', Specialty, {'slug': doctor.get('specialty_slug')},
+                     {'name': doctor.get('specialty')}),
+                    ('regulation_sector_id', RegulationSector, {'code': doctor.get('regulation_sector')}, {}),
+                    ('city_id', City, {'name': doctor.get('city'), 'postal_code': doctor.get('postal_code') or ''},
+                     {'department_id': doctor.get('department_id')}),
+                )
+                for field, model, key, extra in lookups:
+                    doctor[field] = self._id(db, database, model, key, extra, uncommitted)
+
+    def _session_ids(self, db: Session) -> Dict[Tuple, int]:
+        """The ids resolved in db's current transaction"""
+        if db not in self._listening:
+            event.listen(db, 'after_commit', self._committed)
+            event.listen(db, 'after_soft_rollback', self._rolled_back)
+            self._listening.add(db)
+        return self._uncommitted.setdefault(db, {})
+
+    def _committed(self, db: Session):
+        # Also fired when a savepoint is released (see _id) - the outer transaction can still roll back
+        if db.in_nested_transaction():
+            return
+        with self._lock:
+            self._ids.update(self._uncommitted.pop(db, {}))
+
+    def _rolled_back(self, db: Session, previous_transaction):
+        # Savepoints roll back too (see _id) - only the outermost transaction takes the rows with it
+        if previous_transaction.parent is None:
+            with self._lock:
+                self._uncommitted.pop(db, None)
+
+    def _id(self, db: Session, database: str, model, key: Dict, extra: Dict,
+            uncommitted: Dict[Tuple, int]) -> Optional[int]:
+        """Id of the row matching key, inserting it if needed; None without a value"""
+        if not next(iter(key.values())):
+            return None
+        cache_key = (database, model.__tablename__, *key.values())
+        if cache_key in self._ids:
+            return self._ids[cache_key]
+        if cache_key in uncommitted:
+            return uncommitted[cache_key]
+
+        query = db.query(model.id).filter_by(**key)
+        lookup_id = query.scalar()
+        if lookup_id is None:
+            dialect = db.get_bind().dialect.name
+            if dialect in _INSERT_IGNORE:
+                # Another worker may insert it first; no savepoint, which pysqlite would commit on release
+                db.execute(_INSERT_IGNORE[dialect](model).values(**key, **extra).on_conflict_do_nothing())
+                lookup_id = query.scalar()
+            else:
+                try:
+                    with db.begin_nested():
+                        row = model(**key, **extra)
+                        db.add(row)
+                    lookup_id = row.id
+                except IntegrityError:
+                    lookup_id = query.scalar()
+        uncommitted[cache_key] = lookup_id
+        return lookup_id
+
+
+def backfill(db: Session, cache: Optional[LookupCache] = None, batch_size: int = 1000) -> int:
+    """Fill the mask and lookup id columns of doctors saved before they existed"""
+    cache = cache or LookupCache()
+    fields = ('id', 'specialty', 'specialty_slug', 'regulation_sector', 'city', 'postal_code', 'department_id',
+              'payment_methods', 'languages', 'services')
+    table = Doctor.__table__
+    derived = ('specialty_id', 'regulation_sector_id', 'city_id',
+               'payment_methods_mask', 'languages_mask', 'services_mask')
+    statement = update(table).where(table.c.id == bindparam('doctor_id')).values(
+        **{column: bindparam(column) for column in derived},
+        # Derived columns only - the record itself did not change
+        updated_at=table.c.updated_at,
+    )
+    filled = 0
+    while True:
+        rows = db.query(*(getattr(Doctor, field) for field in fields)).filter(
+            Doctor.languages_mask.is_(None)
+        ).order_by(Doctor.id).limit(batch_size).all()
+        if not rows:
+            return filled
+        doctors = [dict(zip(fields, row)) for row in rows]
+        cache.resolve(doctors, db)
+        db.execute(statement, [{
+            'doctor_id': doctor['id'],
+            'specialty_id': doctor['specialty_id'],
+            'regulation_sector_id': doctor['regulation_sector_id'],
+            'city_id': doctor['city_id'],
+            'payment_methods_mask': to_mask(doctor['payment_methods'], PAYMENT_METHODS),
+            'languages_mask': to_mask(doctor['languages'], LANGUAGES),
+            'services_mask': to_mask(doctor['services'], SERVICES),
+        } for doctor in doctors])
+        db.commit()
+        filled += len(doctors)
+        logger.info(f"Backfilled {filled} doctors")
+
+
+def main():
+    from database import Base, SessionLocal, add_missing_columns, add_missing_indexes, engine
+
+    logging.basicConfig(level=logging.INFO)
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    add_missing_indexes(engine)
+    db = SessionLocal()
+    try:
+        print(f"Backfilled {backfill(db)} doctors")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,16 @@ import sys
 
 sys.path.append(os.path.dirname(__file__))
     
-from database import SessionLocal, engine, Base
+from database import SessionLocal, engine, Base, add_missing_columns, add_missing_indexes
 from scraper import DoctolibScraper
 from department_loader import DepartmentLoader
 from models import Doctor, Department
+from response_cache import ResponseCache
+from provider_archive import ProviderArchive
+from transport import ReplayTransport, ResponseRecorder
+from checkpoints import migrate_crawl_tasks
+from spatial import ensure_spatial_index
+import config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,12 +27,21 @@ def main():
     # Create table if they don't exist
     try:
         Base.metadata.create_all(bind=engine)
+        migrate_crawl_tasks(engine)
+        added = add_missing_columns(engine)
+        if added:
+            logger.info(f"Added new columns to the database: {', '.join(added)}")
+        added = add_missing_indexes(engine)
+        if added:
+            logger.info(f"Added new indexes to the database: {', '.join(added)}")
+        ensure_spatial_index(engine)
         logger.info("Database tables created/verified")
     except Exception as e:
         logger.error(f"Error creating tables: {e}")
         return
 
     db = SessionLocal()
+    recorder = None
 
     try:
         # Load department first
@@ -34,8 +49,17 @@ def main():
         department_payloads_path = os.path.join(os.path.dirname(__file__), "..", "department_payloads")
         loader.load_all_departments(department_payloads_path) # Path from project root
 
-        # Initialize scraper
-        scraper = DoctolibScraper()
+        # Initialize scraper - search pages are cached on disk so reruns skip pages we already have
+        transport = None
+        if config.REPLAY_RESPONSES_DIR:
+            transport = ReplayTransport(config.REPLAY_RESPONSES_DIR, reproduce_latency=config.REPLAY_REPRODUCE_LATENCY)
+        recorder = ResponseRecorder(config.RECORD_RESPONSES_DIR) if config.RECORD_RESPONSES_DIR else None
+        scraper = DoctolibScraper(
+            response_cache=ResponseCache.from_config(),
+            transport=transport,
+            recorder=recorder,
+            archive=ProviderArchive.from_config(),
+        )
 
         # Test with sample data first
         logger.info("🧪 Testing with sample data...")
@@ -55,19 +79,23 @@ def main():
         # # Get specific departments to scrape (start small)
         # target_departments = ["Paris", "Rhône"]
         # specialty = "medecin-generaliste"
+        # # Pages finished by a previous (possibly crashed) run are skipped
+        # checkpoints = CheckpointStore(db)
 
         # for dept_name in target_departments:
         #     department = loader.get_department_by_name(dept_name)
         #     if department:
         #         logger.info(f"Scraping {specialty} in {department.name}")
         #         # Small test = scrape just 2 pages (40 docs)
-        #         scraper.scrape_department(specialty, department, db, max_pages=2)
+        #         scraper.scrape_department(specialty, department, db, max_pages=2, checkpoints=checkpoints)
         #     else:
         #         logger.warning(f"Department {dept_name} not found in database")
 
         # Print summary
         doctor_count = db.query(Doctor).count()
         logger.info(f"Scraping complete! Total doctors in database: {doctor_count}")
+        if scraper.response_cache is not None:
+            logger.info(f"Response cache: {scraper.response_cache.stats()}")
 
     except Exception as e:
         logger.error(f"Scraping failed: {e}")
@@ -75,6 +103,8 @@ def main():
         logger.error(traceback.format_exc())
         db.rollback()
     finally:
+        if recorder is not None:
+            recorder.close()
         db.close()
         logger.info("Database connection closed")
 
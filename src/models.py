@@ -1,5 +1,5 @@
 # src/models.py
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, DateTime, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Float, ForeignKey, DateTime, JSON, UniqueConstraint, Index, true
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from database import Base
@@ -12,6 +12,17 @@ When you move to PostgreSQL or MySQL in production, the timezone awareness will
 
 class Doctor(Base):
     __tablename__ = "doctors"
+    # The access patterns of queries.py - SQLite appends the rowid (id) to every index, so
+    # equality on all of an index's columns comes back already in keyset order. Equality on
+    # a leading column alone does not (the rest of the index sorts first), hence the plain
+    # postal_code index next to postal_code + specialty
+    __table_args__ = (
+        Index('ix_doctors_department_specialty', 'department_id', 'specialty_slug'),
+        Index('ix_doctors_postal_code_specialty', 'postal_code', 'specialty_slug'),
+        Index('ix_doctors_postal_code', 'postal_code'),
+        Index('ix_doctors_new_patients_sector', 'accepts_new_patients', 'regulation_sector'),
+        Index('ix_doctors_city', 'city'),
+    )
     
     # Primary key and identifiers
     id = Column(Integer, primary_key=True, index=True)
@@ -29,6 +40,8 @@ class Doctor(Base):
     specialty = Column(String)  # "Médecin généraliste"
     specialty_slug = Column(String)  # "medecin-generaliste"
     regulation_sector = Column(String)  # "contracted_1"
+    specialty_id = Column(Integer, ForeignKey('specialties.id'), nullable=True, index=True)
+    regulation_sector_id = Column(Integer, ForeignKey('regulation_sectors.id'), nullable=True, index=True)
     practitioner_type = Column(String)  # "INDIVIDUAL_PRACTITIONER", "ORGANIZATION"
     
     # Location information
@@ -50,6 +63,11 @@ class Doctor(Base):
     offers_telehealth = Column(Boolean, default=False)
     accepts_new_patients = Column(Boolean, default=True)
     
+    # The same lists as bitmasks over the vocabularies in lookups.py, for cheap filtering
+    payment_methods_mask = Column(Integer, nullable=True)
+    languages_mask = Column(BigInteger, nullable=True)
+    services_mask = Column(Integer, nullable=True)
+
     # Detailed service information (store as JSON for flexibility)
     online_booking_details = Column(JSON)  # agendaIds, topSpecialities, etc.
     payment_methods = Column(JSON)  # ["cash", "check", "credit_card"]
@@ -73,9 +91,16 @@ class Doctor(Base):
     minimum_fee = Column(Float, nullable=True)
     
     # Foreign keys
-    # city_id = Column(Integer, ForeignKey('cities.id'), nullable=True)
+    city_id = Column(Integer, ForeignKey('cities.id'), nullable=True, index=True)
     department_id = Column(Integer, ForeignKey('departments.id'))
 
+    # Hash of the extracted record - a re-crawl that finds the same hash only bumps last_seen
+    fingerprint = Column(String(32), nullable=True)
+
+    # Presence - a complete crawl of the doctor's department/specialty that no longer returns it marks it removed
+    is_active = Column(Boolean, default=True, server_default=true())
+    removed_at = Column(DateTime, nullable=True)
+
     # Timestamps - use timezone-aware datetimes
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), 
@@ -83,7 +108,9 @@ class Doctor(Base):
     last_seen = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     
     # Relationships
-    # city = relationship("City", back_populates="doctors")
+    city_ref = relationship("City", back_populates="doctors")  # city itself is the legacy string column
+    specialty_ref = relationship("Specialty", back_populates="doctors")
+    regulation_sector_ref = relationship("RegulationSector", back_populates="doctors")
     department = relationship("Department", back_populates="doctors")
 
 
@@ -119,26 +146,119 @@ class Department(Base):
     last_updated = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
     # Relationships
-    # cities = relationship("City", back_populates="department")
+    cities = relationship("City", back_populates="department")
     doctors = relationship("Doctor", back_populates="department")
 
 
 
-# class City(Base):
-#     __tablename__ = "cities"
+class DepartmentFile(Base):
+    """A department payload file as of its last load - unchanged files are not read again"""
+    __tablename__ = "department_files"
 
-#     id = Column(Integer, primary_key=True, index=True)
-#     name = Column(String, index=True)
-#     postal_code = Column(String, index=True)
-#     latitude = Column(Float(10, 7))
-#     longitude = Column(Float(10, 7))
-    
-#     # Foreign key
-#     department_id = Column(Integer, ForeignKey('departments.id'))
-    
-#     # Timestamps
-#     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
-    
-#     # Relationships
-#     department = relationship("Department", back_populates="cities")
-#     doctors = relationship("Doctor", back_populates="city")
\ No newline at end of file
+    path = Column(String, primary_key=True)  # Absolute path of the JSON file
+    mtime_ns = Column(BigInteger, nullable=False)  # Nanoseconds since the epoch - past 32 bits
+    size = Column(BigInteger, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    department_doctolib_id = Column(Integer, nullable=True)  # Department the file describes
+    loaded_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+
+class CrawlRun(Base):
+    """One pass over a set of searches - a recurring crawl starts a new run, a resumed one keeps its run"""
+    __tablename__ = "crawl_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    label = Column(String, nullable=True)
+    started_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    finished_at = Column(DateTime, nullable=True)  # Set once every task of the run is done or dead
+
+
+
+class CrawlTask(Base):
+    """One (specialty, department, page) search request of a crawl run and how far it got - the crawl checkpoint"""
+    __tablename__ = "crawl_tasks"
+    __table_args__ = (
+        UniqueConstraint('run_id', 'specialty', 'department_id', 'page', name='uq_crawl_task_run'),
+        Index('ix_crawl_tasks_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    # Lifecycle: pending -> in_flight -> done, or -> failed (retried with backoff) -> dead
+    PENDING = "pending"
+    IN_FLIGHT = "in_flight"
+    DONE = "done"
+    FAILED = "failed"
+    DEAD = "dead"
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(Integer, ForeignKey('crawl_runs.id'), nullable=False)  # Leads uq_crawl_task_run, so it is indexed
+    specialty = Column(String, nullable=False)  # "medecin-generaliste"
+    department_id = Column(Integer, ForeignKey('departments.id'), nullable=False)
+    page = Column(Integer, nullable=False)
+
+    status = Column(String, nullable=False, default=PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=True)  # When a failed task may be retried
+    last_status = Column(Integer, nullable=True)  # Last HTTP status, null for timeouts
+    last_error = Column(String, nullable=True)
+    doctors_found = Column(Integer, nullable=True)
+    total_results = Column(Integer, nullable=True)  # The response's "total", recorded for page 0 so resumes know the page count
+
+    # Leases for distributed workers - an in-flight task whose lease expired is handed to someone else
+    lease_owner = Column(String, nullable=True)  # "hostname:pid"
+    lease_expires_at = Column(DateTime, nullable=True)
+
+    # Timestamps - use timezone-aware datetimes
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    completed_at = Column(DateTime, nullable=True)
+
+    run = relationship("CrawlRun")
+    department = relationship("Department")
+
+
+
+class Specialty(Base):
+    """Lookup table - doctors reference their specialty by id"""
+    __tablename__ = "specialties"
+
+    id = Column(Integer, primary_key=True, index=True)
+    slug = Column(String, unique=True, nullable=False)  # "medecin-generaliste"
+    name = Column(String)  # "Médecin généraliste"
+
+    doctors = relationship("Doctor", back_populates="specialty_ref")
+
+
+
+class RegulationSector(Base):
+    """Lookup table - doctors reference their regulation sector by id"""
+    __tablename__ = "regulation_sectors"
+
+    id = Column(Integer, primary_key=True, index=True)
+    code = Column(String, unique=True, nullable=False)  # "contracted_1"
+
+    doctors = relationship("Doctor", back_populates="regulation_sector_ref")
+
+
+
+class City(Base):
+    __tablename__ = "cities"
+    __table_args__ = (
+        UniqueConstraint('name', 'postal_code', name='uq_city_name_postal_code'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, index=True, nullable=False)
+    postal_code = Column(String, index=True, nullable=False)
+    latitude = Column(Float(10, 7))
+    longitude = Column(Float(10, 7))
+
+    # Foreign key
+    department_id = Column(Integer, ForeignKey('departments.id'))
+
+    # Timestamps
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    # Relationships
+    department = relationship("Department", back_populates="cities")
+    doctors = relationship("Doctor", back_populates="city_ref")
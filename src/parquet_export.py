@@ -0,0 +1,204 @@
+# src/parquet_export.py
+"""
+Export of the doctors table to a Parquet dataset, for analysis outside the database.
+
+The dataset is hive-partitioned - <output>/department_id=69/specialty_slug=dentiste/
+part-0.parquet - so pyarrow, pandas, DuckDB or Spark can read one department or
+specialty without touching the rest. Columns are typed, low-cardinality strings are
+dictionary-encoded, and the list-valued fields (payment methods, languages, services)
+are Parquet lists.
+
+Each partition is read in keyset-paginated chunks and written one row group per
+chunk, so memory stays flat whatever the table size. Exports are incremental: a
+manifest records a signature per partition (row count, latest updated_at and
+removed_at, active count) and only partitions whose signature changed are rewritten.
+last_seen is not exported - every crawl bumps it, which would make every partition
+look changed.
+
+Requires pyarrow, which the crawler itself does not need: pip install -r requirements-parquet.txt
+
+Usage: python src/parquet_export.py [--output exports/doctors] [--full]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import Doctor
+from queries import DoctorFilter, iter_doctors
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Optional - only this export needs it
+    pa = pq = None
+
+MANIFEST_NAME = "_manifest.json"
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"  # What hive-style readers expect for a null key
+CHUNK_SIZE = 10000
+
+# Exported columns and their Parquet types, by kind
+_DICTIONARY = ('title', 'gender', 'specialty', 'regulation_sector', 'practitioner_type', 'city',
+               'postal_code', 'country', 'organization_status', 'visit_motive_name')
+_STRING = ('doctolib_id', 'profile_url', 'first_name', 'last_name', 'organization_name', 'address',
+           'phone_number', 'legacy_id', 'cloudinary_public_id', 'fingerprint')
+_INT = ('id', 'reference_id', 'practice_id', 'visit_motive_id', 'specialty_id', 'regulation_sector_id',
+        'city_id', 'payment_methods_mask', 'languages_mask', 'services_mask')
+_FLOAT = ('latitude', 'longitude', 'minimum_fee')
+_BOOL = ('offers_online_booking', 'offers_telehealth', 'accepts_new_patients', 'is_organization',
+         'exact_match', 'is_active')
+_TIMESTAMP = ('created_at', 'updated_at', 'removed_at')
+_STRING_LIST = ('payment_methods', 'languages', 'services')
+_JSON = ('online_booking_details', 'administrative_areas', 'visit_motive_agenda_ids', 'visit_motive_insurance_sector')
+
+EXPORT_COLUMNS = _DICTIONARY + _STRING + _INT + _FLOAT + _BOOL + _TIMESTAMP + _STRING_LIST + _JSON
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The Parquet export needs pyarrow: pip install -r requirements-parquet.txt")
+
+
+def export_schema() -> "pa.Schema":
+    _require_pyarrow()
+    fields = (
+        [pa.field(name, pa.dictionary(pa.int32(), pa.string())) for name in _DICTIONARY]
+        + [pa.field(name, pa.string()) for name in _STRING]
+        + [pa.field(name, pa.int64()) for name in _INT]
+        + [pa.field(name, pa.float64()) for name in _FLOAT]
+        + [pa.field(name, pa.bool_()) for name in _BOOL]
+        + [pa.field(name, pa.timestamp('us')) for name in _TIMESTAMP]
+        + [pa.field(name, pa.list_(pa.string())) for name in _STRING_LIST]
+        + [pa.field(name, pa.string()) for name in _JSON]  # Free-form nested data, kept as JSON text
+    )
+    return pa.schema(fields)
+
+
+def partition_signatures(db: Session) -> Dict[str, list]:
+    """Partition path -> signature that changes whenever a row of the partition is written"""
+    rows = db.query(
+        Doctor.department_id, Doctor.specialty_slug, func.count(Doctor.id),
+        func.max(Doctor.updated_at), func.max(Doctor.removed_at),
+        func.count(Doctor.id).filter(Doctor.is_active.is_(True)),
+    ).group_by(Doctor.department_id, Doctor.specialty_slug)
+    return {
+        partition_path(department_id, specialty_slug): [count, str(updated_at), str(removed_at), active]
+        for department_id, specialty_slug, count, updated_at, removed_at, active in rows
+    }
+
+
+def partition_path(department_id: Optional[int], specialty_slug: Optional[str]) -> str:
+    department = NULL_PARTITION if department_id is None else str(department_id)
+    specialty = NULL_PARTITION if specialty_slug is None else specialty_slug
+    return f"department_id={department}/specialty_slug={specialty}"
+
+
+def _parse_partition(path: str) -> Tuple[Optional[int], Optional[str]]:
+    department, specialty = (part.split('=', 1)[1] for part in path.split('/'))
+    return (None if department == NULL_PARTITION else int(department),
+            None if specialty == NULL_PARTITION else specialty)
+
+
+def _chunk_table(rows: List, schema: "pa.Schema") -> "pa.Table":
+    columns = {name: [getattr(row, name) for row in rows] for name in EXPORT_COLUMNS}
+    for name in _FLOAT:
+        # Float(10, 7) columns come back as Decimal
+        columns[name] = [None if value is None else float(value) for value in columns[name]]
+    for name in _JSON:
+        columns[name] = [None if value is None else json.dumps(value, ensure_ascii=False) for value in columns[name]]
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def write_partition(db: Session, output: str, path: str, schema: "pa.Schema", chunk_size: int = CHUNK_SIZE) -> int:
+    """(Re)write one partition's file from the database, chunk by chunk - returns its row count"""
+    department_id, specialty_slug = _parse_partition(path)
+    doctor_filter = DoctorFilter(department_id=department_id, specialty_slug=specialty_slug, active_only=False)
+    conditions_on_null = []
+    if department_id is None:
+        conditions_on_null.append(Doctor.department_id.is_(None))
+    if specialty_slug is None:
+        conditions_on_null.append(Doctor.specialty_slug.is_(None))
+    columns = [getattr(Doctor, name) for name in EXPORT_COLUMNS]
+
+    directory = os.path.join(output, path)
+    os.makedirs(directory, exist_ok=True)
+    final = os.path.join(directory, "part-0.parquet")
+    temporary = os.path.join(directory, ".part-0.parquet.tmp")  # Dot files are skipped by dataset readers
+    written = 0
+    with pq.ParquetWriter(temporary, schema, compression='zstd') as writer:
+        chunk = []
+        for row in iter_doctors(db, doctor_filter, columns, page_size=chunk_size, extra_conditions=conditions_on_null):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                writer.write_table(_chunk_table(chunk, schema))
+                written += len(chunk)
+                chunk = []
+        if chunk or not written:
+            writer.write_table(_chunk_table(chunk, schema))
+            written += len(chunk)
+    # Readers never see a half-written partition
+    os.replace(temporary, final)
+    return written
+
+
+def export(db: Session, output: str, full: bool = False, chunk_size: int = CHUNK_SIZE) -> Dict[str, int]:
+    """Bring the dataset at output up to date with the doctors table"""
+    _require_pyarrow()
+    schema = export_schema()
+    manifest_path = os.path.join(output, MANIFEST_NAME)
+    previous = {}
+    if not full and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f)['partitions']
+
+    current = partition_signatures(db)
+    stats = {'partitions': len(current), 'rewritten': 0, 'unchanged': 0, 'removed': 0, 'rows': 0}
+    os.makedirs(output, exist_ok=True)
+    for path, signature in sorted(current.items()):
+        if previous.get(path) == signature:
+            stats['unchanged'] += 1
+            continue
+        stats['rows'] += write_partition(db, output, path, schema, chunk_size)
+        stats['rewritten'] += 1
+        logger.info(f"Exported {path}")
+    for path in set(previous) - set(current):
+        shutil.rmtree(os.path.join(output, path), ignore_errors=True)
+        stats['removed'] += 1
+
+    # Written last, so an interrupted export redoes the partitions it had not recorded
+    with open(manifest_path + ".tmp", 'w') as f:
+        json.dump({'exported_at': time.time(), 'partitions': current}, f, indent=1)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return stats
+
+
+def main():
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Export doctors to a partitioned Parquet dataset")
+    parser.add_argument('--output', default=os.path.join('exports', 'doctors'))
+    parser.add_argument('--full', action='store_true', help="Rewrite every partition, not just changed ones")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Rows per read and per row group")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        stats = export(db, args.output, args.full, args.chunk_size)
+        print(f"{stats['rewritten']} of {stats['partitions']} partitions rewritten ({stats['rows']} rows), "
+              f"{stats['unchanged']} unchanged, {stats['removed']} removed in {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# src/presence.py
+"""
+Disappearance detection for doctors.
+
+Every save stamps last_seen (and re-activates a doctor that had been marked removed),
+so once a (specialty, department) search has been crawled completely, the doctors of
+that department and specialty whose last_seen predates the crawl are exactly the ones
+the API stopped returning. mark_removed flags them with one UPDATE - nothing is
+loaded into Python.
+
+Doctors are matched on specialty_slug, so a search keyword only ever retires doctors
+whose slug is that keyword; providers of related specialties a search happens to
+return are never marked removed by it.
+"""
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from models import Doctor
+
+logger = logging.getLogger(__name__)
+
+
+def mark_removed(db: Session, specialty: str, department_id: int, crawl_started_at: datetime) -> int:
+    """Mark doctors not seen since crawl_started_at as inactive - call only after a complete crawl"""
+    removed = db.query(Doctor).filter(
+        Doctor.department_id == department_id,
+        Doctor.specialty_slug == specialty,
+        or_(Doctor.last_seen < crawl_started_at, Doctor.last_seen.is_(None)),
+        or_(Doctor.is_active.is_(True), Doctor.is_active.is_(None)),
+    ).update({
+        Doctor.is_active: False,
+        Doctor.removed_at: datetime.now(timezone.utc),
+        # The content did not change, only its presence
+        Doctor.updated_at: Doctor.updated_at,
+    }, synchronize_session=False)
+    db.commit()
+    if removed:
+        logger.info(f"Marked {removed} {specialty} doctors of department {department_id} as removed")
+    return removed
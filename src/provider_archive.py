@@ -0,0 +1,309 @@
+# src/provider_archive.py
+"""
+Append-only archive of the raw healthcareProviders entries returned by searches.
+
+extract_doctor_data keeps only the fields it maps, so a mapping fix would otherwise
+mean crawling France again. Every raw provider is stored here instead, keyed by a
+hash of its canonical JSON: a provider that has not changed since the last crawl
+costs one sighting row (run, doctolib_id, department, hash), not another copy.
+
+Entries are ~1-2 KB of JSON sharing most of their keys and values, too small to
+compress well on their own, so they are deflated against a preset dictionary built
+from the first providers archived (zlib's zdict - the same idea as a trained zstd
+dictionary, without the extra dependency). The dictionary is stored in the archive
+and never changes once entries reference it.
+
+Usage:
+    python src/provider_archive.py stats
+    python src/provider_archive.py rebuild [--processes 8]   (re-extract doctors from the archive)
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+sys.path.append(os.path.dirname(__file__))
+
+logger = logging.getLogger(__name__)
+
+DICTIONARY_BYTES = 32 * 1024  # Deflate only looks back 32 KB, a larger dictionary would be ignored
+DICTIONARY_SAMPLE = 200  # Providers the dictionary is built from
+
+
+def canonical_json(provider: Dict) -> bytes:
+    return json.dumps(provider, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def encode_provider(provider: Dict) -> Tuple[str, bytes]:
+    """(doctolib_id, canonical JSON) - all the archive keeps of a provider"""
+    return str(provider.get('id', 'unknown')), canonical_json(provider)
+
+
+def content_hash(canonical: bytes) -> bytes:
+    return hashlib.blake2b(canonical, digest_size=16).digest()
+
+
+def build_dictionary(samples: List[bytes]) -> bytes:
+    """Preset dictionary from sample entries - the most common content should sit at its end"""
+    data = b''.join(samples)
+    return data[-DICTIONARY_BYTES:]
+
+
+def compress(canonical: bytes, dictionary: Optional[bytes], level: int = 9) -> bytes:
+    compressor = zlib.compressobj(level, zdict=dictionary) if dictionary else zlib.compressobj(level)
+    return compressor.compress(canonical) + compressor.flush()
+
+
+def decompress(body: bytes, dictionary: Optional[bytes]) -> bytes:
+    decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+    return decompressor.decompress(body) + decompressor.flush()
+
+
+class ProviderArchive:
+    """SQLite file of compressed raw providers and the runs that saw them"""
+
+    def __init__(self, path: str = "provider_archive.db", label: Optional[str] = None, level: int = 9):
+        self.path = path
+        self.label = label
+        self.level = level
+        self.run_id = None  # Created with the first archived page
+
+        self.stored = 0
+        self.deduplicated = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                started_at REAL NOT NULL,
+                label TEXT
+            );
+            CREATE TABLE IF NOT EXISTS dictionaries (
+                id INTEGER PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS providers (
+                hash BLOB PRIMARY KEY,
+                dictionary_id INTEGER REFERENCES dictionaries(id),
+                size INTEGER NOT NULL,
+                body BLOB NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sightings (
+                id INTEGER PRIMARY KEY,
+                run_id INTEGER NOT NULL REFERENCES runs(id),
+                doctolib_id TEXT NOT NULL,
+                department_id INTEGER,
+                specialty TEXT,
+                hash BLOB NOT NULL,
+                seen_at REAL NOT NULL,
+                UNIQUE (run_id, doctolib_id, department_id, hash)
+            );
+            CREATE INDEX IF NOT EXISTS ix_sightings_doctolib_id ON sightings (doctolib_id, id);
+        """)
+        row = self._conn.execute("SELECT id, data FROM dictionaries ORDER BY id DESC LIMIT 1").fetchone()
+        self._dictionary_id, self._dictionary = row if row else (None, None)
+
+    @classmethod
+    def from_config(cls) -> Optional["ProviderArchive"]:
+        """Build the archive described by config.py, or None when archiving is turned off"""
+        import config
+
+        if not config.PROVIDER_ARCHIVE_PATH:
+            return None
+        directory = os.path.dirname(config.PROVIDER_ARCHIVE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return cls(config.PROVIDER_ARCHIVE_PATH)
+
+    def add(self, specialty: str, department_id: Optional[int], providers: Iterable[Dict]) -> int:
+        """Archive one page of raw providers, returning how many were new content"""
+        return self.add_encoded(specialty, department_id, map(encode_provider, providers))
+
+    def add_encoded(self, specialty: str, department_id: Optional[int],
+                    encoded: Iterable[Tuple[str, bytes]]) -> int:
+        """add() for providers already through encode_provider - a page need not be kept decoded for it"""
+        entries = {}
+        sightings = []
+        for doctolib_id, canonical in encoded:
+            digest = content_hash(canonical)
+            entries[digest] = canonical
+            sightings.append((doctolib_id, digest))
+        if not sightings:
+            return 0
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.run_id is None:
+                    self.run_id = self._conn.execute(
+                        "INSERT INTO runs (started_at, label) VALUES (?, ?)", (now, self.label)
+                    ).lastrowid
+                # Only compress what the archive does not have yet
+                digests = list(entries)
+                placeholders = ','.join('?' * len(digests))
+                known = {row[0] for row in self._conn.execute(
+                    f"SELECT hash FROM providers WHERE hash IN ({placeholders})", digests
+                )}
+                new = {digest: canonical for digest, canonical in entries.items() if digest not in known}
+                if new and self._dictionary is None:
+                    self._create_dictionary(list(new.values())[:DICTIONARY_SAMPLE])
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO providers (hash, dictionary_id, size, body) VALUES (?, ?, ?, ?)",
+                    [(digest, self._dictionary_id, len(canonical), compress(canonical, self._dictionary, self.level))
+                     for digest, canonical in new.items()],
+                )
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO sightings (run_id, doctolib_id, department_id, specialty, hash, seen_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(self.run_id, doctolib_id, department_id, specialty, digest, now)
+                     for doctolib_id, digest in sightings],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self.stored += len(new)
+        self.deduplicated += len(sightings) - len(new)
+        return len(new)
+
+    def _create_dictionary(self, samples: List[bytes]):
+        self._dictionary = build_dictionary(samples)
+        self._dictionary_id = self._conn.execute(
+            "INSERT INTO dictionaries (data) VALUES (?)", (self._dictionary,)
+        ).lastrowid
+        logger.info(f"Created archive dictionary {self._dictionary_id} from {len(samples)} providers")
+
+    def dictionaries(self) -> Dict[int, bytes]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT id, data FROM dictionaries"))
+
+    def latest(self, chunk_size: int = 2000) -> Iterator[List[Tuple[Optional[int], Optional[int], bytes]]]:
+        """(department_id, dictionary_id, compressed body) of each doctor's most recent sighting, in chunks"""
+        # A separate connection, so archiving can go on while a rebuild reads
+        conn = sqlite3.connect(self.path)
+        try:
+            cursor = conn.execute("""
+                SELECT s.department_id, p.dictionary_id, p.body
+                FROM sightings s
+                JOIN (SELECT MAX(id) AS id FROM sightings GROUP BY doctolib_id) latest ON latest.id = s.id
+                JOIN providers p ON p.hash = s.hash
+            """)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, raw_bytes, stored_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(body)), 0) FROM providers"
+            ).fetchone()
+            sightings, doctors = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT doctolib_id) FROM sightings"
+            ).fetchone()
+            runs = self._conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+        return {
+            'runs': runs,
+            'doctors': doctors,
+            'sightings': sightings,
+            'entries': entries,
+            'raw_bytes': raw_bytes,
+            'stored_bytes': stored_bytes,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Rebuild workers: decompression, JSON parsing and extraction run on every core,
+# the parent process only writes
+_worker_dictionaries: Dict[int, bytes] = {}
+
+
+def _init_worker(dictionaries: Dict[int, bytes]):
+    _worker_dictionaries.update(dictionaries)
+
+
+def _extract_chunk(rows: List[Tuple[Optional[int], Optional[int], bytes]]) -> List[Dict]:
+    from data_processors import extract_doctor_data
+
+    return [extract_doctor_data(json.loads(decompress(body, _worker_dictionaries.get(dictionary_id))), department_id)
+            for department_id, dictionary_id, body in rows]
+
+
+def rebuild(archive: ProviderArchive, db, scraper, processes: Optional[int] = None) -> int:
+    """Re-extract every archived doctor (latest version) and upsert it - returns doctors written"""
+    from doctor_index import DoctorIndex
+
+    index = DoctorIndex.load(db)
+    written = 0
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(archive.dictionaries(),)) as pool:
+        for doctors in pool.imap(_extract_chunk, archive.latest()):
+            # Nothing was seen: doctors retired since keep their removal
+            written += scraper.save_doctors_bulk(doctors, db, index=index, rebuild=True)
+            logger.info(f"Rebuilt {written} doctors")
+    return written
+
+
+def main():
+    import config
+
+    parser = argparse.ArgumentParser(description="Inspect the raw provider archive or rebuild doctors from it")
+    parser.add_argument('--archive', default=config.PROVIDER_ARCHIVE_PATH or 'provider_archive.db')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    subcommands.add_parser('stats', help="Archive size and compression")
+    rebuild_parser = subcommands.add_parser('rebuild', help="Re-extract the doctors table from the archive")
+    rebuild_parser.add_argument('--processes', type=int, default=None, help="Extraction processes (default: all cores)")
+    rebuild_parser.add_argument('--sqlite-profile', default='bulk_load',
+                                help="Storage profile for the rebuild's writes (see database.SQLITE_PROFILES)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    archive = ProviderArchive(args.archive)
+    try:
+        if args.command == 'stats':
+            stats = archive.stats()
+            ratio = stats['raw_bytes'] / stats['stored_bytes'] if stats['stored_bytes'] else 0.0
+            print(f"{stats['entries']} distinct entries for {stats['doctors']} doctors, "
+                  f"{stats['sightings']} sightings over {stats['runs']} runs")
+            print(f"{stats['raw_bytes'] / 2 ** 20:.1f} MiB of JSON stored in {stats['stored_bytes'] / 2 ** 20:.1f} MiB "
+                  f"({ratio:.1f}x)")
+            return
+
+        from sqlalchemy.orm import sessionmaker
+
+        from database import DATABASE_URL, Base, add_missing_columns, add_missing_indexes, create_db_engine
+        from scraper import DoctolibScraper
+
+        engine = create_db_engine(DATABASE_URL, args.sqlite_profile)
+        Base.metadata.create_all(bind=engine)
+        add_missing_columns(engine)
+        add_missing_indexes(engine)
+        db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        try:
+            started = time.perf_counter()
+            written = rebuild(archive, db, DoctolibScraper(), args.processes)
+            print(f"Rebuilt {written} doctors in {time.perf_counter() - started:.1f}s")
+        finally:
+            db.close()
+    finally:
+        archive.close()
+
+
+if __name__ == "__main__":
+    main()
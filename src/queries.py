@@ -0,0 +1,144 @@
+# src/queries.py
+"""
+Read-side queries over the doctors table.
+
+Filters map onto the indexes declared on Doctor (department + specialty, postal
+code + specialty, postal code, new patients + regulation sector, city); results are plain
+column tuples rather than ORM objects, and are paged by keyset (WHERE id > last id)
+so page 1000 costs the same as page 1 - no OFFSET scanning.
+
+Usage: python src/queries.py --specialty medecin-generaliste --postal-code 69003 --new-patients [--explain]
+"""
+import argparse
+import logging
+import time
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Sequence
+
+from sqlalchemy import func, text
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from lookups import accepts_payment, speaks
+from models import Doctor
+
+logger = logging.getLogger(__name__)
+
+# Enough to list or export a doctor without loading the whole row
+SUMMARY_COLUMNS = (
+    Doctor.id, Doctor.doctolib_id, Doctor.title, Doctor.first_name, Doctor.last_name,
+    Doctor.organization_name, Doctor.specialty_slug, Doctor.regulation_sector,
+    Doctor.accepts_new_patients, Doctor.address, Doctor.postal_code, Doctor.city,
+    Doctor.profile_url,
+)
+
+
+@dataclass
+class DoctorFilter:
+    """Conditions on doctors - fields left as None are not filtered on"""
+    department_id: Optional[int] = None
+    specialty_slug: Optional[str] = None
+    postal_code: Optional[str] = None
+    city: Optional[str] = None
+    accepts_new_patients: Optional[bool] = None
+    regulation_sector: Optional[str] = None
+    languages: Sequence[str] = ()  # Speaks all of them
+    payment_methods: Sequence[str] = ()  # Accepts all of them
+    active_only: bool = True  # Skip doctors a complete crawl no longer returned
+
+    def conditions(self) -> list:
+        conditions = [
+            column == value for column, value in (
+                (Doctor.department_id, self.department_id),
+                (Doctor.specialty_slug, self.specialty_slug),
+                (Doctor.postal_code, self.postal_code),
+                (Doctor.city, self.city),
+                (Doctor.accepts_new_patients, self.accepts_new_patients),
+                (Doctor.regulation_sector, self.regulation_sector),
+            ) if value is not None
+        ]
+        if self.languages:
+            conditions.append(speaks(*self.languages))
+        if self.payment_methods:
+            conditions.append(accepts_payment(*self.payment_methods))
+        if self.active_only:
+            conditions.append(Doctor.is_active.is_(True))
+        return conditions
+
+
+def find_doctors(db: Session, doctor_filter: DoctorFilter, columns: Sequence = SUMMARY_COLUMNS,
+                 limit: int = 100, after_id: Optional[int] = None, extra_conditions: Sequence = ()) -> List[Row]:
+    """One page of matching doctors in id order - pass the last row's id as after_id for the next page"""
+    if Doctor.id not in columns:
+        # The keyset needs the id of the last row
+        columns = (Doctor.id, *columns)
+    query = db.query(*columns).filter(*doctor_filter.conditions(), *extra_conditions)
+    if after_id is not None:
+        query = query.filter(Doctor.id > after_id)
+    return query.order_by(Doctor.id).limit(limit).all()
+
+
+def iter_doctors(db: Session, doctor_filter: DoctorFilter, columns: Sequence = SUMMARY_COLUMNS,
+                 page_size: int = 1000, extra_conditions: Sequence = ()) -> Iterator[Row]:
+    """Every matching doctor, fetched page by page"""
+    after_id = None
+    while True:
+        page = find_doctors(db, doctor_filter, columns, limit=page_size, after_id=after_id,
+                            extra_conditions=extra_conditions)
+        yield from page
+        if len(page) < page_size:
+            return
+        after_id = page[-1].id
+
+
+def count_doctors(db: Session, doctor_filter: DoctorFilter) -> int:
+    return db.query(func.count(Doctor.id)).filter(*doctor_filter.conditions()).scalar()
+
+
+def explain(db: Session, doctor_filter: DoctorFilter, limit: int = 100) -> List[str]:
+    """SQLite's plan for find_doctors - shows which index a filter is served by"""
+    query = db.query(*SUMMARY_COLUMNS).filter(*doctor_filter.conditions()).order_by(Doctor.id).limit(limit)
+    statement = query.statement.compile(db.get_bind(), compile_kwargs={"literal_binds": True})
+    return [row[-1] for row in db.execute(text(f"EXPLAIN QUERY PLAN {statement}"))]
+
+
+def main():
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Find doctors")
+    parser.add_argument('--department-id', type=int)
+    parser.add_argument('--specialty', dest='specialty_slug')
+    parser.add_argument('--postal-code')
+    parser.add_argument('--city')
+    parser.add_argument('--new-patients', dest='accepts_new_patients', action='store_true', default=None)
+    parser.add_argument('--sector', dest='regulation_sector')
+    parser.add_argument('--languages', nargs='*', default=())
+    parser.add_argument('--payment-methods', nargs='*', default=())
+    parser.add_argument('--include-removed', action='store_true')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--explain', action='store_true', help="Print the query plan")
+    args = parser.parse_args()
+
+    doctor_filter = DoctorFilter(
+        department_id=args.department_id, specialty_slug=args.specialty_slug, postal_code=args.postal_code,
+        city=args.city, accepts_new_patients=args.accepts_new_patients, regulation_sector=args.regulation_sector,
+        languages=args.languages, payment_methods=args.payment_methods, active_only=not args.include_removed,
+    )
+    db = SessionLocal()
+    try:
+        if args.explain:
+            for line in explain(db, doctor_filter, args.limit):
+                print(line)
+        started = time.perf_counter()
+        rows = find_doctors(db, doctor_filter, limit=args.limit)
+        elapsed = time.perf_counter() - started
+        for row in rows:
+            name = row.organization_name or f"{row.title or ''} {row.first_name or ''} {row.last_name or ''}".strip()
+            print(f"{row.id:>8}  {name:<40} {row.postal_code or '':<6} {row.city or ''}")
+        print(f"{len(rows)} doctors in {elapsed * 1000:.1f} ms")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# src/rate_controller.py
+"""
+Adaptive rate controller shared by every request we send to Doctolib.
+
+Additive increase / multiplicative decrease (AIMD) on both the request rate and
+the number of requests in flight: while latency and error rates stay healthy the
+limits creep up, and a 429, 403 or timeout cuts them in half. Retry-After headers
+pause all requests until the server says it is ready again.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Statuses that mean "you are going too fast" - these shrink the limits
+THROTTLE_STATUSES = {403, 429}
+# Statuses worth retrying once the controller has backed off
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Turn a Retry-After header (seconds or HTTP date) into a number of seconds"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RateController:
+    """Thread-safe AIMD controller for request rate and concurrency"""
+
+    def __init__(self, initial_rate: float = 1 / 3, min_rate: float = 0.05, max_rate: float = 10.0,
+                 initial_concurrency: int = 1, min_concurrency: int = 1, max_concurrency: int = 16,
+                 rate_step: float = 0.1, decrease_factor: float = 0.5, latency_target: float = 3.0,
+                 max_error_ratio: float = 0.1, window: int = 20, decrease_cooldown: float = 2.0,
+                 max_retries: int = 3):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.rate_step = rate_step
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.max_error_ratio = max_error_ratio
+        self.decrease_cooldown = decrease_cooldown
+        self.max_retries = max_retries
+
+        self._rate = min(max(initial_rate, min_rate), max_rate)
+        self._concurrency = min(max(initial_concurrency, min_concurrency), max_concurrency)
+        self._outcomes = deque(maxlen=window)  # True for healthy responses
+        self._latency_ewma: Optional[float] = None
+        self._successes_since_increase = 0
+        self._last_decrease = 0.0
+        self._next_slot = 0.0
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def unlimited(cls, concurrency: int = 64) -> "RateController":
+        """A controller that never throttles - for replayed or otherwise local traffic"""
+        return cls(initial_rate=1e6, max_rate=1e6, initial_concurrency=concurrency,
+                   max_concurrency=concurrency, max_retries=0)
+
+    @property
+    def rate(self) -> float:
+        """Current requests-per-second budget"""
+        return self._rate
+
+    @property
+    def concurrency(self) -> int:
+        """Current number of requests allowed in flight"""
+        return self._concurrency
+
+    def set_ceiling(self, max_rate: Optional[float] = None, max_concurrency: Optional[int] = None):
+        """Lower or raise the hard caps, clamping the current values to them"""
+        with self._lock:
+            if max_rate is not None:
+                self.max_rate = max_rate
+                self._rate = min(self._rate, max_rate)
+            if max_concurrency is not None:
+                self.max_concurrency = max_concurrency
+                self._concurrency = min(self._concurrency, max_concurrency)
+
+    @contextmanager
+    def ceiling(self, max_rate: Optional[float] = None, max_concurrency: Optional[int] = None):
+        """set_ceiling for the duration of a with block - the previous caps come back afterwards"""
+        with self._lock:
+            previous = (self.max_rate, self.max_concurrency)
+        self.set_ceiling(max_rate=max_rate, max_concurrency=max_concurrency)
+        try:
+            yield self
+        finally:
+            # The current values stay clamped and grow back through the usual additive increase
+            self.set_ceiling(*previous)
+
+    def reserve(self) -> float:
+        """Claim the next request slot and return how many seconds to wait for it"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot, self._blocked_until)
+            self._next_slot = start + 1.0 / self._rate
+            return start - now
+
+    def wait(self):
+        """Block until a request may be sent"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        """Asyncio version of wait()"""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record(self, status: Optional[int], latency: float, retry_after: Optional[float] = None,
+               timed_out: bool = False):
+        """Feed one response (or timeout) back into the controller"""
+        with self._lock:
+            now = time.monotonic()
+
+            if retry_after is not None:
+                # Nothing we send before this point has a chance of succeeding
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+                logger.warning(f"Server asked us to wait {retry_after:.1f}s before the next request")
+
+            if timed_out or status in THROTTLE_STATUSES:
+                self._outcomes.append(False)
+                self._decrease(now, reason='timeout' if timed_out else f'status {status}')
+                return
+
+            healthy = status is not None and status < 500
+            self._outcomes.append(healthy)
+            if not healthy:
+                return
+
+            self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+            self._successes_since_increase += 1
+
+            # Grow roughly once per round of in-flight requests, and only while things look healthy
+            if self._successes_since_increase >= self._concurrency and self._is_healthy():
+                self._successes_since_increase = 0
+                self._rate = min(self.max_rate, self._rate + self.rate_step)
+                self._concurrency = min(self.max_concurrency, self._concurrency + 1)
+
+    def should_retry(self, status: Optional[int], attempt: int, timed_out: bool = False) -> bool:
+        """Whether a failed request is worth sending again"""
+        if attempt >= self.max_retries:
+            return False
+        # A 403 is usually a block rather than a blip - retrying right away only digs deeper
+        return timed_out or status is None or status in RETRYABLE_STATUSES
+
+    def snapshot(self) -> Dict:
+        """Current limits and health signals, for logging and progress reports"""
+        with self._lock:
+            errors = self._outcomes.count(False)
+            return {
+                'rate': round(self._rate, 3),
+                'concurrency': self._concurrency,
+                'latency_ewma': round(self._latency_ewma, 3) if self._latency_ewma is not None else None,
+                'error_ratio': round(errors / len(self._outcomes), 3) if self._outcomes else 0.0,
+                'blocked_for': round(max(0.0, self._blocked_until - time.monotonic()), 1),
+            }
+
+    def _is_healthy(self) -> bool:
+        if self._latency_ewma is not None and self._latency_ewma > self.latency_target:
+            return False
+        if not self._outcomes:
+            return True
+        return self._outcomes.count(False) / len(self._outcomes) <= self.max_error_ratio
+
+    def _decrease(self, now: float, reason: str):
+        # Responses already in flight report the same overload - cut once per cooldown, not once per response
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        self._successes_since_increase = 0
+        self._rate = max(self.min_rate, self._rate * self.decrease_factor)
+        self._concurrency = max(self.min_concurrency, int(self._concurrency * self.decrease_factor))
+        logger.warning(f"Backing off after {reason}: {self._rate:.2f} req/s, concurrency {self._concurrency}")
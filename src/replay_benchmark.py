@@ -0,0 +1,69 @@
+# src/replay_benchmark.py
+"""
+Benchmark the parse/persist pipeline by replaying a recorded crawl with no network.
+
+Usage: python src/replay_benchmark.py recordings/ [--latency] [--database sqlite:///./bench.db]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('recordings', help="Directory written by ResponseRecorder")
+    parser.add_argument('--latency', action='store_true', help="Reproduce the recorded response latencies")
+    parser.add_argument('--database', default='sqlite:///./replay_benchmark.db',
+                        help="Database to persist into (kept separate from the real one by default)")
+    args = parser.parse_args()
+
+    # database.py reads DATABASE_URL at import time
+    os.environ['DATABASE_URL'] = args.database
+    from database import SessionLocal, engine, Base
+    from department_loader import DepartmentLoader
+    from models import Department, Doctor
+    from scraper import DoctolibScraper
+    from transport import ReplayTransport
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        DepartmentLoader(db).load_all_departments(os.path.join(os.path.dirname(__file__), "..", "department_payloads"))
+
+        transport = ReplayTransport(args.recordings, reproduce_latency=args.latency)
+        scraper = DoctolibScraper(transport=transport)
+
+        # Pages recorded per (specialty, department) tell us how far each crawl went
+        pages = defaultdict(int)
+        for entry in transport.entries():
+            key = (entry.get('specialty'), entry.get('place_id'))
+            pages[key] = max(pages[key], entry.get('page', 0) + 1)
+
+        started = time.perf_counter()
+        for (specialty, place_id), page_count in pages.items():
+            department = db.query(Department).filter(Department.doctolib_id == place_id).first()
+            if department is None:
+                print(f"Skipping {specialty} / place {place_id}: department not loaded")
+                continue
+            scraper.scrape_department(specialty, department, db, max_pages=page_count)
+        elapsed = time.perf_counter() - started
+
+        doctors = db.query(Doctor).count()
+        print("=== REPLAY BENCHMARK ===")
+        print(f"Pages replayed: {transport.replayed} ({transport.missing} missing)")
+        print(f"Doctors in database: {doctors}")
+        print(f"Elapsed: {elapsed:.2f}s - {transport.replayed / elapsed:.1f} pages/s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
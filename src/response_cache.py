@@ -0,0 +1,156 @@
+# src/response_cache.py
+"""
+Persistent cache of /phs_proxy/raw search responses.
+
+Entries live in a small SQLite file, keyed by a hash of the exact request body
+and page number, so re-running a crawl (after a crash, or to iterate on
+extract_doctor_data) reuses pages we already paid rate budget for.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(body: bytes, page: int) -> str:
+    """Hash of (request body, page) identifying one search page"""
+    digest = hashlib.sha256(body)
+    digest.update(f'|page={page}'.encode('ascii'))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed response cache with a TTL, an LRU size cap and hit/miss counters"""
+
+    def __init__(self, path: str = "response_cache.db", ttl_seconds: Optional[float] = 7 * 24 * 3600,
+                 max_bytes: Optional[int] = 1024 ** 3):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL,
+                body BLOB NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_last_access ON responses (last_access)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get_raw(self, key: str) -> Optional[bytes]:
+        """Raw response body for key, or None on a miss or an expired entry"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT created_at, size, body FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            created_at, size, body = row
+            if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+
+        return zlib.decompress(body)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Decoded JSON response for key, or None"""
+        raw = self.get_raw(key)
+        return json.loads(raw) if raw is not None else None
+
+    def put(self, key: str, raw_body: bytes):
+        """Store a raw response body, evicting least recently used entries past max_bytes"""
+        body = zlib.compress(raw_body, 6)
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, created_at, last_access, size, body) VALUES (?, ?, ?, ?, ?)",
+                (key, now, now, len(body), body),
+            )
+            self._total_bytes += len(body) - (previous[0] if previous else 0)
+            self._evict()
+
+    def _evict(self):
+        if self.max_bytes is None or self._total_bytes <= self.max_bytes:
+            return
+        # Walk entries oldest-access first until we are back under the cap
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        doomed = []
+        for key, size in rows:
+            if self._total_bytes <= self.max_bytes:
+                break
+            doomed.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+    def purge_expired(self) -> int:
+        """Delete every entry older than the TTL and return how many were removed"""
+        if self.ttl_seconds is None:
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,)).rowcount
+            self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.expired += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+            'expired': self.expired,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': self._total_bytes,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @classmethod
+    def from_config(cls) -> Optional["ResponseCache"]:
+        """Build the cache described by config.py, or None when caching is turned off"""
+        import config
+
+        if not config.RESPONSE_CACHE_PATH:
+            return None
+        directory = os.path.dirname(config.RESPONSE_CACHE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return cls(
+            config.RESPONSE_CACHE_PATH,
+            ttl_seconds=config.RESPONSE_CACHE_TTL_HOURS * 3600 if config.RESPONSE_CACHE_TTL_HOURS else None,
+            max_bytes=config.RESPONSE_CACHE_MAX_MB * 1024 * 1024 if config.RESPONSE_CACHE_MAX_MB else None,
+        )
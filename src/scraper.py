@@ -4,18 +4,35 @@ import os
 import requests
 import logging
 import time
-from typing import Dict, Optional
+from functools import partial
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timezone
 from sqlalchemy.orm import Session
 
-from models import Doctor, Department
-from data_processors import extract_doctor_data, validate_doctor_data
+from models import Doctor, Department, CrawlTask
+from data_processors import encode_payload, extract_doctor_data, validate_doctor_data
+from base_scraper import BaseDoctolibScraper
+from crawl_planner import CrawlJob, CrawlPlan, build_search_payload, pages_for_total
+from checkpoints import CheckpointStore
+from geo_partition import RESULT_CAP, SearchArea, is_capped
+from rate_controller import RateController, parse_retry_after
+from response_cache import ResponseCache, make_cache_key
+from provider_archive import ProviderArchive
+from transport import ReplayTransport, ResponseRecorder
+from stream_decoder import CHUNK_SIZE, ProviderStream
+from write_behind import CommitTracker, WriteBehindWriter
+from presence import mark_removed
+from doctor_index import DoctorIndex
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class DoctolibScraper:
-    def __init__(self):
+class DoctolibScraper(BaseDoctolibScraper):
+    def __init__(self, rate_controller: Optional[RateController] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 transport: Optional[ReplayTransport] = None,
+                 recorder: Optional[ResponseRecorder] = None,
+                 archive: Optional[ProviderArchive] = None):
         self.session = requests.Session()
         self.base_url = "https://www.doctolib.fr"
         self.headers = {
@@ -36,7 +53,21 @@ class DoctolibScraper:
             'sec-ch-ua-platform': '"macOS"',
         }
         self.session.headers.update(self.headers)
-        self.request_delay = 3 # 3 seconds btw requests to not overwhelm API
+        # Search requests go through the live session unless we are replaying a recording
+        self.transport = transport or self.session
+        # Optional recorder that keeps every raw search exchange for offline replay
+        self.recorder = recorder
+        # Shared pacing for every request - starts at one request every 3 seconds and adapts from there
+        # Replayed traffic never touches Doctolib, so it runs unthrottled
+        self.rate_controller = rate_controller or (
+            RateController.unlimited() if transport is not None else RateController()
+        )
+        # Optional on-disk cache of search pages, so reruns don't spend rate budget twice
+        self.response_cache = response_cache
+        # Optional archive of every raw provider, so extraction can be redone without refetching
+        self.archive = archive
+        # Encoded search bodies by (specialty, department id)
+        self._search_bodies = {}
 
 
     
@@ -47,16 +78,19 @@ class DoctolibScraper:
             try:
                 logger.info(f"Setting up session with Doctolib (attempt {attempt + 1}/{max_retries}...)")
 
-                # Add random delay between retries
-                if attempt > 0:
-                    delay = 5 * attempt # 5, 10, 15 seconds
-                    logger.info(f"Waiting {delay} seconds before retry...")
-                    time.sleep(delay)
+                # The controller spaces attempts out and honors any Retry-After we got
+                self.rate_controller.wait()
 
+                started = time.monotonic()
                 response = self.session.get(
                     'https://www.doctolib.fr',
                     timeout=10
                 )
+                self.rate_controller.record(
+                    response.status_code,
+                    time.monotonic() - started,
+                    retry_after=parse_retry_after(response.headers.get('Retry-After')),
+                )
 
                 if response.status_code == 200:
                     logger.info("Session setup successful")
@@ -67,6 +101,9 @@ class DoctolibScraper:
                 else:
                     logger.warning(f"Session setup returned status {response.status_code}")
 
+            except requests.exceptions.Timeout as e:
+                self.rate_controller.record(None, 10, timed_out=True)
+                logger.error(f"Session setup timed out: {e}")
             except Exception as e:
                 logger.error(f"Session setup failed: {e}")
 
@@ -93,69 +130,128 @@ class DoctolibScraper:
     #         return False
 
     # Creates the stored payload files for each department
-    # Params: specialty=str "medecine generaliste", department=Department object - What is Dict doing here?
+    # Params: specialty=str "medecine generaliste", department=Department object
     def create_search_payload(self, specialty: str, department: Department) -> Dict:
         """Create search payload for a specific department"""
-        payload = {
-            "keyword": specialty,
-            "location": {
-                "place": {
-                    "id": department.doctolib_id,
-                    "name": department.name,
-                    "country": "fr",
-                    "type": department.type,
-                    "viewport": {
-                        "northeast": {
-                            "lat": float(department.viewport_ne_lat),
-                            "lng": float(department.viewport_ne_lng),
-                        },
-                        "southwest": {
-                            "lat": float(department.viewport_sw_lat),
-                            "lng": float(department.viewport_sw_lng),
-                        }
-                    },
-                    "gpsPoint": {
-                        "lat": float(department.latitude),
-                        "lng": float(department.longitude)
-                    },
-                    "zipcodes": department.zipcodes
-                }
-            },
-            "filters": {}
-        }
-        print("DEBUG - Payload types:")
-        # Work through this
-        for key, value in payload['location']['place'].items():
-            if hasattr(value, '__class__'):
-                print(f"  {key}: {type(value)}")
-        
-        return payload
+        return build_search_payload(specialty, department)
+
+
+    def search_body(self, specialty: str, department: Department, area: Optional[SearchArea] = None) -> bytes:
+        """Encoded search payload, built once per (specialty, department, area) and reused for every page"""
+        key = (specialty, department.id, area.label if area is not None else None)
+        if key not in self._search_bodies:
+            self._search_bodies[key] = encode_payload(build_search_payload(specialty, department, area))
+        return self._search_bodies[key]
     
 
-    def search_doctors_in_department(self, specialty: str, department: Department, page: int = 0) -> Optional[Dict]:
-        """Search for doctors in a specific department"""
+    def search_doctors_in_department(self, specialty: str, department: Department, page: int = 0,
+                                     area: Optional[SearchArea] = None) -> Optional[Dict]:
+        """Search for doctors in a specific department, or in one area of it"""
 
-        # Creates payload for the specified department
-        payload = self.create_search_payload(specialty, department)
+        # Encoded payload for the specified department (only built on the first page)
+        body = self.search_body(specialty, department, area)
 
-        try:
-            logger.debug(f"Sending request to Doctolib API for {department.name}, page {page}")
+        cache_key = make_cache_key(body, page)
+        if self.response_cache is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Cache hit for {department.name} page {page} - {len(cached.get('healthcareProviders', []))} doctors")
+                return cached
 
-            # POST request to search endpoint
-            response = self.session.post(
-                f'{self.base_url}/phs_proxy/raw?page={page}',
-                # What is this doing? Is it empty or is this the full response visible in Network tab?
-                json=payload,
-                timeout=30
+        response, _ = self._post_search(department, page, body)
+        if response is None:
+            return None
+
+        data = response.json()
+        if self.response_cache is not None:
+            self.response_cache.put(cache_key, response.content)
+        logger.info(f"Successfully received data for {department.name} - {len(data.get('healthcareProviders', []))} doctors")
+        return data
+
+
+    def stream_doctors_in_department(self, specialty: str, department: Department, page: int = 0,
+                                     area: Optional[SearchArea] = None) -> Optional[ProviderStream]:
+        """Like search_doctors_in_department, but providers are decoded one by one as the body arrives"""
+        body = self.search_body(specialty, department, area)
+
+        cache_key = make_cache_key(body, page)
+        if self.response_cache is not None:
+            cached = self.response_cache.get_raw(cache_key)
+            if cached is not None:
+                logger.info(f"Cache hit for {department.name} page {page}")
+                return ProviderStream.from_bytes(cached)
+
+        response, latency = self._post_search(department, page, body, stream=True)
+        if response is None:
+            return None
+
+        def on_complete(raw: Optional[bytes]):
+            # The body only exists in one piece here, once every provider has been handed out
+            if self.recorder is not None:
+                self.recorder.record(self._search_url(page), body, response.status_code, latency, raw,
+                                     dict(response.headers))
+            if self.response_cache is not None:
+                self.response_cache.put(cache_key, raw)
+
+        return ProviderStream(
+            response.iter_content(CHUNK_SIZE),
+            keep_raw=self.recorder is not None or self.response_cache is not None,
+            on_complete=on_complete,
+        )
+
+
+    def _search_url(self, page: int) -> str:
+        return f'{self.base_url}/phs_proxy/raw?page={page}'
+
+
+    def _post_search(self, department: Department, page: int, body: bytes,
+                     stream: bool = False) -> Tuple[Optional[requests.Response], Optional[float]]:
+        """POST a search page with the rate controller's retries - (200 response, latency) or (None, None)"""
+        for attempt in range(self.rate_controller.max_retries + 1):
+            # Wait for a request slot - this replaces the old fixed request_delay sleep
+            self.rate_controller.wait()
+
+            started = time.monotonic()
+            try:
+                logger.debug(f"Sending request to Doctolib API for {department.name}, page {page}")
+
+                # POST request to search endpoint
+                url = self._search_url(page)
+                response = self.transport.post(
+                    url,
+                    # What is this doing? Is it empty or is this the full response visible in Network tab?
+                    data=body,
+                    timeout=30,
+                    stream=stream,
+                )
+            except requests.exceptions.Timeout as e:
+                self.rate_controller.record(None, time.monotonic() - started, timed_out=True)
+                if self.recorder is not None:
+                    self.recorder.record(url, body, None, time.monotonic() - started, None)
+                logger.error(f"Search request timed out for {department.name}: {e}")
+                if self.rate_controller.should_retry(None, attempt, timed_out=True):
+                    continue
+                return None, None
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Search request failed for {department.name} as {e}")
+                return None, None
+
+            latency = time.monotonic() - started
+            self.rate_controller.record(
+                response.status_code,
+                latency,
+                retry_after=parse_retry_after(response.headers.get('Retry-After')),
             )
+            # A streamed page is recorded by its ProviderStream once the whole body has been read
+            if self.recorder is not None and not (stream and response.status_code == 200):
+                self.recorder.record(url, body, response.status_code, latency, response.content,
+                                     dict(response.headers))
 
             logger.debug(f"Response status: {response.status_code}")
             logger.debug(f"Response headers: {dict(response.headers)}")
 
             if response.status_code == 200:
-                data = response.json()
-                logger.info(f"Successfully received data for {department.name} - {len(data.get('healthcareProviders', []))} doctors")
-                return data
+                return response, latency
             elif response.status_code == 403:
                 logger.error(f"Access forbidden for {department.name}. Possible blocking.")
                 if response.text:
@@ -164,11 +260,12 @@ class DoctolibScraper:
                 logger.error(f"Rate limited for {department.name}. Need to slow down.")
             else:
                 logger.error(f"Unexpected status {response.status_code} for {department.name}")
-                return None
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Search request failed for {department.name} as {e}")
-            return None
+
+            if not self.rate_controller.should_retry(response.status_code, attempt):
+                return None, None
+            logger.info(f"Retrying {department.name} page {page} (attempt {attempt + 2})")
+
+        return None, None
 
 
 
@@ -239,41 +336,190 @@ class DoctolibScraper:
 
 
     # Should this be above save_doc_to_db?
-    def scrape_department(self, specialty: str, department: Department, db: Session, max_pages: int = 5):
+    def scrape_department(self, specialty: str, department: Department, db: Session,
+                          max_pages: Optional[int] = None, checkpoints: Optional[CheckpointStore] = None,
+                          writer: Optional[WriteBehindWriter] = None):
 
         """Scrape all doctors for a specialty in a specific department"""
 
-        logger.info(f"Scraping {specialty} in {department.name} (max {max_pages} pages)")
+        logger.info(f"Scraping {specialty} in {department.name}" + (f" (max {max_pages} pages)" if max_pages else ""))
+
+        # Pages are saved on a writer thread while the next one downloads - pass a writer to share it
+        # across departments, otherwise this call runs its own and flushes it before returning
+        own_writer = writer is None
+        if own_writer:
+            # Stored doctors of the department, so saves know what changed without querying
+            index = DoctorIndex.load(db, [department.id])
+            writer = WriteBehindWriter.for_session(partial(self.save_doctors_bulk, index=index), db)
+        # Everything saved by this crawl (or by the earlier runs it resumes) is seen after this
+        crawl_started_at = datetime.now(timezone.utc)
+        if checkpoints is not None:
+            crawl_started_at = checkpoints.started_at(specialty, department.id) or crawl_started_at
+        tracker = CommitTracker()
+        try:
+            complete = self._scrape_pages(specialty, department, writer, max_pages, checkpoints, tracker)
+        finally:
+            if own_writer:
+                writer.close()
+
+        # Only a crawl that saw every result, and saved all of it, can tell which doctors are gone
+        if complete:
+            writer.flush()
+            if tracker.all_committed:
+                mark_removed(db, specialty, department.id, crawl_started_at)
+            else:
+                logger.warning(f"{tracker.queued - tracker.committed} pages of {department.name} failed to save, "
+                               f"not checking for removed doctors")
+
+        logger.info(f"Completed scraping {department.name}")
 
-        # For every page of search results
-        for page in range(max_pages):
-            logger.info(f"Page {page + 1} for {department.name}...")
 
-            # Creates the payload object of the Department (not doctor)
-            data = self.search_doctors_in_department(specialty, department, page)
-            if not data:
+    def _scrape_pages(self, specialty: str, department: Department, writer: WriteBehindWriter,
+                      max_pages: Optional[int], checkpoints: Optional[CheckpointStore],
+                      tracker: CommitTracker) -> bool:
+        """Fetch a search page by page and queue each page's doctors on the writer
+
+        Returns whether every result of the search was covered.
+        """
+
+        # Page 0's total tells us how many pages exist; until then we only know about page 0
+        pages_known = 1
+        page = 0
+        total, page_size = None, 0
+        while page < pages_known:
+            job = CrawlJob(specialty, department, page)
+
+            # Pages finished by an earlier run are never fetched again
+            if checkpoints is not None:
+                finished = checkpoints.finished(job)
+                if finished is not None:
+                    status, doctors_found, total = finished
+                    if status != CrawlTask.DONE:
+                        return False
+                    if page == 0:
+                        total, page_size = total, doctors_found or 0
+                        pages_known = self._pages_known(page, total, page_size, max_pages)
+                    logger.info(f"Page {page + 1}/{pages_known} for {department.name} already {status}, skipping")
+                    page += 1
+                    continue
+                checkpoints.mark_in_flight(job)
+
+            logger.info(f"Page {page + 1}/{pages_known} for {department.name}...")
+
+            # Providers are decoded and saved one by one while the page is still downloading
+            providers = self.stream_doctors_in_department(specialty, department, page)
+            if providers is None:
                 logger.warning(f"No data received for page {page}, stopping")
-                break
+                if checkpoints is not None:
+                    checkpoints.mark_failed(job, error="no data received")
+                return False
 
-            # Access the list value assigned to key 'healthcareProviders' and save as 'doctors'. 'doctors' is a list of dicts.
-            doctors = data.get('healthcareProviders', [])
-            if not doctors:
+            raw_doctors, parsed_doctors = [], []
+            try:
+                # Passes each provider dict to the processor as soon as it has been decoded
+                for doctor_data in providers:
+                    raw_doctors.append(doctor_data)
+                    parsed_doctors.append(extract_doctor_data(doctor_data, department.id))
+            except (ValueError, requests.exceptions.RequestException) as e:
+                logger.warning(f"Page {page} for {department.name} was cut off after {providers.count} doctors: {e}")
+                # Keep the doctors that did arrive before the cut
+                self.archive_providers(specialty, department.id, raw_doctors)
+                writer.put_page(parsed_doctors, tracker.track())
+                if checkpoints is not None:
+                    checkpoints.mark_failed(job, error=str(e))
+                return False
+
+            if page == 0:
+                total, page_size = providers.total, providers.count
+            if page == 0 or providers.total is None:
+                pages_known = self._pages_known(page, providers.total, providers.count, max_pages)
+
+            self.archive_providers(specialty, department.id, raw_doctors)
+            # Adds the page's doctors to the db in one upsert, checkpointed once they are committed
+            on_committed = None
+            if checkpoints is not None:
+                on_committed = checkpoints.mark_done_on(job, providers.count, providers.total)
+            writer.put_page(parsed_doctors, tracker.track(on_committed))
+
+            if not providers.count:
                 logger.info("No more doctors found, completed department")
-                break
+                return True
 
-            logger.info(f"Found {len(doctors)} doctors on page {page + 1}")
+            logger.info(f"Found {providers.count} doctors on page {page + 1}")
 
-            # Iterate through the list of doctors
-            for doctor_data in doctors:
-                # Passes each dict element (single doctor's data) in doctors list to processor
-                parsed_data = extract_doctor_data(doctor_data, department.id)
-                # Adds processed doctor data to db
-                self.save_doctor_to_db(parsed_data, db)
+            page += 1
+            logger.info(f"Progress for {department.name}: {page}/{pages_known} pages")
 
-            # Rate limiting for politeness
-            time.sleep(self.request_delay)
+        # Complete unless max_pages stopped us early or the API caps what it will page through
+        if total is None:
+            return False
+        return not is_capped(total) and pages_for_total(total, page_size) <= pages_known
 
-        logger.info(f"Completed scraping {department.name}")
+
+    def _pages_known(self, page: int, total: Optional[int], page_size: int, max_pages: Optional[int]) -> int:
+        """Pages a search spans according to its total, or one more page while the total is unknown"""
+        pages = pages_for_total(total, page_size, max_pages)
+        if pages is not None:
+            return pages
+        # No total in the response - keep probing while pages come back non-empty
+        if page_size and (max_pages is None or page + 1 < max_pages):
+            return page + 2
+        return page + 1
+
+
+    def search_doctors(self, specialty: str, department: Department, max_pages: int = 2) -> List[Dict]:
+        """Collect the raw provider dicts of the first max_pages result pages"""
+        providers = []
+        for page in range(max_pages):
+            data = self.search_doctors_in_department(specialty, department, page)
+            if not data or not data.get('healthcareProviders'):
+                break
+            providers.extend(data['healthcareProviders'])
+        return providers
+
+
+    def scrape_departments_concurrently(self, specialty: str, departments: List[Department], db: Session,
+                                        max_pages: Optional[int] = None, max_concurrency: Optional[int] = None,
+                                        requests_per_second: Optional[float] = None,
+                                        checkpoints: Optional[CheckpointStore] = None):
+        """Scrape several departments at once with the asyncio fetch engine"""
+        from fetch_engine import AsyncFetchEngine
+
+        engine = AsyncFetchEngine(
+            self,
+            max_concurrency=max_concurrency,
+            requests_per_second=requests_per_second,
+        )
+        return engine.scrape_departments(specialty, departments, db, max_pages=max_pages, checkpoints=checkpoints)
+
+
+    def run_crawl_plan(self, plan: CrawlPlan, db: Session, max_concurrency: Optional[int] = None,
+                       requests_per_second: Optional[float] = None,
+                       checkpoints: Optional[CheckpointStore] = None):
+        """Execute a compiled CrawlPlan with the asyncio fetch engine, resumable when checkpoints are given"""
+        from fetch_engine import AsyncFetchEngine
+
+        engine = AsyncFetchEngine(
+            self,
+            max_concurrency=max_concurrency,
+            requests_per_second=requests_per_second,
+        )
+        return engine.run_plan(plan, db, checkpoints)
+
+
+    def scrape_departments_partitioned(self, specialties: List[str], departments: List[Department], db: Session,
+                                       max_pages: Optional[int] = None, result_cap: int = RESULT_CAP,
+                                       max_concurrency: Optional[int] = None,
+                                       requests_per_second: Optional[float] = None):
+        """Scrape departments completely, splitting searches whose total hits the API's result cap"""
+        from fetch_engine import AsyncFetchEngine
+
+        engine = AsyncFetchEngine(
+            self,
+            max_concurrency=max_concurrency,
+            requests_per_second=requests_per_second,
+        )
+        return engine.scrape_partitioned(specialties, departments, db, max_pages=max_pages, result_cap=result_cap)
 
 
 
@@ -0,0 +1,175 @@
+# src/spatial.py
+"""
+Spatial index over doctor coordinates.
+
+On SQLite, doctors_rtree is an R-tree virtual table holding one point box per doctor
+with coordinates, kept in sync with the doctors table by triggers - so it covers rows
+written by any path (ORM saves, bulk upserts, raw SQL). A bounding-box search is one
+R-tree probe; a radius search probes the circle's bounding box and keeps the candidates
+whose haversine distance is within the radius. Department viewports are bounding
+boxes already.
+
+R-tree boxes are stored as 32-bit floats (rounded outwards), so candidates are
+re-checked against the real latitude/longitude columns. Other databases get the same
+functions answered from the plain columns.
+
+Usage: python src/spatial.py --lat 45.76 --lng 4.84 --radius-km 2 [--specialty medecin-generaliste]
+"""
+import argparse
+import logging
+import math
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import Column, Float, Integer, MetaData, Table, inspect, text
+from sqlalchemy.engine import Engine, Row
+from sqlalchemy.orm import Session
+
+from models import Department, Doctor
+from queries import SUMMARY_COLUMNS, DoctorFilter
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+# Not part of Base.metadata - create_all cannot create virtual tables, ensure_spatial_index does
+doctors_rtree = Table(
+    'doctors_rtree', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('min_lat', Float), Column('max_lat', Float),
+    Column('min_lng', Float), Column('max_lng', Float),
+)
+
+_SPATIAL_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS doctors_rtree USING rtree(id, min_lat, max_lat, min_lng, max_lng)",
+    """CREATE TRIGGER IF NOT EXISTS doctors_rtree_insert AFTER INSERT ON doctors
+       WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL
+       BEGIN
+           INSERT OR REPLACE INTO doctors_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS doctors_rtree_update AFTER UPDATE OF id, latitude, longitude ON doctors
+       BEGIN
+           DELETE FROM doctors_rtree WHERE id = old.id;
+           INSERT INTO doctors_rtree SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+           WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS doctors_rtree_delete AFTER DELETE ON doctors
+       BEGIN
+           DELETE FROM doctors_rtree WHERE id = old.id;
+       END""",
+)
+
+# Engines whose database is known to have the index, so queries only check once
+_ready = set()
+
+
+def ensure_spatial_index(bind: Engine) -> bool:
+    """Create the R-tree and its triggers if missing, filling it from existing doctors - SQLite only"""
+    if bind.dialect.name != 'sqlite':
+        return False
+    if bind.url in _ready:
+        return True
+    if not inspect(bind).has_table('doctors_rtree'):
+        with bind.begin() as connection:
+            for statement in _SPATIAL_DDL:
+                connection.execute(text(statement))
+            # Same transaction as the triggers, so no row written meanwhile is missed
+            filled = connection.execute(text(
+                "INSERT OR REPLACE INTO doctors_rtree SELECT id, latitude, latitude, longitude, longitude "
+                "FROM doctors WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+            )).rowcount
+        logger.info(f"Created the doctors spatial index with {filled} doctors")
+    _ready.add(bind.url)
+    return True
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance between two points"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def radius_bbox(lat: float, lng: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """(south, west, north, east) of a box containing the circle"""
+    lat_delta = radius_km / KM_PER_DEGREE_LAT
+    # Longitude degrees shrink towards the poles - use the circle's widest latitude
+    widest = min(math.radians(abs(lat) + lat_delta), math.radians(89.9))
+    lng_delta = radius_km / (KM_PER_DEGREE_LAT * math.cos(widest))
+    return lat - lat_delta, lng - lng_delta, lat + lat_delta, lng + lng_delta
+
+
+def within_bbox(db: Session, south: float, west: float, north: float, east: float,
+                doctor_filter: Optional[DoctorFilter] = None, columns: Sequence = SUMMARY_COLUMNS,
+                limit: Optional[int] = None) -> List[Row]:
+    """Doctors located inside the box, in id order"""
+    query = db.query(*columns)
+    if ensure_spatial_index(db.get_bind()):
+        query = query.join(doctors_rtree, doctors_rtree.c.id == Doctor.id).filter(
+            doctors_rtree.c.min_lat <= north, doctors_rtree.c.max_lat >= south,
+            doctors_rtree.c.min_lng <= east, doctors_rtree.c.max_lng >= west,
+        )
+    query = query.filter(
+        Doctor.latitude.between(south, north),
+        Doctor.longitude.between(west, east),
+        *(doctor_filter or DoctorFilter()).conditions(),
+    ).order_by(Doctor.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def within_radius(db: Session, lat: float, lng: float, radius_km: float,
+                  doctor_filter: Optional[DoctorFilter] = None,
+                  columns: Sequence = SUMMARY_COLUMNS) -> List[Tuple[float, Row]]:
+    """(distance in km, doctor) for the doctors within radius_km of the point, nearest first"""
+    columns = tuple(columns) + tuple(column for column in (Doctor.latitude, Doctor.longitude)
+                                     if column not in columns)
+    candidates = within_bbox(db, *radius_bbox(lat, lng, radius_km), doctor_filter, columns)
+    matches = []
+    for row in candidates:
+        distance = haversine_km(lat, lng, row.latitude, row.longitude)
+        if distance <= radius_km:
+            matches.append((distance, row))
+    matches.sort(key=lambda match: match[0])
+    return matches
+
+
+def within_viewport(db: Session, department: Department, doctor_filter: Optional[DoctorFilter] = None,
+                    columns: Sequence = SUMMARY_COLUMNS) -> List[Row]:
+    """Doctors inside a department's stored viewport"""
+    return within_bbox(db, float(department.viewport_sw_lat), float(department.viewport_sw_lng),
+                       float(department.viewport_ne_lat), float(department.viewport_ne_lng),
+                       doctor_filter, columns)
+
+
+def main():
+    import time
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Find doctors around a point")
+    parser.add_argument('--lat', type=float, required=True)
+    parser.add_argument('--lng', type=float, required=True)
+    parser.add_argument('--radius-km', type=float, default=1.0)
+    parser.add_argument('--specialty', dest='specialty_slug')
+    parser.add_argument('--limit', type=int, default=20, help="Nearest doctors to print")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        ensure_spatial_index(db.get_bind())
+        started = time.perf_counter()
+        matches = within_radius(db, args.lat, args.lng, args.radius_km, DoctorFilter(specialty_slug=args.specialty_slug))
+        elapsed = time.perf_counter() - started
+        for distance, row in matches[:args.limit]:
+            name = row.organization_name or f"{row.first_name or ''} {row.last_name or ''}".strip()
+            print(f"{distance:6.2f} km  {name:<40} {row.postal_code or '':<6} {row.city or ''}")
+        print(f"{len(matches)} doctors within {args.radius_km} km in {elapsed * 1000:.1f} ms")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# src/storage_benchmark.py
+"""
+Benchmark doctor persistence under each SQLite storage profile.
+
+Writes the sample response's providers (with made-up ids) into a fresh database per
+profile, once row by row (save_doctor_to_db, a commit per doctor) and once in bulk
+(save_doctors_bulk, a commit per page), and prints rows/s for each.
+
+Usage: python src/storage_benchmark.py [--rows 2000] [--directory /tmp]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(__file__))
+
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, SQLITE_PROFILES, create_db_engine
+from data_processors import extract_doctor_data
+from scraper import DoctolibScraper
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), '..', 'sample_api_response.json')
+PAGE_SIZE = 20
+
+
+def sample_doctors(rows: int):
+    with open(SAMPLE_PATH, 'r', encoding='utf-8') as f:
+        providers = json.load(f)['healthcareProviders']
+    return [
+        extract_doctor_data(dict(providers[i % len(providers)], id=f"benchmark-{i}"), None)
+        for i in range(rows)
+    ]
+
+
+def run_profile(profile: str, mode: str, doctors, directory: str) -> float:
+    """Rows/s for writing doctors into a new database under profile"""
+    path = os.path.join(directory, f"storage_benchmark_{profile}_{mode}.db")
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    engine = create_db_engine(f"sqlite:///{path}", profile)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    scraper = DoctolibScraper()
+    try:
+        started = time.perf_counter()
+        if mode == 'row':
+            for doctor in doctors:
+                scraper.save_doctor_to_db(dict(doctor), db)
+        else:
+            for start in range(0, len(doctors), PAGE_SIZE):
+                scraper.save_doctors_bulk(doctors[start:start + PAGE_SIZE], db)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+        engine.dispose()
+    return len(doctors) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000, help="Doctors to write per run")
+    parser.add_argument('--directory', default='.', help="Where to create the benchmark databases")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    doctors = sample_doctors(args.rows)
+    print("=== STORAGE PROFILE BENCHMARK ===")
+    print(f"{args.rows} doctors, bulk pages of {PAGE_SIZE}")
+    for profile in SQLITE_PROFILES:
+        row_rate = run_profile(profile, 'row', doctors, args.directory)
+        bulk_rate = run_profile(profile, 'bulk', doctors, args.directory)
+        print(f"{profile:>10}: {row_rate:8.0f} rows/s row by row, {bulk_rate:8.0f} rows/s in bulk")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# src/stream_decoder.py
+"""
+Incremental decoding of search response bodies.
+
+A search page is one JSON object, {"total": ..., "healthcareProviders": [...]}.
+ProviderStreamDecoder is fed the body chunk by chunk as it arrives and hands back
+each provider as soon as its closing brace has been received, so providers can go
+into extract_doctor_data while the rest of the page is still on the wire and the
+whole decoded page never has to exist at once. Other top-level keys ("total")
+are decoded whole and kept in `fields`.
+"""
+import codecs
+import json
+import re
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+PROVIDERS_KEY = 'healthcareProviders'
+CHUNK_SIZE = 16 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_START, _OBJECT, _ARRAY, _END = range(4)
+
+
+class ProviderStreamDecoder:
+    """Push-style decoder: feed() bytes, get back the providers completed so far"""
+
+    def __init__(self, array_key: str = PROVIDERS_KEY):
+        self.array_key = array_key
+        self.fields: Dict[str, Any] = {}
+        self.count = 0
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._state = _START
+
+    @property
+    def total(self) -> Optional[int]:
+        return self.fields.get('total')
+
+    def feed(self, chunk: bytes) -> List[Dict]:
+        """Add a chunk of the body and return the providers it completed"""
+        self._buffer += self._text.decode(chunk)
+        return self._drain(final=False)
+
+    def close(self) -> List[Dict]:
+        """Flush the end of the body - raises ValueError if it was truncated"""
+        self._buffer += self._text.decode(b'', final=True)
+        providers = self._drain(final=True)
+        if self._state != _END:
+            raise ValueError("Search response ended before its JSON object was complete")
+        return providers
+
+    def _skip(self, pos: int) -> int:
+        return _WHITESPACE.match(self._buffer, pos).end()
+
+    def _decode(self, pos: int, final: bool):
+        """(value, end) for the JSON value at pos, or None until more of it has arrived"""
+        try:
+            value, end = self._json.raw_decode(self._buffer, pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return None
+        # A number at the very end of the buffer may still be missing digits
+        if end >= len(self._buffer) and not final:
+            return None
+        return value, end
+
+    def _drain(self, final: bool) -> List[Dict]:
+        providers = []
+        buffer = self._buffer
+        while True:
+            pos = self._skip(self._pos)
+            if pos >= len(buffer):
+                break
+            char = buffer[pos]
+
+            if self._state == _START:
+                if char != '{':
+                    raise ValueError(f"Search response is not a JSON object (starts with {char!r})")
+                self._pos, self._state = pos + 1, _OBJECT
+
+            elif self._state == _OBJECT:
+                if char == ',':
+                    self._pos = pos + 1
+                    continue
+                if char == '}':
+                    self._pos, self._state = pos + 1, _END
+                    continue
+                # "key": value - nothing is consumed until the whole pair (or the array's '[') is here
+                decoded = self._decode(pos, final)
+                if decoded is None:
+                    break
+                key, end = decoded
+                colon = self._skip(end)
+                if colon >= len(buffer):
+                    break
+                if buffer[colon] != ':':
+                    raise ValueError(f"Expected ':' after key {key!r} in search response")
+                value_pos = self._skip(colon + 1)
+                if value_pos >= len(buffer):
+                    break
+                if key == self.array_key and buffer[value_pos] == '[':
+                    self._pos, self._state = value_pos + 1, _ARRAY
+                    continue
+                decoded = self._decode(value_pos, final)
+                if decoded is None:
+                    break
+                self.fields[key], self._pos = decoded
+
+            elif self._state == _ARRAY:
+                if char == ',':
+                    self._pos = pos + 1
+                    continue
+                if char == ']':
+                    self._pos, self._state = pos + 1, _OBJECT
+                    continue
+                decoded = self._decode(pos, final)
+                if decoded is None:
+                    break
+                provider, self._pos = decoded
+                providers.append(provider)
+                self.count += 1
+
+            else:
+                raise ValueError("Unexpected data after the end of the search response")
+
+        # Drop what has been consumed so the buffer only ever holds one partial value
+        self._buffer = buffer[self._pos:]
+        self._pos = 0
+        return providers
+
+
+class ProviderStream:
+    """Providers of one search page, decoded while its body is still being received
+
+    Iterate over it once. `total` is known as soon as the decoder has passed the
+    "total" key, which the API sends before the providers. on_complete receives the
+    raw body (when keep_raw is set) after the last chunk, for caching and recording.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], keep_raw: bool = False,
+                 on_complete: Optional[Callable[[Optional[bytes]], None]] = None):
+        self.chunks = chunks
+        self.keep_raw = keep_raw
+        self.on_complete = on_complete
+        self.decoder = ProviderStreamDecoder()
+
+    @classmethod
+    def from_bytes(cls, body: bytes) -> "ProviderStream":
+        return cls(body[i:i + CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE))
+
+    @property
+    def total(self) -> Optional[int]:
+        return self.decoder.total
+
+    @property
+    def count(self) -> int:
+        return self.decoder.count
+
+    def __iter__(self) -> Iterator[Dict]:
+        raw = [] if self.keep_raw else None
+        for chunk in self.chunks:
+            if raw is not None:
+                raw.append(chunk)
+            yield from self.decoder.feed(chunk)
+        yield from self.decoder.close()
+        if self.on_complete is not None:
+            self.on_complete(b''.join(raw) if raw is not None else None)
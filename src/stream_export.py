@@ -0,0 +1,121 @@
+# src/stream_export.py
+"""
+Streaming NDJSON / CSV export of doctors.
+
+Rows are read in keyset-paginated chunks as plain column tuples (queries.iter_doctors),
+never as ORM objects, and written out as they arrive - nothing accumulates in an
+identity map, so memory stays flat from ten thousand rows to ten million.
+
+Usage:
+    python src/stream_export.py --format ndjson > doctors.ndjson
+    python src/stream_export.py --format csv --department Rhône --specialty dentiste --output rhone.csv
+"""
+import argparse
+import csv
+import json
+import logging
+import sys
+from datetime import date, datetime
+from decimal import Decimal
+from typing import IO, Iterable, Optional, Sequence
+
+from sqlalchemy.orm import Session
+
+from models import Department, Doctor
+from queries import DoctorFilter, iter_doctors
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('ndjson', 'csv')
+CHUNK_SIZE = 5000
+DEFAULT_COLUMNS = tuple(Doctor.__table__.columns.keys())
+
+
+def _plain(value):
+    """JSON-serializable form of a column value"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _csv_cell(value):
+    """CSV cells are text - nested values go in as JSON"""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return _plain(value)
+
+
+def export_rows(db: Session, out: IO[str], export_format: str = 'ndjson',
+                doctor_filter: Optional[DoctorFilter] = None, columns: Sequence[str] = DEFAULT_COLUMNS,
+                chunk_size: int = CHUNK_SIZE) -> int:
+    """Write every matching doctor to out, returning the number of rows written"""
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format {export_format!r}, expected one of {FORMATS}")
+    rows = iter_doctors(db, doctor_filter or DoctorFilter(active_only=False),
+                        [getattr(Doctor, name) for name in columns], page_size=chunk_size)
+    if export_format == 'csv':
+        return _write_csv(rows, out, columns)
+    return _write_ndjson(rows, out, columns)
+
+
+def _write_ndjson(rows: Iterable, out: IO[str], columns: Sequence[str]) -> int:
+    written = 0
+    for row in rows:
+        record = {name: _plain(getattr(row, name)) for name in columns}
+        out.write(json.dumps(record, ensure_ascii=False, default=str))
+        out.write('\n')
+        written += 1
+    return written
+
+
+def _write_csv(rows: Iterable, out: IO[str], columns: Sequence[str]) -> int:
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    written = 0
+    for row in rows:
+        writer.writerow([_csv_cell(getattr(row, name)) for name in columns])
+        written += 1
+    return written
+
+
+def main():
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Stream doctors out as NDJSON or CSV")
+    parser.add_argument('--format', dest='export_format', choices=FORMATS, default='ndjson')
+    parser.add_argument('--output', help="File to write (default: stdout)")
+    parser.add_argument('--department', help="Department name")
+    parser.add_argument('--department-id', type=int)
+    parser.add_argument('--specialty', dest='specialty_slug')
+    parser.add_argument('--active-only', action='store_true', help="Skip doctors marked removed")
+    parser.add_argument('--columns', nargs='*', default=DEFAULT_COLUMNS)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    unknown = set(args.columns) - set(DEFAULT_COLUMNS)
+    if unknown:
+        parser.error(f"Unknown columns: {', '.join(sorted(unknown))}")
+
+    db = SessionLocal()
+    out = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        department_id = args.department_id
+        if args.department:
+            department_id = db.query(Department.id).filter(Department.name == args.department).scalar()
+            if department_id is None:
+                parser.error(f"Department {args.department!r} not found")
+        doctor_filter = DoctorFilter(department_id=department_id, specialty_slug=args.specialty_slug,
+                                     active_only=args.active_only)
+        written = export_rows(db, out, args.export_format, doctor_filter, args.columns, args.chunk_size)
+        logger.info(f"Exported {written} doctors")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# src/test_crawl_worker.py
+"""Several crawl worker processes sharing one lease queue in a temporary SQLite file"""
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.append(os.path.dirname(__file__))
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, create_db_engine
+from models import CrawlRun, CrawlTask, Department, Doctor
+from base_scraper import BaseDoctolibScraper
+from crawl_worker import CrawlWorker
+from work_queue import LeaseWorkQueue
+
+SPECIALTIES = ('dentiste', 'pediatre')
+TOTAL = 20  # Results per search
+PAGE_SIZE = 3  # So every search spans 7 pages
+PAGES = -(-TOTAL // PAGE_SIZE)
+
+
+class FakeScraper(BaseDoctolibScraper):
+    """Serves synthetic search pages and logs every fetch to a file all processes append to"""
+
+    def __init__(self, fetch_log: str):
+        self.fetch_log = fetch_log
+
+    def search_doctors_in_department(self, specialty, department, page=0):
+        with open(self.fetch_log, 'a') as f:
+            f.write(f"{specialty} {department.id} {page}\n")
+        first = page * PAGE_SIZE
+        providers = [
+            {'id': f"{specialty}-{department.id}-{i}", 'firstName': 'Jean', 'name': f"Doctor {i}",
+             'speciality': {'name': specialty, 'slug': specialty}, 'location': {'city': 'Lyon', 'zipcode': '69003'}}
+            for i in range(first, min(first + PAGE_SIZE, TOTAL))
+        ]
+        return {'total': TOTAL, 'healthcareProviders': providers}
+
+    def search_doctors(self, specialty, department, max_pages=2):
+        return []
+
+
+def _session_factory(url: str):
+    return sessionmaker(autocommit=False, autoflush=False, bind=create_db_engine(url, 'serving'))
+
+
+def _run_worker(url: str, fetch_log: str, worker_id: str):
+    CrawlWorker(FakeScraper(fetch_log), worker_id=worker_id, batch_size=2, poll_interval=0.05,
+                session_factory=_session_factory(url)).run()
+
+
+@pytest.fixture
+def database(tmp_path):
+    url = f"sqlite:///{tmp_path / 'queue.db'}"
+    session_factory = _session_factory(url)
+    Base.metadata.create_all(bind=session_factory.kw['bind'])
+    db = session_factory()
+    db.add_all([Department(name="Paris", doctolib_id=75), Department(name="Rhône", doctolib_id=69)])
+    db.commit()
+    department_ids = [department_id for (department_id,) in db.query(Department.id)]
+    db.close()
+    return url, session_factory, department_ids
+
+
+def _enqueue_searches(session_factory, department_ids) -> int:
+    db = session_factory()
+    try:
+        queue = LeaseWorkQueue(db)
+        return sum(queue.enqueue(specialty, department_id)
+                   for specialty in SPECIALTIES for department_id in department_ids)
+    finally:
+        db.close()
+
+
+def _fetches(fetch_log: str) -> Counter:
+    with open(fetch_log) as f:
+        return Counter(tuple(line.split()) for line in f)
+
+
+def test_workers_claim_every_page_exactly_once(database, tmp_path):
+    url, session_factory, department_ids = database
+    searches = len(SPECIALTIES) * len(department_ids)
+    assert _enqueue_searches(session_factory, department_ids) == searches
+
+    fetch_log = str(tmp_path / 'fetches.log')
+    processes = [multiprocessing.Process(target=_run_worker, args=(url, fetch_log, f"worker-{i}")) for i in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+        assert process.exitcode == 0
+
+    fetches = _fetches(fetch_log)
+    expected = {(specialty, str(department_id), str(page))
+                for specialty in SPECIALTIES for department_id in department_ids for page in range(PAGES)}
+    assert set(fetches) == expected
+    assert set(fetches.values()) == {1}
+
+    db = session_factory()
+    try:
+        assert {status for (status,) in db.query(CrawlTask.status).distinct()} == {CrawlTask.DONE}
+        assert db.query(Doctor).count() == searches * TOTAL
+    finally:
+        db.close()
+
+    # Once the run is over, the same searches make a new run rather than being refused as done
+    assert _enqueue_searches(session_factory, department_ids) == searches
+    _run_worker(url, fetch_log, "worker-again")
+    assert set(_fetches(fetch_log).values()) == {2}
+
+
+def test_expired_lease_is_reissued(database):
+    _, session_factory, department_ids = database
+    db_a, db_b = session_factory(), session_factory()
+    try:
+        first = LeaseWorkQueue(db_a, "worker-a", lease_seconds=0.2)
+        second = LeaseWorkQueue(db_b, "worker-b", lease_seconds=30)
+        assert first.enqueue(SPECIALTIES[0], department_ids[0])
+
+        [task] = first.claim()
+        assert second.claim() == []  # Still leased to worker-a
+
+        time.sleep(0.3)  # worker-a died without a heartbeat
+        [reissued] = second.claim()
+        assert reissued.id == task.id
+        assert reissued.lease_owner == "worker-b"
+
+        # worker-a coming back to life cannot finish a task it no longer holds
+        assert not first.complete(task, doctors_found=0)
+        assert second.complete(reissued, doctors_found=0)
+    finally:
+        db_a.close()
+        db_b.close()
+
+
+def test_old_run_leftovers_do_not_hold_up_a_new_run(database, tmp_path):
+    url, session_factory, department_ids = database
+    db = session_factory()
+    try:
+        old = LeaseWorkQueue(db, "worker-old")
+        assert old.enqueue(SPECIALTIES[0], department_ids[0])
+        [task] = old.claim()
+        leftover_id = task.id
+        assert old.fail(task, error="timeout")  # Its retry is not due for a while
+        db.add(CrawlRun(label="next pass"))
+        db.commit()
+    finally:
+        db.close()
+
+    assert _enqueue_searches(session_factory, department_ids) == len(SPECIALTIES) * len(department_ids)
+    worker = multiprocessing.Process(target=_run_worker, args=(url, str(tmp_path / 'fetches.log'), "worker-new"))
+    worker.start()
+    worker.join(timeout=60)
+    assert worker.exitcode == 0
+
+    db = session_factory()
+    try:
+        assert db.query(CrawlTask.status).filter(CrawlTask.id == leftover_id).scalar() == CrawlTask.FAILED
+    finally:
+        db.close()
+
+
+def test_unknown_department_fails_the_task(database, tmp_path):
+    _, session_factory, _ = database
+    db = session_factory()
+    try:
+        queue = LeaseWorkQueue(db, "worker-a")
+        assert queue.enqueue(SPECIALTIES[0], department_id=999)
+        [task] = queue.claim()
+        worker = CrawlWorker(FakeScraper(str(tmp_path / 'fetches.log')), worker_id="worker-a",
+                             session_factory=session_factory)
+        worker.process(task, db, queue)
+
+        db.expire_all()
+        assert db.get(CrawlTask, task.id).status == CrawlTask.FAILED
+        assert db.get(CrawlTask, task.id).last_error == "unknown department 999"
+        assert worker.pages_done == 0
+    finally:
+        db.close()
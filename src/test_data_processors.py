@@ -0,0 +1,163 @@
+# src/test_data_processors.py
+"""The compiled extractors against hand-written expected records"""
+import os
+import sys
+
+sys.path.append(os.path.dirname(__file__))
+
+import pytest
+
+from data_processors import DOCTOR_FIELDS, extract_department_data, extract_doctor_columns, extract_doctor_data
+
+DEPARTMENT_ID = 69
+
+# A trimmed-down entry of sample_api_response.json
+PRACTITIONER = {
+    "cloudinaryPublicId": "ougzrs0lrvajicfoc8yn",
+    "exactMatch": False,
+    "id": "profile-65018;practice-35800;medecin-generaliste",
+    "languages": ["gb", "es", "fr"],
+    "link": "/medecin-generaliste/creteil/elodie-croci?pid=practice-35800",
+    "location": {"address": "34 Rue Jean Jaurès", "city": "Créteil", "country": "fr",
+                 "lat": 48.7938837, "lng": 2.45610839999995, "zipcode": "94000", "distanceInMeters": None},
+    "minimumFee": None,
+    "name": "CROCI",
+    "firstName": "Elodie",
+    "title": "Dr",
+    "gender": "female",
+    "onlineBooking": {"agendaIds": [99563], "telehealth": True, "topSpecialities": []},
+    "organizationStatus": None,
+    "type": "INDIVIDUAL_PRACTITIONER",
+    "administrativeArea": [],
+    "paymentMeans": ["cash", "check", "credit_card"],
+    "references": {"legacyId": "profile-65018;practice-35800;medecin-generaliste", "id": 65018,
+                   "type": "public_profile", "practiceId": 35800},
+    "regulationSector": "contracted_1",
+    "services": ["profile", "onlineBooking"],
+    "speciality": {"name": "Médecin généraliste", "slug": "medecin-generaliste"},
+    "matchedVisitMotive": {"visitMotiveId": 584089, "name": "Consultation de médecine générale",
+                           "agendaIds": [99563], "fee": None,
+                           "insuranceSector": {"type": None, "split": False}, "allowNewPatients": False},
+}
+
+# What an entry with none of the keys comes out as
+EMPTY_RECORD = {
+    'doctolib_id': 'unknown', 'profile_url': '',
+    'first_name': None, 'last_name': None, 'organization_name': None, 'is_organization': False,
+    'title': None, 'gender': None,
+    'specialty': 'Médecin généraliste', 'specialty_slug': 'médecin-généraliste',
+    'regulation_sector': 'unknown', 'practitioner_type': 'UNKNOWN',
+    'address': '', 'city': '', 'postal_code': '', 'latitude': None, 'longitude': None,
+    'reference_id': None, 'practice_id': None, 'legacy_id': '',
+    'offers_online_booking': False, 'offers_telehealth': False, 'online_booking_details': None,
+    'accepts_new_patients': True,
+    'payment_methods': [], 'languages': [], 'services': [],
+    'payment_methods_mask': 0, 'languages_mask': 0, 'services_mask': 0,
+    'administrative_areas': [],
+    'visit_motive_id': None, 'visit_motive_name': None, 'visit_motive_agenda_ids': [],
+    'visit_motive_insurance_sector': None,
+    'organization_status': None, 'cloudinary_public_id': None, 'exact_match': False, 'minimum_fee': None,
+    'department_id': DEPARTMENT_ID,
+}
+
+CASES = {
+    'practitioner': (PRACTITIONER, {
+        'doctolib_id': 'profile-65018;practice-35800;medecin-generaliste',
+        'profile_url': '/medecin-generaliste/creteil/elodie-croci?pid=practice-35800',
+        'first_name': 'Elodie', 'last_name': 'CROCI', 'organization_name': None, 'is_organization': False,
+        'title': 'Dr', 'gender': 'female',
+        'specialty': 'Médecin généraliste', 'specialty_slug': 'medecin-generaliste',
+        'regulation_sector': 'contracted_1', 'practitioner_type': 'INDIVIDUAL_PRACTITIONER',
+        'address': '34 Rue Jean Jaurès', 'city': 'Créteil', 'postal_code': '94000',
+        'latitude': 48.7938837, 'longitude': 2.45610839999995,
+        'reference_id': 65018, 'practice_id': 35800, 'legacy_id': 'profile-65018;practice-35800;medecin-generaliste',
+        'offers_online_booking': True, 'offers_telehealth': True,
+        'online_booking_details': {"agendaIds": [99563], "telehealth": True, "topSpecialities": []},
+        'accepts_new_patients': False,
+        'payment_methods': ['cash', 'check', 'credit_card'], 'languages': ['gb', 'es', 'fr'],
+        'services': ['profile', 'onlineBooking'],
+        'payment_methods_mask': 0b111, 'languages_mask': 0b111, 'services_mask': 0b11,
+        'administrative_areas': [],
+        'visit_motive_id': 584089, 'visit_motive_name': 'Consultation de médecine générale',
+        'visit_motive_agenda_ids': [99563], 'visit_motive_insurance_sector': {'type': None, 'split': False},
+        'organization_status': None, 'cloudinary_public_id': 'ougzrs0lrvajicfoc8yn', 'exact_match': False,
+        'minimum_fee': None, 'department_id': DEPARTMENT_ID,
+    }),
+    'organization': ({
+        'id': 'practice-1688', 'firstName': None, 'name': 'Centre de Santé Benoit Frachon',
+        'type': 'ORGANIZATION', 'organizationStatus': 'active',
+        'speciality': {'name': None, 'slug': 'centre-de-sante'},
+    }, {
+        **EMPTY_RECORD,
+        'doctolib_id': 'practice-1688', 'organization_name': 'Centre de Santé Benoit Frachon',
+        'is_organization': True, 'practitioner_type': 'ORGANIZATION', 'organization_status': 'active',
+        'specialty_slug': 'centre-de-sante',  # The null name falls back, the slug does not need to
+    }),
+    # Null nested objects read as {}; other nulls are kept (the defaults are for absent keys)
+    'null objects': ({
+        'id': 'profile-1', 'firstName': 'Ana', 'name': 'Lopez', 'location': None, 'references': None,
+        'onlineBooking': None, 'matchedVisitMotive': None, 'speciality': None, 'regulationSector': None,
+        'paymentMeans': None, 'languages': None, 'services': None,
+    }, {
+        **EMPTY_RECORD,
+        'doctolib_id': 'profile-1', 'first_name': 'Ana', 'last_name': 'Lopez', 'regulation_sector': None,
+        'payment_methods': None, 'languages': None, 'services': None,
+    }),
+    'missing keys': ({}, EMPTY_RECORD),
+    # Masks only hold vocabulary values - the lists keep the rest
+    'unknown vocabulary': ({
+        'id': 'profile-2', 'languages': ['fr', 'xx', 'es'], 'paymentMeans': ['bitcoin', 'cash'],
+        'services': ['teleconsultation'],
+    }, {
+        **EMPTY_RECORD,
+        'doctolib_id': 'profile-2', 'languages': ['fr', 'xx', 'es'], 'languages_mask': 0b101,
+        'payment_methods': ['bitcoin', 'cash'], 'payment_methods_mask': 0b1,
+        'services': ['teleconsultation'], 'services_mask': 0,
+    }),
+}
+
+AIN_PAYLOAD = {
+    "keyword": "medecin-generaliste",
+    "location": {"place": {
+        "id": 15297, "placeId": "ChIJ6WS-4x1Yi0cRgCW55CqrCAM", "name": "Ain", "slug": "ain", "country": "fr",
+        "viewport": {"northeast": {"lat": 46.519953, "lng": 6.1701981},
+                     "southwest": {"lat": 45.611093, "lng": 4.7280671}},
+        "type": "administrativeArea", "zipcodes": ["01"], "gpsPoint": {"lat": 46.2475706, "lng": 5.1307681},
+    }},
+    "filters": {},
+}
+
+
+@pytest.mark.parametrize('provider, expected', CASES.values(), ids=CASES.keys())
+def test_extract_doctor_data(provider, expected):
+    record = extract_doctor_data(provider, DEPARTMENT_ID)
+    assert record == expected
+    assert tuple(record) == DOCTOR_FIELDS
+
+
+def test_extract_doctor_columns_matches_records():
+    providers = [provider for provider, _ in CASES.values()]
+    expected = {field: [record[field] for _, record in CASES.values()] for field in DOCTOR_FIELDS}
+    assert extract_doctor_columns(providers, DEPARTMENT_ID) == expected
+    assert extract_doctor_columns([], DEPARTMENT_ID) == {field: [] for field in DOCTOR_FIELDS}
+
+
+def test_extract_department_data():
+    assert extract_department_data(AIN_PAYLOAD) == {
+        'name': 'Ain', 'doctolib_id': 15297, 'place_id': 'ChIJ6WS-4x1Yi0cRgCW55CqrCAM',
+        'latitude': 46.2475706, 'longitude': 5.1307681,
+        'viewport_ne_lat': 46.519953, 'viewport_ne_lng': 6.1701981,
+        'viewport_sw_lat': 45.611093, 'viewport_sw_lng': 4.7280671,
+        'zipcodes': ['01'], 'type': 'administrativeArea',
+    }
+
+
+def test_extract_department_data_optional_and_required_keys():
+    place = {key: value for key, value in AIN_PAYLOAD['location']['place'].items()
+             if key not in ('placeId', 'zipcodes')}
+    record = extract_department_data({'location': {'place': place}})
+    assert (record['place_id'], record['zipcodes']) == (None, [])
+
+    del place['gpsPoint']
+    with pytest.raises(KeyError):
+        extract_department_data({'location': {'place': place}})
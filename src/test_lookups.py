@@ -0,0 +1,81 @@
+# src/test_lookups.py
+"""Lookup ids resolved inside the saving transaction, next to the columns they encode"""
+import os
+import sys
+
+sys.path.append(os.path.dirname(__file__))
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, create_db_engine
+from base_scraper import BaseDoctolibScraper
+from data_processors import extract_doctor_data
+from lookups import LANGUAGES, LookupCache, from_mask
+from models import City, Doctor, Specialty
+
+PROVIDER = {
+    'id': 'profile-1', 'firstName': 'Jean', 'name': 'Martin', 'regulationSector': 'contracted_1',
+    'speciality': {'name': 'Dentiste', 'slug': 'dentiste'}, 'languages': ['gb', 'fr'],
+    'location': {'city': 'Lyon', 'zipcode': '69003'},
+}
+
+
+class Scraper(BaseDoctolibScraper):
+    def search_doctors(self, specialty, department, max_pages=2):
+        return []
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    bind = create_db_engine(f"sqlite:///{tmp_path / 'lookups.db'}", 'serving')
+    Base.metadata.create_all(bind=bind)
+    return sessionmaker(autocommit=False, autoflush=False, bind=bind)
+
+
+def test_rolled_back_lookups_are_not_cached(session_factory):
+    cache = LookupCache()
+    db = session_factory()
+    try:
+        doctor = extract_doctor_data(PROVIDER, None)
+        cache.resolve([doctor], db)
+        db.rollback()
+        assert db.query(Specialty).count() == 0
+
+        # Created again in the next transaction, not served from the cache
+        again = extract_doctor_data(PROVIDER, None)
+        cache.resolve([again], db)
+        db.commit()
+        assert db.get(Specialty, again['specialty_id']).slug == 'dentiste'
+        assert db.get(City, again['city_id']).name == 'Lyon'
+    finally:
+        db.close()
+
+    # Committed ids are shared with other sessions without a query
+    statements = []
+    event.listen(session_factory.kw['bind'], 'before_cursor_execute',
+                 lambda connection, cursor, statement, *args: statements.append(statement))
+    other = session_factory()
+    try:
+        doctor = extract_doctor_data(PROVIDER, None)
+        cache.resolve([doctor], other)
+        assert doctor['specialty_id'] == again['specialty_id']
+        assert statements == []
+    finally:
+        other.close()
+
+
+def test_bulk_save_keeps_the_encoded_columns(session_factory):
+    db = session_factory()
+    try:
+        assert Scraper().save_doctors_bulk([extract_doctor_data(PROVIDER, None)], db) == 1
+        doctor = db.query(Doctor).one()
+        assert (doctor.specialty, doctor.regulation_sector, doctor.city) == ('Dentiste', 'contracted_1', 'Lyon')
+        assert doctor.languages == ['gb', 'fr']
+        assert doctor.specialty_ref.name == 'Dentiste'
+        assert doctor.regulation_sector_ref.code == 'contracted_1'
+        assert doctor.city_ref.name == 'Lyon'
+        assert from_mask(doctor.languages_mask, LANGUAGES) == ['fr', 'gb']
+    finally:
+        db.close()
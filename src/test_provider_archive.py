@@ -0,0 +1,59 @@
+# src/test_provider_archive.py
+"""Rebuilding doctors from the raw provider archive"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.dirname(__file__))
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, create_db_engine
+from base_scraper import BaseDoctolibScraper
+from data_processors import extract_doctor_data
+from models import Doctor
+from presence import mark_removed
+from provider_archive import ProviderArchive, rebuild
+
+DEPARTMENT_ID = 69
+STALE_FINGERPRINT = '00' * 16
+PROVIDER = {
+    'id': 'profile-1', 'firstName': 'Jean', 'name': 'Martin', 'regulationSector': 'contracted_1',
+    'speciality': {'name': 'Dentiste', 'slug': 'dentiste'}, 'location': {'city': 'Lyon', 'zipcode': '69003'},
+}
+
+
+class Scraper(BaseDoctolibScraper):
+    def search_doctors(self, specialty, department, max_pages=2):
+        return []
+
+
+@pytest.mark.parametrize('stale_fingerprint', [False, True], ids=['unchanged', 'changed'])
+def test_rebuild_keeps_removed_doctors_removed(tmp_path, stale_fingerprint):
+    bind = create_db_engine(f"sqlite:///{tmp_path / 'doctors.db'}", 'serving')
+    Base.metadata.create_all(bind=bind)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=bind)()
+    archive = ProviderArchive(str(tmp_path / 'archive.db'))
+    try:
+        archive.add('dentiste', DEPARTMENT_ID, [PROVIDER])
+        scraper = Scraper()
+        assert scraper.save_doctors_bulk([extract_doctor_data(PROVIDER, DEPARTMENT_ID)], db) == 1
+        # A later complete crawl no longer returned the doctor
+        assert mark_removed(db, 'dentiste', DEPARTMENT_ID, datetime.now(timezone.utc) + timedelta(minutes=1)) == 1
+        doctor = db.query(Doctor).one()
+        if stale_fingerprint:
+            # As after a mapping fix: the rebuild rewrites the row
+            doctor.fingerprint = STALE_FINGERPRINT
+            db.commit()
+        removed_at, last_seen = doctor.removed_at, doctor.last_seen
+
+        assert rebuild(archive, db, scraper, processes=1) == (1 if stale_fingerprint else 0)
+        db.expire_all()
+        doctor = db.query(Doctor).one()
+        assert doctor.is_active is False
+        assert (doctor.removed_at, doctor.last_seen) == (removed_at, last_seen)
+        assert doctor.fingerprint != STALE_FINGERPRINT
+    finally:
+        archive.close()
+        db.close()
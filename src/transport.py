@@ -0,0 +1,273 @@
+# src/transport.py
+"""
+Record-and-replay transport for the Doctolib search API.
+
+ResponseRecorder appends every raw /phs_proxy/raw exchange (request body, page,
+status, latency, response body) to gzip-compressed, append-only segment files.
+ReplayTransport reads those segments back and answers the same requests with no
+network, optionally reproducing the recorded latencies - a drop-in for
+requests.Session.post in DoctolibScraper, and understood by the async engine.
+
+Each exchange is its own gzip member (a segment is still one valid gzip file), so
+replay only keeps an index of where every exchange starts and decompresses a
+response body when it is asked for - memory does not grow with the recording.
+Segments recorded as a single member still replay, decompressed from their start
+on every lookup.
+"""
+import asyncio
+import base64
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from response_cache import make_cache_key
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PATTERN = "segment-{:05d}.jsonl.gz"
+_READ_SIZE = 64 * 1024
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+# What replay keeps of an exchange until its body is needed
+_INDEXED_FIELDS = ('status', 'latency', 'headers', 'page', 'specialty', 'place_id', 'place_name')
+
+
+def _page_from_url(url: str) -> int:
+    return int(parse_qs(urlparse(url).query).get('page', ['0'])[0])
+
+
+def _request_metadata(body: bytes) -> Dict:
+    """Specialty and department of a search payload, for browsing recordings"""
+    try:
+        payload = json.loads(body)
+        place = payload.get('location', {}).get('place', {})
+        return {'specialty': payload.get('keyword'), 'place_id': place.get('id'), 'place_name': place.get('name')}
+    except (ValueError, AttributeError):
+        return {}
+
+
+class ResponseRecorder:
+    """Appends raw search exchanges to rolling gzip segment files"""
+
+    def __init__(self, directory: str = "recordings", segment_max_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.records_written = 0
+        os.makedirs(directory, exist_ok=True)
+
+        existing = sorted(glob.glob(os.path.join(directory, "segment-*.jsonl.gz")))
+        # Never reopen an old segment - each run starts a fresh one so existing files stay immutable
+        self._segment_index = len(existing)
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _open_next_segment(self):
+        self._close_segment()
+        self._segment_index += 1
+        path = os.path.join(self.directory, SEGMENT_PATTERN.format(self._segment_index))
+        self._file = open(path, 'ab')
+        logger.info(f"Recording responses to {path}")
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def record(self, url: str, body: bytes, status: Optional[int], latency: float,
+               response_body: Optional[bytes], headers: Optional[Dict] = None):
+        """Append one request/response exchange"""
+        entry = {
+            'recorded_at': time.time(),
+            'url': url,
+            'page': _page_from_url(url),
+            'key': make_cache_key(body, _page_from_url(url)),
+            'request': body.decode('utf-8'),
+            'status': status,
+            'latency': round(latency, 4),
+            'headers': {k: v for k, v in (headers or {}).items() if k.lower() in ('retry-after', 'content-type')},
+        }
+        if response_body is not None:
+            try:
+                entry['response'] = response_body.decode('utf-8')
+            except UnicodeDecodeError:
+                # Bodies are JSON text in practice; base64 keeps the format safe for anything else
+                entry['response_b64'] = base64.b64encode(response_body).decode('ascii')
+        entry.update(_request_metadata(body))
+        # One gzip member per exchange, so replay can decompress it on its own
+        member = gzip.compress((json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8'))
+
+        with self._lock:
+            if self._file is None or self._file.tell() >= self.segment_max_bytes:
+                self._open_next_segment()
+            self._file.write(member)
+            self.records_written += 1
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+
+
+class _Location(NamedTuple):
+    """Where a recorded exchange is: its line starts line_offset bytes into the gzip member at member_offset"""
+    path: str
+    member_offset: int
+    line_offset: int
+
+
+def _scan_segment(path: str) -> Iterator[Tuple[_Location, bytes]]:
+    """Every line of a segment with its location, member by member"""
+    with open(path, 'rb') as f:
+        decompressor = zlib.decompressobj(_GZIP_WBITS)
+        member_offset = line_offset = 0
+        pending = b''
+        data = f.read(_READ_SIZE)
+        fed = len(data)  # Compressed bytes read so far
+        try:
+            while data:
+                pending += decompressor.decompress(data)
+                start = 0
+                while True:
+                    end = pending.find(b'\n', start)
+                    if end == -1:
+                        break
+                    yield _Location(path, member_offset, line_offset), pending[start:end]
+                    line_offset += end + 1 - start
+                    start = end + 1
+                pending = pending[start:]
+                if decompressor.eof:
+                    # The next member starts right after this one
+                    data = decompressor.unused_data
+                    member_offset = fed - len(data)
+                    decompressor = zlib.decompressobj(_GZIP_WBITS)
+                    line_offset, pending = 0, b''
+                    if data:
+                        continue
+                data = f.read(_READ_SIZE)
+                fed += len(data)
+        except zlib.error as e:
+            logger.warning(f"Segment {path} is corrupt ({e}), stopping at the last complete record")
+            return
+        if member_offset < fed:
+            # A crashed run leaves a truncated final member - keep everything before it
+            logger.warning(f"Segment {path} is truncated, stopping at the last complete record")
+
+
+def _read_line(location: _Location) -> bytes:
+    """The recorded line at location, decompressing no further than its end"""
+    decompressor = zlib.decompressobj(_GZIP_WBITS)
+    skip = location.line_offset
+    line = b''
+    with open(location.path, 'rb') as f:
+        f.seek(location.member_offset)
+        while not decompressor.eof:
+            chunk = f.read(_READ_SIZE)
+            if not chunk:
+                break
+            data = decompressor.decompress(chunk)
+            if skip:
+                if len(data) <= skip:
+                    skip -= len(data)
+                    continue
+                data, skip = data[skip:], 0
+            end = data.find(b'\n')
+            if end != -1:
+                return line + data[:end]
+            line += data
+    return line
+
+
+def _scan_recordings(directory: str) -> Iterator[Tuple[_Location, Dict]]:
+    for path in sorted(glob.glob(os.path.join(directory, "segment-*.jsonl.gz"))):
+        for location, line in _scan_segment(path):
+            if line.strip():
+                yield location, json.loads(line)
+
+
+def iter_recordings(directory: str) -> Iterator[Dict]:
+    """Yield every recorded exchange in segment order"""
+    for _, entry in _scan_recordings(directory):
+        yield entry
+
+
+@dataclass
+class ReplayResponse:
+    """The parts of requests.Response the scraper uses"""
+    status_code: int
+    content: bytes = b''
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+class ReplayTransport:
+    """Answers search requests from a recording directory instead of the network"""
+
+    def __init__(self, directory: str = "recordings", reproduce_latency: bool = False, speed: float = 1.0):
+        self.directory = directory
+        self.reproduce_latency = reproduce_latency
+        self.speed = speed
+        self.replayed = 0
+        self.missing = 0
+        # Request key -> where the exchange is, and what it is without its bodies
+        self._index: Dict[str, Tuple[_Location, Dict]] = {}
+
+        for location, entry in _scan_recordings(directory):
+            # The last recording of a request wins, like a re-fetch would
+            self._index[entry['key']] = (location, {name: entry.get(name) for name in _INDEXED_FIELDS})
+        logger.info(f"Indexed {len(self._index)} recorded responses from {directory}")
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def entries(self) -> Iterator[Dict]:
+        """The replayable exchanges, without their request and response bodies"""
+        return (entry for _, entry in self._index.values())
+
+    def _lookup(self, url: str, data: bytes):
+        indexed = self._index.get(make_cache_key(data, _page_from_url(url)))
+        if indexed is None:
+            self.missing += 1
+            logger.warning(f"No recording for {url}")
+            return ReplayResponse(status_code=404), 0.0
+
+        self.replayed += 1
+        location, entry = indexed
+        recorded = json.loads(_read_line(location))
+        if recorded.get('response') is not None:
+            body = recorded['response'].encode('utf-8')
+        elif recorded.get('response_b64'):
+            body = base64.b64decode(recorded['response_b64'])
+        else:
+            body = b''
+        delay = (entry.get('latency') or 0.0) / self.speed if self.reproduce_latency and self.speed > 0 else 0.0
+        return ReplayResponse(entry.get('status') or 599, body, entry.get('headers') or {}), delay
+
+    def post(self, url: str, data: bytes = b'', **kwargs) -> ReplayResponse:
+        """Drop-in for requests.Session.post"""
+        response, delay = self._lookup(url, data)
+        if delay:
+            time.sleep(delay)
+        return response
+
+    async def post_async(self, url: str, data: bytes = b'') -> ReplayResponse:
+        """Asyncio version of post(), used by the fetch engine"""
+        response, delay = self._lookup(url, data)
+        if delay:
+            await asyncio.sleep(delay)
+        return response
@@ -1,21 +1,26 @@
 # src/verify_data.py
+from sqlalchemy import func
+
 from database import SessionLocal
 from models import Doctor
+from queries import DoctorFilter, find_doctors
 
 def verify_new_fields():
     """Verify that new fields are being stored correctly"""
     db = SessionLocal()
     try:
-        doctors = db.query(Doctor).all()
+        # Counted by the database - no doctor is loaded just to be counted
+        by_accepting = dict(db.query(Doctor.accepts_new_patients, func.count(Doctor.id))
+                            .group_by(Doctor.accepts_new_patients))
 
         print("VERIFYING NEW FIELDS")
         print("=" * 50 )
 
         # Number of doctors accepting/not accepting new patients
-        accepting_count = sum(1 for doctor in doctors if doctor.accepts_new_patients)
-        not_accepting_count = sum(1 for doctor in doctors if not doctor.accepts_new_patients)
-
-        unknown_count = len(doctors) - accepting_count - not_accepting_count
+        accepting_count = by_accepting.get(True, 0)
+        # Null counts as not accepting, like `not doctor.accepts_new_patients` did
+        not_accepting_count = by_accepting.get(False, 0) + by_accepting.get(None, 0)
+        unknown_count = sum(by_accepting.values()) - accepting_count - not_accepting_count
 
         print("ACCEPTING NEW PATIENTS STATS: ")
         print(f"Accepting: {accepting_count} doctors")
@@ -25,9 +30,12 @@ def verify_new_fields():
 
         # Show regulation sectors
         regulation_sectors = {}
-        for doctor in doctors:
-            sector = doctor.regulation_sector or 'unknown'
-            regulation_sectors[sector] = regulation_sectors.get(sector, 0) + 1
+        # Listed in order of first appearance, like the per-doctor loop this replaced
+        sector_counts = db.query(Doctor.regulation_sector, func.count(Doctor.id)).group_by(
+            Doctor.regulation_sector).order_by(func.min(Doctor.id))
+        for sector, count in sector_counts:
+            sector = sector or 'unknown'
+            regulation_sectors[sector] = regulation_sectors.get(sector, 0) + count
 
         print("REGULATION SECTORS:")
         for sector, count in regulation_sectors.items():
@@ -38,13 +46,14 @@ def verify_new_fields():
         print("SAMPLE DOCTORS")
         print("-" * 30)
 
-        for doctor in doctors[:5]:
+        sample_columns = (Doctor.last_name, Doctor.accepts_new_patients, Doctor.regulation_sector, Doctor.city)
+        for doctor in find_doctors(db, DoctorFilter(active_only=False), sample_columns, limit=5):
             print(f"Dr. {doctor.last_name}")
             print(f"  Accepts new patients: {doctor.accepts_new_patients}")
             print(f"  Regulation sector: {doctor.regulation_sector}")
             print(f"  City: {doctor.city}")
             print()
-            
+
     finally:
         db.close()
 
@@ -0,0 +1,170 @@
+# src/work_queue.py
+"""
+Lease-based work queue for crawling from several machines at once.
+
+Work units are the crawl_tasks rows (one per specialty, department and page) in the
+shared database - SQLite for local multi-process runs, PostgreSQL (DATABASE_URL)
+across machines. A worker leases a task for lease_seconds and keeps the lease alive
+with heartbeats; if the worker dies, the lease expires and the task is handed out
+again. Claims are compare-and-set UPDATEs, so two workers never get the same task.
+
+Enqueued searches join the current crawl run (see checkpoints.current_run): once a
+run is over, enqueueing the same searches starts the next pass instead of being
+refused as already done. Workers claim from, and wait on, one run at a time - the
+leftovers of an older run do not hold up the current one.
+"""
+import logging
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import CrawlTask
+from checkpoints import current_run, retry_delay
+
+logger = logging.getLogger(__name__)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseWorkQueue:
+    """Claims, heartbeats and completes crawl tasks on behalf of one worker"""
+
+    def __init__(self, db: Session, worker_id: Optional[str] = None, lease_seconds: float = 120.0,
+                 max_attempts: int = 5, backoff_base: float = 30.0, backoff_max: float = 3600.0,
+                 run_id: Optional[int] = None):
+        self.db = db
+        self.run_id = run_id  # Run enqueued into and claimed from - the current run when None
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def enqueue(self, specialty: str, department_id: int, page: int = 0, run_id: Optional[int] = None) -> bool:
+        """Add a pending task to a run unless the run already has it - returns True if it was added
+
+        Follow-up pages pass the run of the page that found them; new searches go to the current run.
+        """
+        if run_id is None:
+            run_id = self._run()
+        exists = self.db.query(CrawlTask.id).filter(
+            CrawlTask.run_id == run_id,
+            CrawlTask.specialty == specialty,
+            CrawlTask.department_id == department_id,
+            CrawlTask.page == page,
+        ).first()
+        if exists:
+            return False
+        try:
+            self.db.add(CrawlTask(run_id=run_id, specialty=specialty, department_id=department_id, page=page,
+                                  status=CrawlTask.PENDING))
+            self.db.commit()
+            return True
+        except IntegrityError:
+            # Another worker enqueued the same page between our check and our insert
+            self.db.rollback()
+            return False
+
+    def _run(self) -> int:
+        if self.run_id is None:
+            self.run_id = current_run(self.db)
+        return self.run_id
+
+    def _claimable(self, now: datetime):
+        return and_(CrawlTask.run_id == self._run(), or_(
+            CrawlTask.status == CrawlTask.PENDING,
+            and_(CrawlTask.status == CrawlTask.FAILED,
+                 or_(CrawlTask.next_attempt_at.is_(None), CrawlTask.next_attempt_at <= now)),
+            # A dead worker's lease ran out - the task is up for grabs again
+            and_(CrawlTask.status == CrawlTask.IN_FLIGHT, CrawlTask.lease_expires_at < now),
+        ))
+
+    def claim(self, limit: int = 1) -> List[CrawlTask]:
+        """Lease up to `limit` tasks for this worker"""
+        now = datetime.now(timezone.utc)
+        # SKIP LOCKED keeps PostgreSQL workers off each other's rows; SQLite ignores it
+        candidates = self.db.query(CrawlTask.id).filter(self._claimable(now)).order_by(
+            CrawlTask.page, CrawlTask.id
+        ).limit(limit * 4).with_for_update(skip_locked=True).all()
+
+        claimed_ids = []
+        for (task_id,) in candidates:
+            if len(claimed_ids) >= limit:
+                break
+            # Compare-and-set: only succeeds if nobody claimed the row since we read it
+            updated = self.db.query(CrawlTask).filter(CrawlTask.id == task_id, self._claimable(now)).update({
+                CrawlTask.status: CrawlTask.IN_FLIGHT,
+                CrawlTask.lease_owner: self.worker_id,
+                CrawlTask.lease_expires_at: now + timedelta(seconds=self.lease_seconds),
+            }, synchronize_session=False)
+            if updated:
+                claimed_ids.append(task_id)
+        self.db.commit()
+
+        if not claimed_ids:
+            return []
+        return self.db.query(CrawlTask).filter(CrawlTask.id.in_(claimed_ids)).order_by(CrawlTask.id).all()
+
+    def heartbeat(self, task_ids: List[int]) -> int:
+        """Extend this worker's leases - returns how many are still ours"""
+        if not task_ids:
+            return 0
+        renewed = self.db.query(CrawlTask).filter(
+            CrawlTask.id.in_(task_ids),
+            CrawlTask.lease_owner == self.worker_id,
+            CrawlTask.status == CrawlTask.IN_FLIGHT,
+        ).update({
+            CrawlTask.lease_expires_at: datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds),
+        }, synchronize_session=False)
+        self.db.commit()
+        return renewed
+
+    def complete(self, task: CrawlTask, doctors_found: int, total_results: Optional[int] = None) -> bool:
+        """Mark a leased task done - False if the lease was lost to another worker meanwhile"""
+        return self._finish(task, {
+            CrawlTask.status: CrawlTask.DONE,
+            CrawlTask.last_status: 200,
+            CrawlTask.last_error: None,
+            CrawlTask.doctors_found: doctors_found,
+            CrawlTask.total_results: total_results,
+            CrawlTask.completed_at: datetime.now(timezone.utc),
+        })
+
+    def fail(self, task: CrawlTask, status: Optional[int] = None, error: Optional[str] = None) -> bool:
+        """Release a leased task for a later retry with backoff, or bury it after max_attempts"""
+        attempts = (task.attempts or 0) + 1
+        values = {CrawlTask.attempts: attempts, CrawlTask.last_status: status, CrawlTask.last_error: error}
+        if attempts >= self.max_attempts:
+            values.update({CrawlTask.status: CrawlTask.DEAD, CrawlTask.next_attempt_at: None})
+        else:
+            delay = retry_delay(attempts, self.backoff_base, self.backoff_max)
+            values.update({
+                CrawlTask.status: CrawlTask.FAILED,
+                CrawlTask.next_attempt_at: datetime.now(timezone.utc) + timedelta(seconds=delay),
+            })
+        return self._finish(task, values)
+
+    def _finish(self, task: CrawlTask, values) -> bool:
+        values.update({CrawlTask.lease_owner: None, CrawlTask.lease_expires_at: None})
+        updated = self.db.query(CrawlTask).filter(
+            CrawlTask.id == task.id,
+            CrawlTask.lease_owner == self.worker_id,
+        ).update(values, synchronize_session=False)
+        self.db.commit()
+        if not updated:
+            logger.warning(f"Lost the lease on task {task.id} before finishing it")
+        return bool(updated)
+
+    def outstanding(self) -> int:
+        """Tasks of the run that are not finished yet (pending, leased, or waiting for a retry)"""
+        return self.db.query(CrawlTask.id).filter(
+            CrawlTask.run_id == self._run(),
+            CrawlTask.status.in_([CrawlTask.PENDING, CrawlTask.IN_FLIGHT, CrawlTask.FAILED])
+        ).count()
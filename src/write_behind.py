@@ -0,0 +1,174 @@
+# src/write_behind.py
+"""
+Write-behind persistence for scraped doctors.
+
+Fetchers hand extracted doctor dicts to a WriteBehindWriter and go straight back to
+the network; a dedicated writer thread drains the queue and upserts them in batches
+(every batch_size doctors, or every flush_interval seconds, whichever comes first).
+The queue is bounded, so when the database falls behind, put_page() blocks and the
+fetchers slow down to the writer's pace instead of piling pages up in memory.
+
+A batch counts as failed when it raises or when fewer doctors were saved than it
+held; the on_committed callbacks of its pages never run, so nothing downstream
+(checkpoints, disappearance detection) takes those pages for saved.
+"""
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session, sessionmaker
+
+logger = logging.getLogger(__name__)
+
+WriteBatch = Callable[[List[Dict], Session], int]
+OnCommitted = Callable[[Session], None]
+
+_STOP = object()
+
+
+class CommitTracker:
+    """Counts the pages put on a writer and the ones it committed - they only match if no batch failed"""
+
+    def __init__(self):
+        self.queued = 0
+        self.committed = 0
+        self._lock = threading.Lock()
+
+    def track(self, on_committed: Optional[OnCommitted] = None) -> OnCommitted:
+        """on_committed for put_page that also counts the page, for one page"""
+        self.queued += 1
+
+        def committed(db: Session):
+            with self._lock:
+                self.committed += 1
+            if on_committed is not None:
+                on_committed(db)
+        return committed
+
+    @property
+    def all_committed(self) -> bool:
+        return self.committed == self.queued
+
+
+class WriteBehindWriter:
+    """Bounded queue of doctor pages drained by one writer thread with its own session"""
+
+    def __init__(self, write_batch: WriteBatch, session_factory: Callable[[], Session],
+                 batch_size: int = 500, flush_interval: float = 1.0, max_pending_pages: int = 32):
+        self.write_batch = write_batch
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.blocked_seconds = 0.0
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending_pages)
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._closed = False
+        self._thread.start()
+
+    @classmethod
+    def for_session(cls, write_batch: WriteBatch, db: Session, **kwargs) -> "WriteBehindWriter":
+        """A writer on the same database as an existing session"""
+        return cls(write_batch, sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind()), **kwargs)
+
+    def put_page(self, doctors: List[Dict], on_committed: Optional[OnCommitted] = None):
+        """Queue a page of extracted doctors - blocks while the writer is max_pending_pages behind
+
+        on_committed runs on the writer thread, with the writer's session, once the
+        page's doctors are committed (e.g. to checkpoint the page).
+        """
+        if self._closed:
+            raise RuntimeError("WriteBehindWriter is closed")
+        if not self._thread.is_alive():
+            raise RuntimeError("Write-behind thread died, doctors can no longer be saved")
+        started = time.monotonic()
+        self._queue.put((doctors, on_committed))
+        self.blocked_seconds += time.monotonic() - started
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def flush(self):
+        """Wait until every page queued so far is committed"""
+        self._queue.join()
+
+    def close(self):
+        """Flush the remaining pages and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        logger.info(f"Write-behind writer closed: {self.summary()}")
+
+    def summary(self) -> str:
+        return (f"{self.written} doctors in {self.batches} batches ({self.errors} failed), "
+                f"queue peaked at {self.max_depth} pages, fetchers blocked {self.blocked_seconds:.1f}s")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        db = self.session_factory()
+        pending: List[Dict] = []
+        callbacks: List[OnCommitted] = []
+        taken = 0  # queue items behind `pending`, acknowledged once they are written
+        deadline = None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                stopping = item is _STOP
+                if item is not None and not stopping:
+                    doctors, on_committed = item
+                    pending.extend(doctors)
+                    if on_committed is not None:
+                        callbacks.append(on_committed)
+                    taken += 1
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+
+                due = deadline is not None and time.monotonic() >= deadline
+                if taken and (stopping or due or len(pending) >= self.batch_size):
+                    self._write(db, pending, callbacks)
+                    for _ in range(taken):
+                        self._queue.task_done()
+                    pending, callbacks, taken, deadline = [], [], 0, None
+
+                if stopping:
+                    self._queue.task_done()
+                    break
+        finally:
+            db.close()
+
+    def _write(self, db: Session, doctors: List[Dict], callbacks: List[OnCommitted]):
+        try:
+            written = self.write_batch(doctors, db)
+            self.written += written
+            self.batches += 1
+            # The batch functions log and skip doctors they fail to save rather than raise
+            expected = len({doctor.get('doctolib_id') for doctor in doctors})
+            if written < expected:
+                self.errors += 1
+                logger.error(f"Write-behind batch saved only {written} of {expected} doctors, "
+                             f"its pages are not reported as committed")
+                return
+            # Only now are the pages' doctors committed - safe to checkpoint them
+            for on_committed in callbacks:
+                on_committed(db)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Write-behind batch of {len(doctors)} doctors failed: {e}")
+            db.rollback()